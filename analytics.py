@@ -0,0 +1,238 @@
+import threading
+import time
+from array import array
+from collections import OrderedDict
+import numpy as np
+from rank_history import NOT_RANKED_POSITION, normalize_domain
+
+# Share of clicks by organic position, used for the visibility score.
+# Position 0 stands for "Not in top results".
+CTR_BY_POSITION = np.zeros(NOT_RANKED_POSITION + 1)
+CTR_BY_POSITION[1:21] = [0.316, 0.158, 0.100, 0.070, 0.053, 0.042, 0.033, 0.027, 0.023, 0.020,
+                         0.012, 0.011, 0.010, 0.009, 0.008, 0.007, 0.006, 0.006, 0.005, 0.005]
+
+GROUP_COLUMNS = ('date', 'location', 'device')
+
+class RankFrame:
+    """Rank history rows held as NumPy columns.
+
+    Text columns are dictionary-encoded: each row stores an integer code
+    into dates, keywords, locations or devices. position is 0 for
+    "Not in top results".
+    """
+    def __init__(self, dates, keywords, locations, devices, date_codes, keyword_codes, location_codes,
+                 device_codes, positions):
+        self.dates = dates
+        self.keywords = keywords
+        self.locations = locations
+        self.devices = devices
+        self.date_codes = date_codes
+        self.keyword_codes = keyword_codes
+        self.location_codes = location_codes
+        self.device_codes = device_codes
+        self.positions = positions
+
+    def __len__(self):
+        return len(self.positions)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build a frame from (date, keyword, location_code, location_name, device, position) tuples.
+
+        Rows of one run share their date, location and device, so those are
+        encoded together as one segment code per row and split afterwards.
+        """
+        segment_index = {}
+        keyword_index = {}
+        segment_codes = array('i')
+        keyword_codes = array('i')
+        positions = array('h')
+        for check_date, keyword, location_code, location_name, device, position in rows:
+            segment_codes.append(segment_index.setdefault((check_date, location_code, location_name, device),
+                                                          len(segment_index)))
+            keyword_codes.append(keyword_index.setdefault(keyword, len(keyword_index)))
+            positions.append(position or 0)
+
+        segments = list(segment_index)
+        dates = sorted({segment[0] for segment in segments})
+        locations = sorted({(segment[1], segment[2]) for segment in segments})
+        devices = sorted({segment[3] for segment in segments})
+        date_lookup = {value: code for code, value in enumerate(dates)}
+        location_lookup = {value: code for code, value in enumerate(locations)}
+        device_lookup = {value: code for code, value in enumerate(devices)}
+        segment_dates = np.array([date_lookup[segment[0]] for segment in segments], dtype=np.int32)
+        segment_locations = np.array([location_lookup[(segment[1], segment[2])] for segment in segments], dtype=np.int32)
+        segment_devices = np.array([device_lookup[segment[3]] for segment in segments], dtype=np.int32)
+        segment_codes = np.frombuffer(segment_codes, dtype=np.int32)
+
+        return cls(
+            dates=dates,
+            keywords=list(keyword_index),
+            locations=locations,
+            devices=devices,
+            date_codes=segment_dates[segment_codes],
+            keyword_codes=np.frombuffer(keyword_codes, dtype=np.int32),
+            location_codes=segment_locations[segment_codes],
+            device_codes=segment_devices[segment_codes],
+            positions=np.frombuffer(positions, dtype=np.int16)
+        )
+
+    def date_code(self, check_date):
+        try:
+            return self.dates.index(check_date)
+        except ValueError:
+            return None
+
+    def group_codes(self, group_by):
+        """Combine the group_by columns into one integer code per row."""
+        sizes = {'date': len(self.dates), 'location': len(self.locations), 'device': len(self.devices)}
+        columns = {'date': self.date_codes, 'location': self.location_codes, 'device': self.device_codes}
+        codes = np.zeros(len(self), dtype=np.int64)
+        for column in group_by:
+            codes = codes * max(1, sizes[column]) + columns[column]
+        return codes
+
+    def describe_group(self, group_by, code):
+        """Turn a combined group code back into its column values."""
+        sizes = {'date': len(self.dates), 'location': len(self.locations), 'device': len(self.devices)}
+        group = {}
+        for column in reversed(group_by):
+            code, value = divmod(int(code), max(1, sizes[column]))
+            if column == 'date':
+                group['date'] = self.dates[value]
+            elif column == 'location':
+                group['location_code'], group['location_name'] = self.locations[value]
+            else:
+                group['device'] = self.devices[value]
+        return group
+
+def summarize(frame, group_by=('date',)):
+    """Average position, top 3/10 share and visibility for each group of rows.
+
+    Shares and visibility are over all tracked keywords in the group;
+    average position is over the keywords that ranked. Visibility is the
+    estimated click share as a percentage of ranking #1 for every keyword.
+    """
+    group_by = [column for column in GROUP_COLUMNS if column in group_by]
+    if not len(frame):
+        return []
+    codes = frame.group_codes(group_by)
+    groups, inverse = np.unique(codes, return_inverse=True)
+    positions = frame.positions
+    ranked = positions > 0
+
+    tracked = np.bincount(inverse, minlength=len(groups))
+    ranked_count = np.bincount(inverse, weights=ranked, minlength=len(groups))
+    position_sum = np.bincount(inverse, weights=positions, minlength=len(groups))
+    top3 = np.bincount(inverse, weights=ranked & (positions <= 3), minlength=len(groups))
+    top10 = np.bincount(inverse, weights=ranked & (positions <= 10), minlength=len(groups))
+    clicks = np.bincount(inverse, weights=CTR_BY_POSITION[np.minimum(positions, NOT_RANKED_POSITION)],
+                         minlength=len(groups))
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        average_position = np.where(ranked_count > 0, position_sum / ranked_count, np.nan)
+    visibility = clicks / (tracked * CTR_BY_POSITION[1]) * 100
+
+    summary = []
+    for index, code in enumerate(groups):
+        group = frame.describe_group(group_by, code)
+        group.update({
+            'keywords': int(tracked[index]),
+            'ranked': int(ranked_count[index]),
+            'average_position': None if np.isnan(average_position[index]) else round(float(average_position[index]), 2),
+            'top3_share': round(float(top3[index] / tracked[index]), 4),
+            'top10_share': round(float(top10[index] / tracked[index]), 4),
+            'visibility': round(float(visibility[index]), 2)
+        })
+        summary.append(group)
+    return summary
+
+def movement(frame, from_date, to_date):
+    """Compare two runs keyword by keyword, per location and device.
+
+    delta is the old position minus the new one (positive = improved);
+    "Not in top results" counts as NOT_RANKED_POSITION, as in the rank
+    history deltas.
+    """
+    from_code = frame.date_code(from_date)
+    to_code = frame.date_code(to_date)
+    if from_code is None or to_code is None:
+        return None
+
+    # One integer per (keyword, location, device) to match rows between runs
+    location_count = max(1, len(frame.locations))
+    device_count = max(1, len(frame.devices))
+    keys = (frame.keyword_codes.astype(np.int64) * location_count + frame.location_codes) * device_count + frame.device_codes
+    before = frame.date_codes == from_code
+    after = frame.date_codes == to_code
+    common, before_index, after_index = np.intersect1d(keys[before], keys[after], assume_unique=True, return_indices=True)
+
+    old_positions = frame.positions[before][before_index].astype(np.int32)
+    new_positions = frame.positions[after][after_index].astype(np.int32)
+    old_positions[old_positions == 0] = NOT_RANKED_POSITION
+    new_positions[new_positions == 0] = NOT_RANKED_POSITION
+    deltas = old_positions - new_positions
+    entered = (old_positions == NOT_RANKED_POSITION) & (new_positions < NOT_RANKED_POSITION)
+    dropped = (old_positions < NOT_RANKED_POSITION) & (new_positions == NOT_RANKED_POSITION)
+
+    def describe(mask):
+        count = int(mask.sum())
+        return {
+            'keywords': count,
+            'improved': int((deltas[mask] > 0).sum()),
+            'declined': int((deltas[mask] < 0).sum()),
+            'unchanged': int((deltas[mask] == 0).sum()),
+            'entered': int(entered[mask].sum()),
+            'dropped': int(dropped[mask].sum()),
+            'net_change': int(deltas[mask].sum()),
+            'average_change': round(float(deltas[mask].mean()), 2) if count else None
+        }
+
+    common_devices = common % device_count
+    common_locations = (common // device_count) % location_count
+    segments = []
+    for location_code in np.unique(common_locations):
+        for device_code in np.unique(common_devices):
+            mask = (common_locations == location_code) & (common_devices == device_code)
+            if mask.any():
+                segment = frame.describe_group(['location', 'device'], location_code * device_count + device_code)
+                segment.update(describe(mask))
+                segments.append(segment)
+
+    return dict(describe(np.ones(len(common), dtype=bool)), **{
+        'from': from_date,
+        'to': to_date,
+        'segments': segments
+    })
+
+# Frames loaded from the rank history, reused until the domain's version changes
+frame_cache = OrderedDict()
+frame_cache_lock = threading.Lock()
+FRAME_CACHE_SIZE = 8
+
+def load_frame(history, domain, start_date=None, end_date=None, location_code=None, location_name=None, device=None):
+    """Load one domain's rank history into a RankFrame. Returns (frame, load_seconds).
+
+    Frames are cached per filter set and reloaded only after new results
+    are recorded for the domain, so repeated queries skip SQLite entirely.
+    """
+    domain = normalize_domain(domain)
+    key = (domain, start_date, end_date, location_code, location_name, device)
+    version = history.get_version(domain)
+    with frame_cache_lock:
+        cached = frame_cache.get(key)
+        if cached and cached[0] == version:
+            frame_cache.move_to_end(key)
+            return cached[1], 0.0
+
+    start_time = time.perf_counter()
+    frame = RankFrame.from_rows(history.scan_positions(domain, start_date, end_date,
+                                                       location_code, location_name, device))
+    load_seconds = time.perf_counter() - start_time
+
+    with frame_cache_lock:
+        frame_cache[key] = (version, frame)
+        frame_cache.move_to_end(key)
+        while len(frame_cache) > FRAME_CACHE_SIZE:
+            frame_cache.popitem(last=False)
+    return frame, load_seconds
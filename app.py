@@ -1,85 +1,148 @@
 import os
 import json
-import tempfile
 import csv
 import io
 import threading
 import time
-import shutil
 import hashlib
-from datetime import datetime, timedelta
-from flask import Flask, request, jsonify, render_template, redirect, url_for, send_file, Response, stream_with_context
+import hmac
+import uuid
+import functools
+from flask import Flask, request, jsonify, render_template, redirect, url_for, send_file, Response, stream_with_context, make_response
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
-from client import RestClient
+from client import get_transfer_stats
 
-# Import functions from rank_checker.py
-from rank_checker import get_ranking
+# rank_checker (the fetch pipeline) is imported by the handlers that run lookups, not at app import
+from request_profiles import REQUEST_PROFILES, DEFAULT_PROFILE
+from serp_cache import serp_cache, negative_cache
+from resilience import RetryBudget
+from costs import CostBudget, cost_tracker
+from rank_history import get_rank_history
+from jobs import get_job_store, JOB_UPLOAD, JOB_POSTBACK, STATUS_COMPLETED, STATUS_FAILED
+from scheduler import get_schedule_store
+from services import start_services, get_startup_stats
+from uploads import get_upload_store
+from exporters import resolve_format, stream_export, history_row, CONTENT_TYPES
+from fetch_engine import get_fetch_engine, LANE_INTERACTIVE, LANE_BULK
+from work_queue import get_work_queue, results_page
+from worker import distributed_enabled, enqueue_csv_job
+from postbacks import get_postback_store, post_tasks, read_postback_body, handle_postback, handle_pingback, POSTBACK_TOKEN
+from credentials import get_credential_pool, make_client, POOL_FOR_ANONYMOUS
+from results import ResultBuffer, ResultRecord, row_to_dict
+from status_board import StatusBoard
+from refresh_planner import plan_refresh
+from locations import get_location_catalog, resolve_location
+from profiling import JobProfiler, profiled, stage, list_saved_profiles, load_summary, get_profile_path
 
 app = Flask(__name__, static_folder='static', static_url_path='/static')
 CORS(app)  # Enable CORS for all routes
 
-# Create a templates directory if it doesn't exist
-os.makedirs('templates', exist_ok=True)
-os.makedirs('static', exist_ok=True)
-os.makedirs('uploads', exist_ok=True)
+def new_status(**fields):
+    """A processing status for a new job, with fields overriding the defaults"""
+    return dict({
+        'is_processing': False,
+        'total_keywords': 0,
+        'processed_keywords': 0,
+        'current_keyword': '',
+        'results': ResultBuffer(),  # Most recent results in memory, older ones spilled to the job store
+        'results_total': 0,  # Results published so far; readers show the buffer up to here
+        'error': None,
+        'csv_file_path': None,
+        'original_filename': None,
+        'timestamp': int(time.time()),  # Add timestamp for cache busting
+        'device': 'desktop',  # Default device
+        'location_code': 2356,  # Default location code (India)
+        'location_name': '',  # Default location name
+        'profile': DEFAULT_PROFILE,  # Request profile (depth, rectangles, SERP features)
+        'session_id': '',  # Unique session identifier
+        'job_id': None,  # Job record in the job store
+        'upload_id': None,  # Stored file in the upload index
+        'cost': 0.0,  # API spend of the current job in USD
+        'max_cost': None,  # Budget cap of the current job
+        'estimate': None  # Pre-flight cost estimate of the current job
+    }, **fields)
+
+# Status of the dashboard job: the job thread publishes immutable snapshots
+# and request threads read them without locking
+status_board = StatusBoard(new_status())
+
+def parse_max_cost(value):
+    """Parse an optional budget cap in USD. Raises ValueError for invalid amounts."""
+    if value is None or value == '':
+        return None
+    max_cost = float(value)
+    if max_cost < 0:
+        raise ValueError("max_cost must not be negative")
+    return max_cost
+
+# Token for the /admin endpoints (X-Admin-Token header or token parameter); they are refused while it is unset
+ADMIN_TOKEN = os.environ.get('RANK_ADMIN_TOKEN')
+
+def admin_authorized():
+    token = request.headers.get('X-Admin-Token', request.args.get('token'))
+    return bool(ADMIN_TOKEN) and token is not None and hmac.compare_digest(token, ADMIN_TOKEN)
+
+def profiling_requested(value):
+    """Whether a form, query or JSON value asks for the job to be profiled"""
+    return value is True or str(value or '').lower() in ('1', 'true', 'yes', 'on')
+
+def profile_request(view):
+    """Run the view under a profiler when called with ?profiling=1; the profile ID is returned in X-Profile-Id"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not profiling_requested(request.args.get('profiling')):
+            return view(*args, **kwargs)
+        profiler = JobProfiler(f"request-{uuid.uuid4().hex}", label=request.path)
+        response = make_response(profiler.run(view, *args, **kwargs))
+        response.headers['X-Profile-Id'] = profiler.profile_id
+        response.headers['X-Profile-Url'] = url_for('get_job_profile', profile_id=profiler.profile_id)
+        return response
+    return wrapper
 
-# Function to clean up old temporary files
-def cleanup_old_files():
-    """Clean up files in the uploads directory that are older than 24 hours"""
+def credentials_missing(api_login, api_password):
+    """True when a request brings no credentials and may not fall back to the credential pool"""
+    return (not api_login or not api_password) and not (POOL_FOR_ANONYMOUS and get_credential_pool() is not None)
+
+def record_history(target_url, location_code, location_name, device, results):
+    """Append (keyword, ranking_info) results to the rank history store"""
     try:
-        uploads_dir = 'uploads'
-        current_time = datetime.now()
-        
-        # Get all files in the uploads directory
-        for filename in os.listdir(uploads_dir):
-            file_path = os.path.join(uploads_dir, filename)
-            
-            # Skip directories
-            if os.path.isdir(file_path):
-                continue
-                
-            # Get the file's modification time
-            file_mod_time = datetime.fromtimestamp(os.path.getmtime(file_path))
-            
-            # If the file is older than 24 hours, delete it
-            if current_time - file_mod_time > timedelta(hours=24):
-                os.remove(file_path)
-                print(f"Cleaned up old file: {file_path}")
+        get_rank_history().record_results(target_url, location_code, location_name, device, results)
     except Exception as e:
-        print(f"Error cleaning up old files: {e}")
+        print(f"Error recording rank history: {e}")
 
-# Start a background thread to clean up old files periodically
-def start_cleanup_thread():
-    """Start a background thread to clean up old files every hour"""
-    def cleanup_thread():
-        while True:
-            cleanup_old_files()
-            time.sleep(3600)  # Sleep for 1 hour
-    
-    thread = threading.Thread(target=cleanup_thread)
-    thread.daemon = True
-    thread.start()
+def status_result(keyword, ranking_info, device):
+    """Format one (keyword, ranking_info) result for the dashboard status"""
+    return ResultRecord.from_ranking(keyword, ranking_info, device).to_dict()
 
-# Start the cleanup thread
-start_cleanup_thread()
-
-# Global variables to track processing status
-processing_status = {
-    'is_processing': False,
-    'total_keywords': 0,
-    'processed_keywords': 0,
-    'current_keyword': '',
-    'results': [],
-    'error': None,
-    'csv_file_path': None,
-    'original_filename': None,
-    'timestamp': int(time.time()),  # Add timestamp for cache busting
-    'device': 'desktop',  # Default device
-    'location_code': 2356,  # Default location code (India)
-    'location_name': '',  # Default location name
-    'session_id': ''  # Unique session identifier
-}
+def follow_queued_job(job_id, device, generation, interval=2):
+    """Mirror a distributed job's progress and finished shards into the dashboard status"""
+    job_store = get_job_store()
+    queue = get_work_queue()
+    # Shard results stay in the queue; only the most recent are mirrored in memory
+    results = ResultBuffer()
+    merged = set()
+    try:
+        while True:
+            job = job_store.get_job(job_id)
+            # Read only the shards completed since the last pass
+            new_shards = [index for index, size in queue.completed_shards(job_id) if index not in merged]
+            for index, shard in queue.shard_results(job_id, new_shards).items():
+                for keyword, ranking_info in shard:
+                    results.append(ResultRecord.from_ranking(keyword, ranking_info, device))
+                merged.add(index)
+            fields = {'total_keywords': job['total_keywords'], 'processed_keywords': job['processed_keywords'],
+                      'cost': job['cost'], 'results': results, 'results_total': len(results)}
+            if job['status'] in (STATUS_COMPLETED, STATUS_FAILED):
+                status_board.update(generation, error=job['error'], current_keyword='Completed', **fields)
+                return
+            if not status_board.update(generation, current_keyword=f"{len(results)} keywords checked by workers", **fields):
+                return
+            time.sleep(interval)
+    except Exception as e:
+        status_board.update(generation, error=f"Error following job: {str(e)}")
+    finally:
+        status_board.update(generation, is_processing=False)
 
 @app.route('/', methods=['GET'])
 def index():
@@ -89,7 +152,7 @@ def index():
 @app.route('/status', methods=['GET'])
 def status():
     """Return the current processing status"""
-    global processing_status
+    processing_status = status_board.snapshot()
     
     # Get query parameters
     device = request.args.get('device')
@@ -100,8 +163,8 @@ def status():
     print(f"Status request received with parameters: device={device}, location_code={location_code}, location_name={location_name}, session_id={session_id}")
     print(f"Current processing status: {processing_status}")
     
-    # Create a copy of the processing status
-    status_copy = processing_status.copy()
+    # The snapshot never changes; the copy gets the request-specific fields
+    status_copy = dict(processing_status)
     
     # Add a flag to indicate if the parameters match the current processing session
     if session_id:
@@ -127,9 +190,13 @@ def status():
         status_copy['parameters_match'] = True
         print("No parameters provided, assuming match")
     
-    # Ensure results is always an array
-    if 'results' in status_copy and status_copy['results'] is not None:
-        print(f"Results count: {len(status_copy['results'])}")
+    # Only the results still in memory are sent; /jobs/<job_id>/results pages through all of them
+    results = status_copy.get('results')
+    if results is not None:
+        print(f"Results count: {status_copy['results_total']}")
+        # Only results published with this snapshot, so the list matches its counters
+        status_copy['results'] = results.recent(upto=status_copy['results_total'])
+        status_copy['results_spilled'] = results.spilled
     else:
         print("No results in status")
         status_copy['results'] = []
@@ -146,12 +213,6 @@ def status():
 @app.route('/upload', methods=['POST'])
 def upload_file():
     """Handle file upload and start processing"""
-    global processing_status
-    
-    # Check if already processing
-    if processing_status['is_processing']:
-        return jsonify({"error": "Already processing a file. Please wait."}), 400
-    
     # Reset status with new parameters
     current_timestamp = int(time.time())
     current_device = request.form.get('device', 'desktop')
@@ -163,21 +224,17 @@ def upload_file():
     location_hash = hashlib.md5(f"{current_location_code}_{current_location_name}".encode()).hexdigest()[:8]
     session_id = f"{current_timestamp}_{device_hash}_{location_hash}"
     
-    processing_status = {
-        'is_processing': False,
-        'total_keywords': 0,
-        'processed_keywords': 0,
-        'current_keyword': '',
-        'results': [],  # Initialize as empty array
-        'error': None,
-        'csv_file_path': None,
-        'original_filename': None,
-        'timestamp': current_timestamp,
-        'device': current_device,
-        'location_code': current_location_code,
-        'location_name': current_location_name,
-        'session_id': session_id
-    }
+    # Start a new status generation unless a job is still running
+    generation = status_board.reset(new_status(
+        timestamp=current_timestamp,
+        device=current_device,
+        location_code=current_location_code,
+        location_name=current_location_name,
+        profile=request.form.get('profile', DEFAULT_PROFILE),
+        session_id=session_id
+    ), unless_processing=True)
+    if generation is None:
+        return jsonify({"error": "Already processing a file. Please wait."}), 400
     
     # Get form data
     target_url = request.form.get('target_url')
@@ -187,11 +244,27 @@ def upload_file():
     location_name = request.form.get('location_name', '')  # Optional city name
     device = request.form.get('device', 'desktop')  # Default to desktop
     limit = request.form.get('limit', '')
+    profile = request.form.get('profile', DEFAULT_PROFILE)  # Request profile
+    # Shards of distributed jobs run in worker processes, so only local jobs can be profiled
+    profiling = profiling_requested(request.form.get('profiling', request.args.get('profiling'))) and not distributed_enabled()
     
     # Validate required fields
-    if not target_url or not api_login or not api_password:
+    if not target_url or credentials_missing(api_login, api_password):
         return jsonify({"error": "Missing required fields: target_url, api_login, api_password"}), 400
     
+    if profile not in REQUEST_PROFILES:
+        return jsonify({"error": f"Unknown profile '{profile}'. Available: {', '.join(REQUEST_PROFILES)}"}), 400
+    
+    try:
+        location_code, location_name = resolve_location(location_code, location_name)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    try:
+        max_cost = parse_max_cost(request.form.get('max_cost'))
+    except ValueError:
+        return jsonify({"error": "max_cost must be a non-negative amount in USD"}), 400
+    
     # Check if file was uploaded
     if 'csv_file' not in request.files:
         return jsonify({"error": "No file uploaded"}), 400
@@ -200,25 +273,21 @@ def upload_file():
     if csv_file.filename == '':
         return jsonify({"error": "No file selected"}), 400
     
-    # Save the uploaded file with a unique name to prevent conflicts
+    # Keep the original filename for display and downloads
     original_filename = secure_filename(csv_file.filename)
     
-    # Create a unique identifier based on all parameters
+    # Session identifier based on all parameters
     timestamp = int(time.time())
     device_hash = hashlib.md5(device.encode()).hexdigest()[:8]
     location_hash = hashlib.md5(f"{location_code}_{location_name}".encode()).hexdigest()[:8]
     
-    # Create a unique filename that includes parameter hashes
-    unique_filename = f"{timestamp}_{device_hash}_{location_hash}_{original_filename}"
-    file_path = os.path.join('uploads', unique_filename)
-    csv_file.save(file_path)
+    # Store the file under a unique ID in the upload index
+    upload = get_upload_store().store_file(csv_file, original_filename)
+    file_path = upload['path']
     
     # Store the original filename and parameters for display purposes
-    processing_status['original_filename'] = original_filename
-    processing_status['device'] = device
-    processing_status['location_code'] = location_code
-    processing_status['location_name'] = location_name
-    processing_status['session_id'] = f"{timestamp}_{device_hash}_{location_hash}"
+    status_board.update(generation, original_filename=original_filename, device=device, location_code=location_code,
+                        location_name=location_name, session_id=f"{timestamp}_{device_hash}_{location_hash}")
     
     # Convert limit to int if provided
     if limit and limit.isdigit():
@@ -226,23 +295,56 @@ def upload_file():
     else:
         limit = None
     
-    # Start processing in a background thread
-    processing_status['is_processing'] = True
-    processing_status['csv_file_path'] = file_path
-    
-    thread = threading.Thread(
-        target=process_csv_file,
-        args=(file_path, target_url, api_login, api_password, int(location_code), limit, location_name, device)
+    # Record the job so it is visible through the job APIs
+    job_id = get_job_store().create_job(
+        JOB_UPLOAD,
+        params={'target_url': target_url, 'location_code': int(location_code), 'location_name': location_name,
+                'device': device, 'profile': profile, 'limit': limit, 'profiling': profiling},
+        csv_file_path=file_path,
+        original_filename=original_filename,
+        max_cost=max_cost
     )
+    get_upload_store().attach_job(upload['id'], job_id)
+    
+    # Start processing in a background thread, unless another upload started a job in the meantime
+    results = ResultBuffer(job_id, store=get_job_store())
+    if not status_board.claim(generation, csv_file_path=file_path, job_id=job_id, upload_id=upload['id'],
+                              results=results, max_cost=max_cost):
+        get_job_store().finish_job(job_id, error="Another file was uploaded at the same time")
+        return jsonify({"error": "Already processing a file. Please wait."}), 400
+    
+    if distributed_enabled():
+        # Shards go to the work queue and worker.py processes run them; this thread only follows progress
+        try:
+            enqueue_csv_job(job_id, file_path, target_url, api_login, api_password, int(location_code), limit,
+                            location_name, device, profile, max_cost)
+        except ValueError as e:
+            get_job_store().finish_job(job_id, error=str(e))
+            status_board.update(generation, is_processing=False, error=str(e))
+            return jsonify({"error": str(e)}), 400
+        thread = threading.Thread(target=follow_queued_job, args=(job_id, device, generation))
+    else:
+        # An opted-in job is profiled on its own thread and on the fetch workers running its lookups
+        profiler = JobProfiler(job_id, label=original_filename) if profiling else None
+        thread = threading.Thread(
+            target=profiled(profiler, process_csv_file),
+            args=(file_path, target_url, api_login, api_password, int(location_code), limit, location_name, device, profile, job_id, max_cost, generation),
+            kwargs={'results': results, 'upload_id': upload['id']}
+        )
     thread.daemon = True
     thread.start()
     
-    return jsonify({"message": "File uploaded and processing started", "status_url": url_for('status')}), 200
+    response = {"message": "File uploaded and processing started", "status_url": url_for('status'),
+                "job_id": job_id, "job_url": url_for('get_job', job_id=job_id),
+                "download_url": url_for('download_api_file', file_id=upload['id'])}
+    if profiling:
+        response['profile_url'] = url_for('get_job_profile', profile_id=job_id)
+    return jsonify(response), 200
 
 @app.route('/download', methods=['GET'])
 def download_file():
     """Download the processed CSV file"""
-    global processing_status
+    processing_status = status_board.snapshot()
     
     if not processing_status['csv_file_path'] or not os.path.exists(processing_status['csv_file_path']):
         return jsonify({"error": "No processed file available"}), 404
@@ -281,28 +383,24 @@ def download_file():
 
 @app.route('/download-api/<file_id>', methods=['GET'])
 def download_api_file(file_id):
-    """Download a file by ID (filename)"""
-    file_path = os.path.join('uploads', file_id)
+    """Download a stored file by its ID in the upload index"""
+    upload = get_upload_store().get_upload(file_id)
     
-    if not os.path.exists(file_path):
+    if not upload or not os.path.exists(upload['path']):
         return jsonify({"error": "File not found"}), 404
     
     try:
         # Read the file content into memory
-        with open(file_path, 'rb') as f:
+        with open(upload['path'], 'rb') as f:
             file_content = f.read()
         
         # Create a BytesIO object from the file content
         file_stream = io.BytesIO(file_content)
         file_stream.seek(0)
         
-        # Use a more user-friendly filename if available
-        global processing_status
-        display_filename = processing_status.get('original_filename', file_id)
-        
         # Set explicit headers for file download
         headers = {
-            'Content-Disposition': f'attachment; filename="{display_filename}"',
+            'Content-Disposition': f'attachment; filename="{upload["original_filename"]}"',
             'Content-Type': 'text/csv',
             'Cache-Control': 'no-cache, no-store, must-revalidate',
             'Pragma': 'no-cache',
@@ -321,12 +419,525 @@ def download_api_file(file_id):
         print(f"Error downloading API file: {e}")
         return jsonify({"error": f"Error downloading file: {str(e)}"}), 500
 
+@app.route('/uploads', methods=['GET'])
+def list_uploads():
+    """List stored files, newest first. Optional filters: job_id, limit"""
+    uploads = get_upload_store().list_uploads(
+        job_id=request.args.get('job_id'),
+        limit=request.args.get('limit', 50, type=int)
+    )
+    for upload in uploads:
+        upload['download_url'] = url_for('download_api_file', file_id=upload['id'])
+        del upload['path']
+    return jsonify({"uploads": uploads}), 200
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     return jsonify({"status": "healthy"}), 200
 
+@app.route('/profiles', methods=['GET'])
+def list_profiles():
+    """List the request profiles with their measured response size and latency"""
+    from rank_checker import get_profile_stats
+    return jsonify({
+        "default": DEFAULT_PROFILE,
+        "profiles": REQUEST_PROFILES,
+        "stats": get_profile_stats()
+    }), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Return fetch metrics for this worker process"""
+    from rank_checker import get_profile_stats, upstream_breaker, concurrency_controller, serp_flights
+    return jsonify({
+        "transfer": get_transfer_stats(),
+        "profiles": get_profile_stats(),
+        "circuit_breaker": upstream_breaker.get_state(),
+        "concurrency": concurrency_controller.get_state(),
+        "coalescing": serp_flights.get_stats(),
+        "serp_cache": serp_cache.get_stats(),
+        "negative_cache": negative_cache.get_stats(),
+        "location_catalog": get_location_catalog().get_stats(),
+        "costs": cost_tracker.get_stats(),
+        "fetch_engine": get_fetch_engine().get_stats(),
+        "credential_pool": get_credential_pool().get_stats() if get_credential_pool() else None,
+        "startup": get_startup_stats()
+    }), 200
+
+@app.route('/queue', methods=['GET'])
+def queue_status():
+    """Shard counts on the distributed work queue, or the shard progress of one job"""
+    queue = get_work_queue()
+    job_id = request.args.get('job_id')
+    if job_id:
+        progress = queue.progress(job_id)
+        if progress is None:
+            return jsonify({"error": "No queued shards for this job"}), 404
+        return jsonify({"job_id": job_id, **progress}), 200
+    return jsonify({"distributed": distributed_enabled(), **queue.get_stats()}), 200
+
+@app.route('/estimate', methods=['POST'])
+def estimate():
+    """
+    Estimate the API cost of a check before running it
+    
+    Accepts the same CSV upload and form fields as /upload, or a JSON payload:
+    {
+        "keywords": ["keyword1", "keyword2"],
+        "location_code": 2356,
+        "location_name": "Mumbai",  // Optional
+        "device": "desktop",
+        "profile": "top20",
+        "limit": 10
+    }
+    """
+    from rank_checker import estimate_cost
+    if 'csv_file' in request.files:
+        params = request.form
+        try:
+            reader = csv.DictReader(io.StringIO(request.files['csv_file'].read().decode('utf-8-sig')))
+            keywords = [row.get('Keyword') or row.get('Keywords') for row in reader]
+        except (UnicodeDecodeError, csv.Error) as e:
+            return jsonify({"error": f"Error reading CSV: {str(e)}"}), 400
+        keywords = [keyword for keyword in keywords if keyword]
+    else:
+        params = request.json or {}
+        keywords = params.get('keywords', [])
+    
+    profile = params.get('profile', DEFAULT_PROFILE)
+    if profile not in REQUEST_PROFILES:
+        return jsonify({"error": f"Unknown profile '{profile}'. Available: {', '.join(REQUEST_PROFILES)}"}), 400
+    if not keywords:
+        return jsonify({"error": "No keywords provided"}), 400
+    
+    try:
+        limit = int(params['limit']) if params.get('limit') else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "limit must be a number"}), 400
+    try:
+        location_code, location_name = resolve_location(params.get('location_code', 2356), params.get('location_name', ''))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if limit and limit < len(keywords):
+        keywords = keywords[:limit]
+    
+    return jsonify(estimate_cost(keywords, location_code,
+                                 location_name=location_name,
+                                 device=params.get('device', 'desktop'),
+                                 profile=profile)), 200
+
+@app.route('/locations', methods=['GET'])
+def search_locations():
+    """Autocomplete over the local location catalog; without q, the list of countries"""
+    catalog = get_location_catalog()
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"locations": catalog.countries(), "catalog": catalog.get_stats()}), 200
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 100)
+    return jsonify({"locations": catalog.search_locations(query, limit, request.args.get('country'),
+                                                          request.args.get('type'))}), 200
+
+@app.route('/languages', methods=['GET'])
+def search_languages():
+    """Autocomplete over the local language catalog; without q, every language"""
+    catalog = get_location_catalog()
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"languages": catalog.languages}), 200
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 100)
+    return jsonify({"languages": catalog.search_languages(query, limit)}), 200
+
+@app.route('/admin/profiles', methods=['GET'])
+def list_job_profiles():
+    """Saved job and request profiles, newest first"""
+    if not admin_authorized():
+        return jsonify({"error": "Missing or invalid admin token (admin endpoints need RANK_ADMIN_TOKEN)"}), 403
+    return jsonify({"profiles": list_saved_profiles()}), 200
+
+@app.route('/admin/profiles/<profile_id>', methods=['GET'])
+def get_job_profile(profile_id):
+    """Time per pipeline stage and the hottest functions of one profile"""
+    if not admin_authorized():
+        return jsonify({"error": "Missing or invalid admin token (admin endpoints need RANK_ADMIN_TOKEN)"}), 403
+    summary = load_summary(profile_id)
+    if summary is None:
+        # A profiled upload saves its profile when the job finishes
+        return jsonify({"error": "Profile not found (or its job is still running)"}), 404
+    return jsonify({**summary, "speedscope_url": url_for('download_job_profile', profile_id=profile_id)}), 200
+
+@app.route('/admin/profiles/<profile_id>/speedscope', methods=['GET'])
+def download_job_profile(profile_id):
+    """Download a profile as a speedscope flame graph file"""
+    if not admin_authorized():
+        return jsonify({"error": "Missing or invalid admin token (admin endpoints need RANK_ADMIN_TOKEN)"}), 403
+    path = get_profile_path(profile_id, 'speedscope')
+    if path is None or not os.path.exists(path):
+        return jsonify({"error": "Profile not found"}), 404
+    with open(path, 'rb') as file:
+        content = file.read()
+    return Response(content, headers={
+        'Content-Disposition': f'attachment; filename="{profile_id}.speedscope.json"',
+        'Content-Type': 'application/json'
+    })
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    """List recent jobs from all workers, newest first"""
+    jobs = get_job_store().list_jobs(
+        status=request.args.get('status'),
+        schedule_id=request.args.get('schedule_id'),
+        limit=request.args.get('limit', 50, type=int)
+    )
+    return jsonify({"jobs": jobs}), 200
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Return one job record"""
+    job = get_job_store().get_job(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job), 200
+
+@app.route('/jobs/<job_id>/results', methods=['GET'])
+def get_job_results(job_id):
+    """Page through the results of an upload job (offset, limit), including those spilled from memory"""
+    job_store = get_job_store()
+    job = job_store.get_job(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    offset = max(0, request.args.get('offset', 0, type=int))
+    limit = min(max(1, request.args.get('limit', 1000, type=int)), 10000)
+    processing_status = status_board.snapshot()
+    results = processing_status['results']
+    if processing_status['job_id'] == job_id and results.store is not None:
+        # The running job's newest results are still in memory
+        page, total = results.page(offset, limit), len(results)
+    elif job_store.count_results(job_id):
+        page = [row_to_dict(row) for row in job_store.get_results(job_id, offset, limit)]
+        total = job_store.count_results(job_id)
+    else:
+        # Distributed jobs keep their results with the shards on the work queue
+        device = job['params'].get('device', 'desktop')
+        pairs, total = results_page(get_work_queue(), job_id, offset, limit)
+        page = [status_result(keyword, ranking_info, device) for keyword, ranking_info in pairs]
+    return jsonify({"job_id": job_id, "offset": offset, "total": total, "results": page}), 200
+
+@app.route('/schedules', methods=['GET'])
+def list_schedules():
+    """List recurring job definitions"""
+    return jsonify({"schedules": get_schedule_store().list_schedules()}), 200
+
+@app.route('/schedules', methods=['POST'])
+def create_schedule():
+    """
+    Create a recurring rank-tracking job
+    
+    Expected JSON payload:
+    {
+        "name": "Daily India desktop",
+        "cron": "0 6 * * *",              // minute hour day-of-month month day-of-week
+        "target_urls": ["example.com"],
+        "keywords": ["keyword1", "keyword2"],   // and/or "csv_file": "/path/to/keywords.csv"
+        "locations": [{"location_code": 2356, "location_name": "Mumbai"}],
+        "devices": ["desktop", "mobile"],
+        "profile": "top20",
+        "api_credentials": {"login": "...", "password": "..."},  // Optional, defaults to DATAFORSEO_LOGIN/DATAFORSEO_PASSWORD
+        "splay_seconds": 600,             // Optional, spreads start times
+        "max_cost": 5.0                   // Optional, USD budget for each run
+    }
+    """
+    data = request.json
+    if not data:
+        return jsonify({"error": "No JSON data provided"}), 400
+    if not data.get('name') or not data.get('cron'):
+        return jsonify({"error": "Missing required parameters: name, cron"}), 400
+    
+    try:
+        schedule = get_schedule_store().create_schedule(
+            data['name'],
+            data['cron'],
+            data,
+            splay_seconds=data.get('splay_seconds', 600),
+            enabled=data.get('enabled', True)
+        )
+    except (ValueError, KeyError) as e:
+        return jsonify({"error": f"Invalid schedule: {str(e)}"}), 400
+    return jsonify(schedule), 201
+
+@app.route('/schedules/<schedule_id>', methods=['GET'])
+def get_schedule(schedule_id):
+    """Return a schedule with its most recent runs"""
+    schedule = get_schedule_store().get_schedule(schedule_id)
+    if not schedule:
+        return jsonify({"error": "Schedule not found"}), 404
+    schedule['recent_jobs'] = get_job_store().list_jobs(schedule_id=schedule_id, limit=10)
+    return jsonify(schedule), 200
+
+@app.route('/schedules/<schedule_id>', methods=['DELETE'])
+def delete_schedule(schedule_id):
+    """Delete a schedule"""
+    if not get_schedule_store().delete_schedule(schedule_id):
+        return jsonify({"error": "Schedule not found"}), 404
+    return jsonify({"message": "Schedule deleted"}), 200
+
+@app.route('/history/export', methods=['GET'])
+def export_history():
+    """Stream rank history rows as Parquet, Arrow or NDJSON"""
+    try:
+        export_format = resolve_format(request.args.get('format'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    domain = request.args.get('domain')
+    rows = get_rank_history().iter_rows(
+        domain=domain,
+        start_date=request.args.get('start'),
+        end_date=request.args.get('end'),
+        location_code=request.args.get('location_code', type=int),
+        location_name=request.args.get('location_name'),
+        device=request.args.get('device')
+    )
+    filename = f"rank_history_{secure_filename(domain) if domain else 'all'}.{export_format}"
+    headers = {
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'X-Export-Format': export_format,
+        'Cache-Control': 'no-cache, no-store, must-revalidate'
+    }
+    # Rows are read and written one row group at a time as the response is sent
+    return Response(stream_with_context(stream_export((history_row(row) for row in rows), export_format)),
+                    mimetype=CONTENT_TYPES[export_format], headers=headers)
+
+@app.route('/history/<domain>/keyword', methods=['GET'])
+def keyword_history(domain):
+    """Ranking history for one keyword of a domain, oldest first"""
+    keyword = request.args.get('keyword')
+    if not keyword:
+        return jsonify({"error": "Missing required parameter: keyword"}), 400
+    
+    history = get_rank_history().keyword_history(
+        domain,
+        keyword,
+        location_code=request.args.get('location_code', type=int),
+        location_name=request.args.get('location_name'),
+        device=request.args.get('device'),
+        start_date=request.args.get('start'),
+        end_date=request.args.get('end'),
+        limit=request.args.get('limit', 365, type=int)
+    )
+    return jsonify({"domain": domain, "keyword": keyword, "history": history}), 200
+
+@app.route('/history/<domain>/refresh-plan', methods=['GET'])
+def refresh_plan(domain):
+    """Which keywords a smart-refresh run would check today, with each keyword's re-check interval"""
+    keywords = request.args.get('keywords')
+    plan = plan_refresh(
+        get_rank_history(),
+        domain,
+        [keyword.strip() for keyword in keywords.split(',') if keyword.strip()] if keywords else None,
+        request.args.get('location_code', 2356, type=int),
+        location_name=request.args.get('location_name', ''),
+        device=request.args.get('device', 'desktop')
+    )
+    total = len(plan['due']) + len(plan['skipped'])
+    return jsonify({"domain": domain, "total": total, "due": len(plan['due']), "skipped": len(plan['skipped']),
+                    "saved_fraction": round(len(plan['skipped']) / total, 3) if total else 0.0, **plan}), 200
+
+def get_comparison_dates(domain):
+    """Return the (from, to) dates from the query string, defaulting to the last two checked dates"""
+    from_date = request.args.get('from')
+    to_date = request.args.get('to')
+    if not from_date or not to_date:
+        dates = get_rank_history().get_dates(domain, limit=2)
+        if len(dates) < 2:
+            return None, None
+        to_date = to_date or dates[0]
+        from_date = from_date or dates[1]
+    return from_date, to_date
+
+@app.route('/history/<domain>/deltas', methods=['GET'])
+def rank_deltas(domain):
+    """Position changes for every keyword between two dates"""
+    from_date, to_date = get_comparison_dates(domain)
+    if not from_date:
+        return jsonify({"error": "Need results from at least two dates, or explicit 'from' and 'to' parameters"}), 404
+    
+    deltas = get_rank_history().rank_deltas(
+        domain,
+        from_date,
+        to_date,
+        location_code=request.args.get('location_code', type=int),
+        location_name=request.args.get('location_name'),
+        device=request.args.get('device'),
+        limit=request.args.get('limit', 100, type=int),
+        offset=request.args.get('offset', 0, type=int)
+    )
+    return jsonify({"domain": domain, "from": from_date, "to": to_date, "deltas": deltas}), 200
+
+@app.route('/history/<domain>/movers', methods=['GET'])
+def rank_movers(domain):
+    """Best and worst movers between two dates"""
+    from_date, to_date = get_comparison_dates(domain)
+    if not from_date:
+        return jsonify({"error": "Need results from at least two dates, or explicit 'from' and 'to' parameters"}), 404
+    
+    movers = get_rank_history().movers(
+        domain,
+        from_date,
+        to_date,
+        limit=request.args.get('limit', 20, type=int),
+        location_code=request.args.get('location_code', type=int),
+        location_name=request.args.get('location_name'),
+        device=request.args.get('device')
+    )
+    return jsonify({"domain": domain, "from": from_date, "to": to_date, **movers}), 200
+
+def load_analytics_frame(domain, start_date=None, end_date=None):
+    """Return (analytics module, frame, load seconds) for the request's filters; numpy is imported on first use"""
+    import analytics
+    frame, load_seconds = analytics.load_frame(
+        get_rank_history(),
+        domain,
+        start_date=start_date,
+        end_date=end_date,
+        location_code=request.args.get('location_code', type=int),
+        location_name=request.args.get('location_name'),
+        device=request.args.get('device')
+    )
+    return analytics, frame, load_seconds
+
+@app.route('/history/<domain>/analytics', methods=['GET'])
+def rank_analytics(domain):
+    """Average position, top 3/10 share and visibility per date, location and/or device"""
+    group_by = [column.strip() for column in request.args.get('group_by', 'date').split(',') if column.strip()]
+    unknown = [column for column in group_by if column not in ('date', 'location', 'device')]
+    if unknown:
+        return jsonify({"error": f"Invalid group_by column(s): {', '.join(unknown)}. Use date, location or device"}), 400
+
+    try:
+        analytics, frame, load_seconds = load_analytics_frame(domain, request.args.get('start'), request.args.get('end'))
+    except ImportError:
+        return jsonify({"error": "Rank analytics require numpy (pip install numpy)"}), 501
+
+    start_time = time.perf_counter()
+    groups = analytics.summarize(frame, group_by)
+    return jsonify({
+        "domain": domain,
+        "group_by": group_by,
+        "rows": len(frame),
+        "groups": groups,
+        "timing_ms": {
+            "load": round(load_seconds * 1000, 1),
+            "compute": round((time.perf_counter() - start_time) * 1000, 1)
+        }
+    }), 200
+
+@app.route('/history/<domain>/movement', methods=['GET'])
+def rank_movement(domain):
+    """Improved, declined, entered and dropped keyword counts between two dates, per location and device"""
+    from_date, to_date = get_comparison_dates(domain)
+    if not from_date:
+        return jsonify({"error": "Need results from at least two dates, or explicit 'from' and 'to' parameters"}), 404
+
+    try:
+        # The frame covers every date, so it is shared with other comparisons and /analytics
+        analytics, frame, load_seconds = load_analytics_frame(domain)
+    except ImportError:
+        return jsonify({"error": "Rank analytics require numpy (pip install numpy)"}), 501
+
+    start_time = time.perf_counter()
+    movement = analytics.movement(frame, from_date, to_date)
+    if movement is None:
+        return jsonify({"error": f"No results recorded for {domain} on {from_date} and {to_date}"}), 404
+    movement['timing_ms'] = {
+        "load": round(load_seconds * 1000, 1),
+        "compute": round((time.perf_counter() - start_time) * 1000, 1)
+    }
+    return jsonify({"domain": domain, **movement}), 200
+
+@app.route('/tasks', methods=['POST'])
+def create_tasks():
+    """
+    Post keywords as DataForSEO tasks that report back to /postback when done
+
+    Accepts the same JSON payload as /check-rankings. Returns the job ID
+    straight away; results arrive as DataForSEO completes the tasks.
+    """
+    data = request.get_json(silent=True) or {}
+    target_url = data.get('target_url')
+    api_login = data.get('api_credentials', {}).get('login')
+    api_password = data.get('api_credentials', {}).get('password')
+    keywords = data.get('keywords', [])
+    location_code = data.get('location_code', 2356)
+    location_name = data.get('location_name', '')
+    device = data.get('device', 'desktop')
+    profile = data.get('profile', DEFAULT_PROFILE)
+    limit = data.get('limit')
+
+    if not target_url or credentials_missing(api_login, api_password) or not keywords:
+        return jsonify({"error": "Missing required parameters: target_url, api_credentials, keywords"}), 400
+    if profile not in REQUEST_PROFILES:
+        return jsonify({"error": f"Unknown profile '{profile}'. Available: {', '.join(REQUEST_PROFILES)}"}), 400
+    try:
+        location_code, location_name = resolve_location(location_code, location_name)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        max_cost = parse_max_cost(data.get('max_cost'))
+    except (TypeError, ValueError):
+        return jsonify({"error": "max_cost must be a non-negative amount in USD"}), 400
+    if limit and limit < len(keywords):
+        keywords = keywords[:limit]
+
+    job_id = get_job_store().create_job(
+        JOB_POSTBACK,
+        params={'target_url': target_url, 'location_code': int(location_code), 'location_name': location_name,
+                'device': device, 'profile': profile, 'limit': limit},
+        max_cost=max_cost
+    )
+    counts = post_tasks(make_client(api_login, api_password), job_id, keywords, target_url, location_code,
+                        location_name, device, profile, base_url=request.url_root, cost_budget=CostBudget(max_cost))
+    return jsonify({"job_id": job_id, "job_url": url_for('get_job', job_id=job_id),
+                    "results_url": url_for('task_results', job_id=job_id), **counts}), 200
+
+@app.route('/tasks/<job_id>', methods=['GET'])
+def task_results(job_id):
+    """Progress and results so far of a job posted with /tasks"""
+    job = get_job_store().get_job(job_id)
+    if job is None or job['kind'] != JOB_POSTBACK:
+        return jsonify({"error": "Job not found"}), 404
+    store = get_postback_store()
+    device = job['params'].get('device', 'desktop')
+    results = [status_result(keyword, ranking_info, device) for keyword, ranking_info in store.job_results(job_id)]
+    return jsonify({"job": job, "progress": store.job_progress(job_id), "results": results}), 200
+
+def postback_authorized():
+    token = request.args.get('token')
+    return bool(POSTBACK_TOKEN) and token is not None and hmac.compare_digest(token, POSTBACK_TOKEN)
+
+@app.route('/postback', methods=['POST'])
+def receive_postback():
+    """Receive a finished task from DataForSEO (gzip'd or plain JSON) and complete its job item"""
+    if not postback_authorized():
+        return jsonify({"error": "Invalid token"}), 403
+    try:
+        response = read_postback_body(request.get_data(), request.headers.get('Content-Encoding'))
+    except (OSError, ValueError) as e:
+        return jsonify({"error": f"Invalid postback payload: {str(e)}"}), 400
+    return jsonify({"completed": handle_postback(response)}), 200
+
+@app.route('/pingback', methods=['GET'])
+def receive_pingback():
+    """Fetch a task announced by a DataForSEO pingback and complete its job item"""
+    if not postback_authorized():
+        return jsonify({"error": "Invalid token"}), 403
+    task_id = request.args.get('id')
+    if not task_id:
+        return jsonify({"error": "Missing required parameter: id"}), 400
+    return jsonify({"completed": handle_pingback(task_id, request.args.get('tag'))}), 200
+
 @app.route('/check-rankings', methods=['POST'])
+@profile_request
 def check_rankings():
     """
     API endpoint to check rankings for keywords
@@ -341,7 +952,9 @@ def check_rankings():
         "location_code": 2356,
         "location_name": "Mumbai",  // Optional city name
         "device": "desktop",        // desktop, mobile, or tablet
+        "profile": "top20",         // Optional request profile (top10, top20, top100, ...)
         "limit": 10,
+        "max_cost": 0.5,            // Optional budget in USD
         "keywords": ["keyword1", "keyword2", "keyword3"]
     }
     
@@ -349,6 +962,7 @@ def check_rankings():
     - Form data with 'csv_file' containing the CSV file
     - Form data with 'config' containing the JSON configuration
     """
+    from rank_checker import get_ranking
     results = []
     
     # Check if this is a file upload or direct JSON payload
@@ -360,18 +974,9 @@ def check_rankings():
         if csv_file.filename == '':
             return jsonify({"error": "No file selected"}), 400
             
-        # Save the uploaded file with a unique name to prevent conflicts
-        original_filename = secure_filename(csv_file.filename)
-        # Add timestamp to filename to make it unique
-        timestamp = int(time.time())
-        unique_filename = f"{timestamp}_{original_filename}"
-        
-        # Create uploads directory if it doesn't exist
-        os.makedirs('uploads', exist_ok=True)
-        
-        # Save to uploads directory instead of a temporary directory
-        file_path = os.path.join('uploads', unique_filename)
-        csv_file.save(file_path)
+        # Store the uploaded file under a unique ID in the upload index
+        upload = get_upload_store().store_file(csv_file, csv_file.filename)
+        file_path = upload['path']
         
         # Process the CSV file
         target_url = config.get('target_url')
@@ -380,13 +985,27 @@ def check_rankings():
         location_code = config.get('location_code', 2356)  # Default to India
         location_name = config.get('location_name', '')  # Optional city name
         device = config.get('device', 'desktop')  # Default to desktop
+        profile = config.get('profile', DEFAULT_PROFILE)  # Request profile
         limit = config.get('limit')
         
-        if not target_url or not api_login or not api_password:
+        if not target_url or credentials_missing(api_login, api_password):
             return jsonify({"error": "Missing required parameters: target_url, api_login, api_password"}), 400
+        
+        if profile not in REQUEST_PROFILES:
+            return jsonify({"error": f"Unknown profile '{profile}'. Available: {', '.join(REQUEST_PROFILES)}"}), 400
+        
+        try:
+            location_code, location_name = resolve_location(location_code, location_name)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        try:
+            cost_budget = CostBudget(parse_max_cost(config.get('max_cost')))
+        except (TypeError, ValueError):
+            return jsonify({"error": "max_cost must be a non-negative amount in USD"}), 400
             
         # Initialize the API client
-        client = RestClient(api_login, api_password)
+        client = make_client(api_login, api_password)
         
         # Read keywords from CSV
         try:
@@ -417,13 +1036,27 @@ def check_rankings():
                 if limit and limit < len(rows):
                     rows = rows[:limit]
                 
+                # Retries this request may spend on transient upstream failures
+                retry_budget = RetryBudget.for_keywords(len(rows))
+                history_results = []
+                
+                # Queue every keyword in the interactive lane of the shared fetch engine
+                engine = get_fetch_engine()
+                request_key = f"request-{uuid.uuid4().hex}"
+                futures = [
+                    engine.submit(get_ranking, client, row[keyword_column], target_url, location_code,
+                                  location_name=location_name, device=device, profile=profile, retry_budget=retry_budget,
+                                  cost_budget=cost_budget, lane=LANE_INTERACTIVE, job_key=request_key)
+                    for row in rows
+                ]
+                
                 # Process each keyword
-                for row in rows:
+                for row, future in zip(rows, futures):
                     keyword = row[keyword_column]
                     print(f"Processing keyword: {keyword}")
                     
                     # Get ranking with geo_location parameter
-                    ranking_info = get_ranking(client, keyword, target_url, location_code, location_name=location_name, device=device)
+                    ranking_info = future.result()
                     
                     # Store result
                     if isinstance(ranking_info, dict):
@@ -456,6 +1089,9 @@ def check_rankings():
                         row['Device'] = device
                         
                     results.append(result)
+                    history_results.append((keyword, ranking_info))
+                
+                record_history(target_url, location_code, location_name, device, history_results)
                 
                 # Save the updated CSV
                 with open(file_path, 'w', newline='') as f:
@@ -466,18 +1102,17 @@ def check_rankings():
                 # Read the updated CSV to return as response
                 with open(file_path, 'r') as f:
                     csv_content = f.read()
+                get_upload_store().refresh_size(upload['id'])
                 
-                # Create a download URL for the file
-                download_url = request.url_root.rstrip('/') + '/download-api/' + os.path.basename(file_path)
-                
-                # Don't remove the file yet, as it will be needed for download
-                # We'll clean it up after download or after a timeout
+                # Create a download URL for the file; it is kept until its retention expires
+                download_url = request.url_root.rstrip('/') + url_for('download_api_file', file_id=upload['id'])
                 
                 # Return JSON results, CSV content, and download URL
                 return jsonify({
                     "results": results,
                     "csv_content": csv_content,
-                    "download_url": download_url
+                    "download_url": download_url,
+                    "cost": cost_budget.get_state()
                 }), 200
                 
         except Exception as e:
@@ -496,11 +1131,25 @@ def check_rankings():
         location_code = data.get('location_code', 2356)  # Default to India
         location_name = data.get('location_name', '')  # Optional city name
         device = data.get('device', 'desktop')  # Default to desktop
+        profile = data.get('profile', DEFAULT_PROFILE)  # Request profile
         keywords = data.get('keywords', [])
         limit = data.get('limit')
         
-        if not target_url or not api_login or not api_password:
+        if not target_url or credentials_missing(api_login, api_password):
             return jsonify({"error": "Missing required parameters: target_url, api_credentials"}), 400
+        
+        if profile not in REQUEST_PROFILES:
+            return jsonify({"error": f"Unknown profile '{profile}'. Available: {', '.join(REQUEST_PROFILES)}"}), 400
+        
+        try:
+            location_code, location_name = resolve_location(location_code, location_name)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        try:
+            cost_budget = CostBudget(parse_max_cost(data.get('max_cost')))
+        except (TypeError, ValueError):
+            return jsonify({"error": "max_cost must be a non-negative amount in USD"}), 400
             
         if not keywords:
             return jsonify({"error": "No keywords provided"}), 400
@@ -510,14 +1159,28 @@ def check_rankings():
             keywords = keywords[:limit]
             
         # Initialize the API client
-        client = RestClient(api_login, api_password)
+        client = make_client(api_login, api_password)
+        
+        # Retries this request may spend on transient upstream failures
+        retry_budget = RetryBudget.for_keywords(len(keywords))
+        history_results = []
+        
+        # Queue every keyword in the interactive lane of the shared fetch engine
+        engine = get_fetch_engine()
+        request_key = f"request-{uuid.uuid4().hex}"
+        futures = [
+            engine.submit(get_ranking, client, keyword, target_url, location_code,
+                          location_name=location_name, device=device, profile=profile, retry_budget=retry_budget,
+                          cost_budget=cost_budget, lane=LANE_INTERACTIVE, job_key=request_key)
+            for keyword in keywords
+        ]
         
         # Process each keyword
-        for keyword in keywords:
+        for keyword, future in zip(keywords, futures):
             print(f"Processing keyword: {keyword}")
             
             # Get ranking with geo_location parameter
-            ranking_info = get_ranking(client, keyword, target_url, location_code, location_name=location_name, device=device)
+            ranking_info = future.result()
             
             # Store result
             if isinstance(ranking_info, dict):
@@ -538,30 +1201,46 @@ def check_rankings():
                 }
                 
             results.append(result)
-            
-        return jsonify({"results": results}), 200
+            history_results.append((keyword, ranking_info))
+        
+        record_history(target_url, location_code, location_name, device, history_results)
+        
+        return jsonify({"results": results, "cost": cost_budget.get_state()}), 200
+
+def process_csv_file(csv_file, target_url, api_login, api_password, location_code, limit=None, location_name='', device='desktop', profile=DEFAULT_PROFILE, job_id=None, max_cost=None, generation=None, results=None, upload_id=None):
+    """Process the CSV file in the background.
 
-def process_csv_file(csv_file, target_url, api_login, api_password, location_code, limit=None, location_name='', device='desktop'):
-    """Process the CSV file in the background"""
-    global processing_status
+    results and upload_id belong to this job; they are passed in rather than
+    read from the status board, which a newer upload may have reset.
+    """
+    from rank_checker import get_ranking, estimate_cost
+    job_store = get_job_store()
+    if results is None:
+        results = ResultBuffer(job_id, store=job_store) if job_id else ResultBuffer()
+    processed = 0
+    error = None
+    
+    def publish(**fields):
+        # Updates are dropped if a newer upload has taken over the status board
+        status_board.update(generation, **fields)
     
     try:
         # Initialize the API client
-        client = RestClient(api_login, api_password)
+        client = make_client(api_login, api_password)
         
-        # Read keywords from CSV
-        keywords_data = []
+        # Read the CSV once; the keyword rows are the same dicts that are written back
         with open(csv_file, 'r') as file:
             reader = csv.DictReader(file)
-            for row in reader:
-                keywords_data.append(row)
+            header = reader.fieldnames.copy() if reader.fieldnames else []
+            all_rows = list(reader)
         
         # Apply limit if specified
-        if limit and limit < len(keywords_data):
-            keywords_data = keywords_data[:limit]
+        keywords_data = all_rows[:limit] if limit and limit < len(all_rows) else all_rows
         
         # Update status
-        processing_status['total_keywords'] = len(keywords_data)
+        publish(total_keywords=len(keywords_data))
+        if job_id:
+            job_store.start_job(job_id, total_keywords=len(keywords_data))
         
         # Check for either 'Keyword' or 'Keywords' column
         if len(keywords_data) > 0:
@@ -570,22 +1249,12 @@ def process_csv_file(csv_file, target_url, api_login, api_password, location_cod
             elif 'Keywords' in keywords_data[0]:
                 keyword_column = 'Keywords'
             else:
-                processing_status['error'] = "CSV must contain either a 'Keyword' or 'Keywords' column."
-                processing_status['is_processing'] = False
+                error = "CSV must contain either a 'Keyword' or 'Keywords' column."
                 return
         else:
-            processing_status['error'] = "CSV file is empty."
-            processing_status['is_processing'] = False
+            error = "CSV file is empty."
             return
         
-        # Read the CSV file to get the structure
-        all_rows = []
-        with open(csv_file, 'r') as file:
-            reader = csv.DictReader(file)
-            header = reader.fieldnames.copy() if reader.fieldnames else []
-            for row in reader:
-                all_rows.append(row)
-        
         # Check if ranking columns exist in the header, if not, add them
         ranking_columns = ['Ranking', 'Rank Group', 'Rank Absolute', 'Device']
         for column in ranking_columns:
@@ -595,8 +1264,23 @@ def process_csv_file(csv_file, target_url, api_login, api_password, location_cod
         # Create a ranking cache to avoid redundant API calls
         ranking_cache = {}
         
+        # Retries this job may spend on transient upstream failures
+        retry_budget = RetryBudget.for_keywords(len(keywords_data))
+        
+        # API spend of this job, stopped at max_cost if one was given
+        cost_budget = CostBudget(max_cost)
+        estimate = estimate_cost(
+            [row[keyword_column] for row in keywords_data], location_code,
+            location_name=location_name, device=device, profile=profile)
+        publish(estimate=estimate)
+        print(f"Estimated cost: ${estimate['estimated_cost']:.4f} for {estimate['billable_calls']} API calls")
+        
+        # Lookups run on the shared fetch engine in the bulk lane, taking turns
+        # with other jobs and yielding to interactive requests
+        engine = get_fetch_engine()
+        
         # Process keywords in batches for better performance
-        batch_size = 5  # Reduce batch size to 5 keywords to avoid timeouts
+        batch_size = 20
         total_keywords = len(keywords_data)
         total_batches = (total_keywords + batch_size - 1) // batch_size
         
@@ -607,17 +1291,31 @@ def process_csv_file(csv_file, target_url, api_login, api_password, location_cod
             
             print(f"Processing batch {batch_index + 1}/{total_batches} (keywords {start_idx + 1}-{end_idx} of {total_keywords})")
             
+            history_results = []
+            
+            # Queue one lookup per distinct uncached keyword in the batch
+            futures = {}
+            for keyword_row in batch:
+                keyword = keyword_row[keyword_column]
+                cache_key = f"{keyword}_{target_url}_{location_code}_{location_name}_{device}_{profile}"
+                if cache_key not in ranking_cache and cache_key not in futures:
+                    print(f"Fetching ranking for '{keyword}' with location: {location_code}, location_name: {location_name}, device: {device}, profile: {profile}")
+                    futures[cache_key] = engine.submit(
+                        get_ranking, client, keyword, target_url, location_code,
+                        location_name=location_name, device=device, profile=profile, retry_budget=retry_budget,
+                        cost_budget=cost_budget, lane=LANE_BULK, job_key=job_id or csv_file
+                    )
+            
             # Process each keyword in the batch
             for j, keyword_row in enumerate(batch):
                 keyword = keyword_row[keyword_column]
                 current_index = start_idx + j
                 
                 # Update status
-                processing_status['current_keyword'] = keyword
-                processing_status['processed_keywords'] = current_index
+                publish(current_keyword=keyword, processed_keywords=current_index)
                 
                 # Create a cache key
-                cache_key = f"{keyword}_{target_url}_{location_code}_{location_name}_{device}"
+                cache_key = f"{keyword}_{target_url}_{location_code}_{location_name}_{device}_{profile}"
                 
                 try:
                     # Check if we have a cached result
@@ -625,102 +1323,79 @@ def process_csv_file(csv_file, target_url, api_login, api_password, location_cod
                         print(f"Using cached result for '{keyword}'")
                         ranking_info = ranking_cache[cache_key]
                     else:
-                        # Pass location_name as geo_location parameter
-                        print(f"Fetching ranking for '{keyword}' with location: {location_code}, location_name: {location_name}, device: {device}")
-                        ranking_info = get_ranking(client, keyword, target_url, location_code, location_name=location_name, device=device)
+                        ranking_info = futures[cache_key].result()
                         # Cache the result
                         ranking_cache[cache_key] = ranking_info
-                        
-                        # Add a small delay between API calls within a batch
-                        time.sleep(1)
                     
-                    # Handle different types of ranking values
-                    if isinstance(ranking_info, dict):
-                        result = {
-                            "keyword": keyword,
-                            "ranking": ranking_info.get('position', 'N/A'),
-                            "rank_group": ranking_info.get('rank_group', 'N/A'),
-                            "rank_absolute": ranking_info.get('rank_absolute', 'N/A'),
-                            "device": device
-                        }
-                        
-                        # Update the row data
-                        keyword_row['Ranking'] = ranking_info.get('position', 'N/A')
-                        keyword_row['Rank Group'] = ranking_info.get('rank_group', 'N/A')
-                        keyword_row['Rank Absolute'] = ranking_info.get('rank_absolute', 'N/A')
-                        keyword_row['Device'] = device
-                    else:
-                        result = {
-                            "keyword": keyword,
-                            "ranking": ranking_info,
-                            "rank_group": 'N/A',
-                            "rank_absolute": 'N/A',
-                            "device": device
-                        }
-                        
-                        # Update the row data
-                        keyword_row['Ranking'] = ranking_info
-                        keyword_row['Rank Group'] = 'N/A'
-                        keyword_row['Rank Absolute'] = 'N/A'
-                        keyword_row['Device'] = device
+                    # Compact record for the status; the row itself is written back to the CSV
+                    record = ResultRecord.from_ranking(keyword, ranking_info, device)
+                    keyword_row['Ranking'] = record.ranking
+                    keyword_row['Rank Group'] = record.rank_group
+                    keyword_row['Rank Absolute'] = record.rank_absolute
+                    keyword_row['Device'] = record.device
                     
                     # Add to results
-                    processing_status['results'].append(result)
-                    
-                    # Update the corresponding row in all_rows
-                    for row in all_rows:
-                        if row[keyword_column] == keyword:
-                            row['Ranking'] = keyword_row['Ranking']
-                            row['Rank Group'] = keyword_row['Rank Group']
-                            row['Rank Absolute'] = keyword_row['Rank Absolute']
-                            row['Device'] = device
-                            break
+                    results.append(record)
+                    history_results.append((keyword, ranking_info))
                     
                 except Exception as e:
-                    processing_status['error'] = f"Error processing keyword '{keyword}': {str(e)}"
+                    error = f"Error processing keyword '{keyword}': {str(e)}"
+                    publish(error=error)
                     # Continue processing other keywords
                 
-                # Update the processed count after each keyword
-                processing_status['processed_keywords'] = current_index + 1
+                # Update the processed count after each keyword, together with the results it covers
+                processed = current_index + 1
+                publish(processed_keywords=processed, results_total=len(results))
             
             # Write the updated data back to the CSV file after processing the batch
-            with open(csv_file, 'w', newline='') as file:
-                writer = csv.DictWriter(file, fieldnames=header)
-                writer.writeheader()
-                writer.writerows(all_rows)
+            with stage('csv_write'):
+                with open(csv_file, 'w', newline='') as file:
+                    writer = csv.DictWriter(file, fieldnames=header)
+                    writer.writeheader()
+                    writer.writerows(all_rows)
             
             print(f"Updated CSV file with rankings for batch {batch_index + 1}/{total_batches}")
             
-            # Add a longer delay between batches to avoid hitting API rate limits
-            if batch_index < total_batches - 1:
-                print(f"Waiting 5 seconds before processing next batch...")
-                time.sleep(5)
+            # Append the batch to the rank history
+            with stage('history'):
+                record_history(target_url, location_code, location_name, device, history_results)
+            cost = cost_budget.get_state()['spent']
+            publish(cost=cost)
+            if job_id:
+                job_store.update_job(job_id, processed_keywords=end_idx, cost=cost)
+        
+        if cost_budget.exceeded():
+            error = f"Cost budget of ${max_cost} reached; remaining keywords were not checked."
         
         # Update final status
-        processing_status['processed_keywords'] = processing_status['total_keywords']
-        processing_status['current_keyword'] = 'Completed'
+        processed = total_keywords
+        publish(processed_keywords=processed, current_keyword='Completed', error=error)
         print("Processing completed successfully!")
-        print(f"Final results count: {len(processing_status.get('results', []))}")
+        print(f"Final results count: {len(results)}")
         
-        # Ensure results are properly set in the processing_status
-        if not processing_status.get('results'):
+        if not len(results):
             print("WARNING: No results found after processing. This is unexpected.")
-            # Initialize results as empty array if it doesn't exist
-            processing_status['results'] = []
-        elif len(processing_status['results']) > 0:
-            print(f"First result: {processing_status['results'][0]}")
         
     except Exception as e:
-        processing_status['error'] = f"Error processing CSV file: {str(e)}"
+        error = f"Error processing CSV file: {str(e)}"
         print(f"Error during processing: {str(e)}")
         import traceback
         traceback.print_exc()
     
     finally:
+        # Every result is in the job store once the job is finished
+        results.flush()
+        if upload_id:
+            get_upload_store().refresh_size(upload_id)
+        if job_id:
+            job_store.update_job(job_id, processed_keywords=processed)
+            job_store.finish_job(job_id, error=error)
         # Ensure is_processing is set to False
-        processing_status['is_processing'] = False
-        print(f"Final processing status: is_processing={processing_status['is_processing']}, total_keywords={processing_status['total_keywords']}, processed_keywords={processing_status['processed_keywords']}, results_count={len(processing_status.get('results', []))}")
+        publish(is_processing=False, error=error, results_total=len(results))
+        print(f"Final processing status: processed_keywords={processed}, results_count={len(results)}, error={error}")
 
 if __name__ == '__main__':
-    # Run the Flask app on port 5050
-    app.run(host='127.0.0.1', port=5050, debug=True)
\ No newline at end of file
+    # Under gunicorn, gunicorn.conf.py starts the services instead
+    start_services()
+    # Run the Flask app on port 5050 (the reloader would start a second copy of the services)
+    app.run(host='127.0.0.1', port=5050, debug=True, use_reloader=False)
\ No newline at end of file
@@ -0,0 +1,161 @@
+import asyncio
+import os
+import ssl
+from base64 import b64encode
+from gzip import compress, decompress
+from json import loads
+from json import dumps
+from urllib.parse import urlsplit
+from client import record_transfer, DEFAULT_API_URL, IDEMPOTENT_METHODS
+
+class AsyncRestClient:
+    """asyncio counterpart of client.RestClient.
+
+    Keeps idle keep-alive connections for reuse and caps the number of
+    requests in flight at max_connections; callers beyond that wait for a
+    free slot instead of opening more sockets.
+    """
+    domain = "api.dataforseo.com"
+    port = 443
+
+    def __init__(self, username, password, max_connections=20, api_url=None):
+        self.username = username
+        self.password = password
+        self.max_connections = max_connections
+        # Same endpoint as RestClient: DATAFORSEO_API_URL can point at the sandbox or a local stand-in
+        url = urlsplit(api_url or os.environ.get('DATAFORSEO_API_URL', DEFAULT_API_URL))
+        self.use_ssl = url.scheme != 'http'
+        self.host = url.netloc
+        self.domain = url.hostname
+        self.port = url.port or (443 if self.use_ssl else 80)
+        self.last_response_size = 0
+        self.last_response_wire_size = 0
+        self.idle_connections = []
+        # Created on first use so the semaphore binds to the running loop
+        self.semaphore = None
+
+    async def open_connection(self):
+        ssl_context = ssl.create_default_context() if self.use_ssl else None
+        return await asyncio.open_connection(self.domain, self.port, ssl=ssl_context)
+
+    async def acquire_connection(self):
+        """Return (reader, writer, reused) using an idle connection when one is open."""
+        while self.idle_connections:
+            reader, writer = self.idle_connections.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        reader, writer = await self.open_connection()
+        return reader, writer, False
+
+    async def read_response(self, reader):
+        """Read one HTTP/1.1 response. Returns (status, headers, body)."""
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError("Connection closed by server")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size_line = await reader.readline()
+                size = int(size_line.split(b";")[0].strip(), 16)
+                if size == 0:
+                    # Skip trailers up to the final blank line
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            body = b"".join(chunks)
+        elif "content-length" in headers:
+            body = await reader.readexactly(int(headers["content-length"]))
+        else:
+            body = await reader.read()
+            headers["connection"] = "close"
+        return status, headers, body
+
+    async def send_request(self, reader, writer, path, method, body):
+        base64_bytes = b64encode(
+            ("%s:%s" % (self.username, self.password)).encode("ascii")
+            ).decode("ascii")
+        lines = [
+            "%s %s HTTP/1.1" % (method, path),
+            "Host: %s" % self.host,
+            "Authorization: Basic %s" % base64_bytes,
+            "Accept-Encoding: gzip",
+            "Connection: keep-alive",
+            "Content-Length: %d" % (len(body) if body else 0)
+        ]
+        if body:
+            lines.append("Content-Type: application/json")
+            lines.append("Content-Encoding: gzip")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        if body:
+            writer.write(body)
+        await writer.drain()
+        return await self.read_response(reader)
+
+    async def request(self, path, method, data=None):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_connections)
+
+        body = None
+        request_raw = 0
+        if data is not None:
+            raw_body = data.encode("utf-8")
+            body = compress(raw_body)
+            request_raw = len(raw_body)
+
+        async with self.semaphore:
+            reader, writer, reused = await self.acquire_connection()
+            try:
+                try:
+                    status, headers, wire_body = await self.send_request(reader, writer, path, method, body)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    if not reused or method not in IDEMPOTENT_METHODS:
+                        raise
+                    # The server dropped an idle keep-alive connection; a GET is safe to send again on a fresh one
+                    writer.close()
+                    reader, writer = await self.open_connection()
+                    status, headers, wire_body = await self.send_request(reader, writer, path, method, body)
+            except Exception:
+                writer.close()
+                raise
+
+            if headers.get("connection", "").lower() == "close":
+                writer.close()
+            else:
+                self.idle_connections.append((reader, writer))
+
+        if headers.get("content-encoding", "").lower() == "gzip":
+            raw_response = decompress(wire_body)
+        else:
+            raw_response = wire_body
+        self.last_response_size = len(raw_response)
+        self.last_response_wire_size = len(wire_body)
+        record_transfer(request_raw, len(body) if body else 0, len(raw_response), len(wire_body))
+        return loads(raw_response.decode())
+
+    async def get(self, path):
+        return await self.request(path, 'GET')
+
+    async def post(self, path, data):
+        if isinstance(data, str):
+            data_str = data
+        else:
+            data_str = dumps(data)
+        return await self.request(path, 'POST', data_str)
+
+    async def close(self):
+        """Close all idle keep-alive connections."""
+        while self.idle_connections:
+            reader, writer = self.idle_connections.pop()
+            writer.close()
@@ -0,0 +1,382 @@
+import csv
+import os
+import sys
+import threading
+import time
+from client import get_transfer_stats
+from credentials import make_client
+from costs import CostBudget
+from exporters import open_export, resolve_export_path, result_row
+from fetch_engine import get_fetch_engine, LANE_BULK
+from locations import get_location_catalog, resolve_location
+from profiling import JobProfiler, profiled, stage, get_profile_path
+from rank_checker import (get_ranking, get_mock_ranking, load_config, estimate_cost, serp_flights,
+                          REQUEST_PROFILES, DEFAULT_PROFILE)
+from rank_history import get_rank_history, normalize_domain
+from resilience import RetryBudget
+from results import ResultRecord
+from serp_cache import serp_cache, negative_cache
+
+# Batch mode of the CLI: many config files and/or keyword CSVs in one run.
+# Every keyword of every job goes onto the shared fetch engine at once, so
+# the jobs share its workers, the rate limiter, the SERP cache and in-flight
+# coalescing; the engine takes turns between jobs so none waits for another
+# to finish. Results are written back to each CSV when its job completes.
+
+# Seconds between aggregate progress lines
+PROGRESS_INTERVAL = float(os.environ.get('RANK_BATCH_PROGRESS_SECONDS', '5'))
+
+RANKING_COLUMNS = ['Ranking', 'Rank Group', 'Rank Absolute', 'Device']
+
+# Rankings that are answers rather than failed lookups
+NOT_RANKED = ("Not in top results", "No results found")
+
+class BatchJob:
+    """One CSV of a batch with its settings, rows and progress."""
+    def __init__(self, name, csv_file, target_url, location_code=2840, location_name='', device='desktop',
+                 profile=DEFAULT_PROFILE, limit=None, max_cost=None, api_login=None, api_password=None,
+                 test_mode=False, export_path=None):
+        self.name = name
+        self.csv_file = csv_file
+        self.target_url = target_url
+        self.location_code = location_code
+        self.location_name = location_name
+        self.device = device
+        self.profile = profile
+        self.limit = limit
+        self.max_cost = max_cost
+        self.api_login = api_login
+        self.api_password = api_password
+        self.test_mode = test_mode
+        self.export_path = export_path
+        self.header = []
+        self.rows = []
+        self.keyword_column = None
+        self.cost_budget = CostBudget(max_cost)
+        self.results = []  # (keyword, ranking_info) per distinct keyword, in completion order
+        self.pending = 0
+        self.errors = 0
+        self.started_at = None
+        self.finished_at = None
+
+    @classmethod
+    def from_config(cls, config_file):
+        config = load_config(config_file)
+        credentials = config.get('api_credentials') or {}
+        return cls(config_file, config['csv_file'], config['target_url'],
+                   location_code=config.get('location_code', 2840),
+                   location_name=config.get('location_name', ''),
+                   device=config.get('device', 'desktop'),
+                   profile=config.get('profile', DEFAULT_PROFILE),
+                   limit=config.get('limit'),
+                   max_cost=config.get('max_cost'),
+                   api_login=credentials.get('login'),
+                   api_password=credentials.get('password'),
+                   test_mode=config.get('test_mode', False),
+                   export_path=config.get('export'))
+
+    def validate(self):
+        """Check the settings and read the CSV. Raises ValueError describing the first problem."""
+        if self.profile not in REQUEST_PROFILES:
+            raise ValueError(f"Unknown profile '{self.profile}'. Available: {', '.join(REQUEST_PROFILES)}")
+        self.location_code, self.location_name = resolve_location(self.location_code, self.location_name)
+        if self.export_path:
+            # A .parquet or .arrow export without pyarrow is refused before any lookup
+            resolve_export_path(self.export_path)
+        try:
+            with open(self.csv_file, 'r') as file:
+                reader = csv.DictReader(file)
+                self.header = reader.fieldnames.copy() if reader.fieldnames else []
+                self.rows = list(reader)
+        except OSError as e:
+            raise ValueError(f"Could not read {self.csv_file}: {e}")
+        if 'Keyword' in self.header:
+            self.keyword_column = 'Keyword'
+        elif 'Keywords' in self.header:
+            self.keyword_column = 'Keywords'
+        else:
+            raise ValueError(f"{self.csv_file} must contain either a 'Keyword' or 'Keywords' column")
+        for column in RANKING_COLUMNS:
+            if column not in self.header:
+                self.header.append(column)
+
+    def keyword_rows(self):
+        rows = [row for row in self.rows if row.get(self.keyword_column)]
+        return rows[:self.limit] if self.limit else rows
+
+    def write_csv(self):
+        # Written to a temporary file first so an interrupted run never leaves a truncated CSV
+        temporary_file = self.csv_file + '.tmp'
+        with open(temporary_file, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=self.header)
+            writer.writeheader()
+            writer.writerows(self.rows)
+        os.replace(temporary_file, self.csv_file)
+
+def find_jobs(paths, defaults):
+    """Batch jobs for config files (.json), keyword CSVs and directories of either."""
+    jobs = []
+    for path in paths:
+        if os.path.isdir(path):
+            entries = sorted(os.path.join(path, name) for name in os.listdir(path)
+                             if name.endswith('.json') or name.endswith('.csv'))
+        else:
+            entries = [path]
+        for entry in entries:
+            if entry.endswith('.json'):
+                jobs.append(BatchJob.from_config(entry))
+            elif not defaults.get('target_url'):
+                raise ValueError(f"{entry}: keyword CSVs need --target <url> (or use a config file)")
+            else:
+                jobs.append(BatchJob(entry, entry, **defaults))
+    return jobs
+
+class BatchRun:
+    """Runs the jobs of a batch on the shared fetch engine and reports aggregate progress."""
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.engine = get_fetch_engine()
+        self.clients = {}
+        self.lock = threading.Lock()
+        self.total = 0
+        self.done = 0
+        self.finished = []  # Jobs whose lookups are all done, waiting to be written out
+        self.changed = threading.Condition(self.lock)
+        self.started_at = None
+
+    def get_client(self, job):
+        # One client per set of credentials, so jobs of the same account share its connections
+        key = (job.api_login, job.api_password)
+        if key not in self.clients:
+            self.clients[key] = make_client(job.api_login, job.api_password)
+        return self.clients[key]
+
+    def submit(self, job):
+        """Queue one lookup per distinct keyword of the job; duplicates share it."""
+        rows_by_keyword = {}
+        for row in job.keyword_rows():
+            rows_by_keyword.setdefault(row[job.keyword_column], []).append(row)
+        job.pending = len(rows_by_keyword)
+        job.started_at = time.time()
+        if not rows_by_keyword:
+            job.finished_at = job.started_at
+            self.finished.append(job)
+            return
+        with self.lock:
+            self.total += len(rows_by_keyword)
+        client = None if job.test_mode else self.get_client(job)
+        retry_budget = RetryBudget.for_keywords(len(rows_by_keyword))
+        for keyword, rows in rows_by_keyword.items():
+            if job.test_mode:
+                future = self.engine.submit(get_mock_ranking, keyword, job.target_url, lane=LANE_BULK, job_key=job.name)
+            else:
+                future = self.engine.submit(
+                    get_ranking, client, keyword, job.target_url, job.location_code,
+                    location_name=job.location_name, device=job.device, profile=job.profile,
+                    retry_budget=retry_budget, cost_budget=job.cost_budget, lane=LANE_BULK, job_key=job.name)
+            future.add_done_callback(lambda future, job=job, keyword=keyword, rows=rows:
+                                     self.complete(job, keyword, rows, future))
+
+    def complete(self, job, keyword, rows, future):
+        # Runs on an engine worker; only fills in the job's rows
+        try:
+            ranking_info = future.result()
+        except Exception as e:
+            ranking_info = f"Error: {e}"
+        record = ResultRecord.from_ranking(keyword, ranking_info, job.device)
+        for row in rows:
+            row['Ranking'] = record.ranking
+            row['Rank Group'] = record.rank_group
+            row['Rank Absolute'] = record.rank_absolute
+            row['Device'] = record.device
+        with self.lock:
+            job.results.append((keyword, ranking_info))
+            if not isinstance(ranking_info, dict) and ranking_info not in NOT_RANKED:
+                job.errors += 1
+            self.done += 1
+            job.pending -= 1
+            if job.pending == 0:
+                job.finished_at = time.time()
+                self.finished.append(job)
+                self.changed.notify_all()
+
+    def finish(self, job):
+        """Write a completed job's CSV, rank history and export."""
+        with stage('csv_write'):
+            job.write_csv()
+        if not job.test_mode and job.results:
+            try:
+                with stage('history'):
+                    get_rank_history().record_results(job.target_url, job.location_code, job.location_name,
+                                                      job.device, job.results)
+            except Exception as e:
+                print(f"[batch] Warning: Could not record rank history for {job.name}: {e}")
+        if job.export_path:
+            try:
+                export_writer, export_path = open_export(job.export_path)
+                domain = normalize_domain(job.target_url)
+                export_date = time.strftime('%Y-%m-%d')
+                export_writer.write_rows([result_row(domain, keyword, job.location_code, job.location_name, job.device,
+                                                     export_date, ranking_info, job.finished_at)
+                                          for keyword, ranking_info in job.results])
+                export_writer.close()
+            except (OSError, ValueError) as e:
+                print(f"[batch] Warning: Could not export {job.name}: {e}")
+        print(f"[batch] Finished {job.name}: {len(job.results)} keywords in {job.finished_at - job.started_at:.1f}s"
+              + (f", {job.errors} errors" if job.errors else ""))
+
+    def print_progress(self):
+        with self.lock:
+            done, total = self.done, self.total
+            jobs_done = sum(1 for job in self.jobs if job.finished_at is not None)
+        elapsed = time.time() - self.started_at
+        rate = done / elapsed if elapsed else 0.0
+        eta = f", ETA {(total - done) / rate:.0f}s" if rate and done < total else ""
+        print(f"[batch] {done}/{total} keywords ({done * 100.0 / total if total else 100.0:.1f}%), "
+              f"{jobs_done}/{len(self.jobs)} jobs done, {rate:.1f} keywords/s{eta}")
+
+    def run(self):
+        self.started_at = time.time()
+        for job in self.jobs:
+            self.submit(job)
+        print(f"[batch] Queued {self.total} lookups from {len(self.jobs)} jobs on {self.engine.workers} workers")
+        written = 0
+        last_progress = time.time()
+        while written < len(self.jobs):
+            with self.lock:
+                if not self.finished:
+                    self.changed.wait(timeout=max(0.1, PROGRESS_INTERVAL - (time.time() - last_progress)))
+                finished, self.finished = self.finished, []
+            # CSVs, history and exports are written here, off the engine's workers
+            for job in finished:
+                self.finish(job)
+                written += 1
+            if time.time() - last_progress >= PROGRESS_INTERVAL:
+                self.print_progress()
+                last_progress = time.time()
+        self.print_progress()
+        return self.summarize()
+
+    def summarize(self):
+        elapsed = time.time() - self.started_at
+        serp_stats = serp_cache.get_stats()
+        transfer = get_transfer_stats()
+        summary = {
+            'jobs': len(self.jobs),
+            'keywords': self.done,
+            'errors': sum(job.errors for job in self.jobs),
+            'seconds': round(elapsed, 2),
+            'keywords_per_second': round(self.done / elapsed, 2) if elapsed else 0.0,
+            'api_calls': transfer['requests'],
+            'cache_hits': serp_stats['hits'],
+            'negative_cache_hits': negative_cache.get_stats()['empty_hits'] + negative_cache.get_stats()['error_hits'],
+            'coalesced': serp_flights.get_stats()['deduplicated'],
+            'cost': round(sum(job.cost_budget.get_state()['spent'] for job in self.jobs), 6)
+        }
+        print("\n[batch] Throughput summary")
+        for job in self.jobs:
+            seconds = (job.finished_at or time.time()) - job.started_at
+            spend = job.cost_budget.get_state()
+            print(f"  {job.name}: {len(job.results)} keywords in {seconds:.1f}s "
+                  f"({len(job.results) / seconds if seconds else 0.0:.1f}/s), ${spend['spent']:.4f}"
+                  + (" (budget reached)" if job.cost_budget.exceeded() else ""))
+        print(f"  Total: {summary['keywords']} keywords from {summary['jobs']} jobs in {summary['seconds']:.1f}s "
+              f"({summary['keywords_per_second']:.1f} keywords/s)")
+        print(f"  API calls: {summary['api_calls']}, answered from cache: {summary['cache_hits']}, "
+              f"negative cache: {summary['negative_cache_hits']}, shared in flight: {summary['coalesced']}")
+        print(f"  API cost: ${summary['cost']:.4f}" + (f", {summary['errors']} errors" if summary['errors'] else ""))
+        return summary
+
+def pop_option(args, name, convert=str):
+    """Remove --name <value> from args and return the converted value, or None if absent."""
+    if name not in args:
+        return None
+    index = args.index(name)
+    if index + 1 >= len(args):
+        print(f"Error: {name} requires a value")
+        sys.exit(1)
+    value = args[index + 1]
+    del args[index:index + 2]
+    try:
+        return convert(value)
+    except ValueError:
+        print(f"Error: invalid value for {name}: {value}")
+        sys.exit(1)
+
+def print_usage():
+    print("Usage:")
+    print("  python rank_checker.py --batch <config.json|keywords.csv|directory> [...] [options]")
+    print("\nConfig files carry their own settings. Keyword CSVs (given directly or found in a directory) use:")
+    print("  --target <url> [--login <api_login> --password <api_password>] [--test] [--location <code|name>]")
+    print("  [--location-name <name>] [--device <desktop|mobile>] [--profile <name>] [--limit <number>] [--max-cost <usd>]")
+    print("\n--profiling samples the whole run and saves a stage summary and a speedscope flame graph.")
+    print("\nLookups of every job share one fetch engine (FETCH_WORKERS workers), rate limiter and SERP cache.")
+
+def main(args):
+    """Run a batch from command line arguments (without the --batch flag)."""
+    args = list(args)
+    if not args or "--help" in args:
+        print_usage()
+        sys.exit(1)
+    test_mode = "--test" in args
+    if test_mode:
+        args.remove("--test")
+    profiling = "--profiling" in args
+    if profiling:
+        args.remove("--profiling")
+    location = pop_option(args, "--location")
+    defaults = {
+        'target_url': pop_option(args, "--target"),
+        'api_login': pop_option(args, "--login"),
+        'api_password': pop_option(args, "--password"),
+        'location_name': pop_option(args, "--location-name") or '',
+        'device': pop_option(args, "--device") or 'desktop',
+        'profile': pop_option(args, "--profile") or DEFAULT_PROFILE,
+        'limit': pop_option(args, "--limit", int),
+        'max_cost': pop_option(args, "--max-cost", float),
+        'test_mode': test_mode
+    }
+    if location is not None:
+        match = get_location_catalog().find_location(location)
+        defaults['location_code'] = match['location_code'] if match else location
+
+    unknown = [arg for arg in args if arg.startswith('--')]
+    if unknown:
+        print(f"Error: Unknown option(s): {', '.join(unknown)}")
+        print_usage()
+        sys.exit(1)
+
+    # Everything is checked before the first lookup is queued
+    try:
+        jobs = find_jobs(args, defaults)
+        for job in jobs:
+            job.validate()
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    if not jobs:
+        print("Error: No config files or keyword CSVs found")
+        sys.exit(1)
+
+    run = BatchRun(jobs)
+    try:
+        for job in jobs:
+            if not job.test_mode:
+                run.get_client(job)
+    except ValueError:
+        print("Error: API credentials are required when not in test mode")
+        sys.exit(1)
+
+    live_jobs = [job for job in jobs if not job.test_mode]
+    if live_jobs:
+        estimated = sum(estimate_cost([row[job.keyword_column] for row in job.keyword_rows()], job.location_code,
+                                      location_name=job.location_name, device=job.device,
+                                      profile=job.profile)['estimated_cost'] for job in live_jobs)
+        print(f"[batch] Estimated cost: ${estimated:.4f}")
+    profiler = JobProfiler(f"batch-{time.strftime('%Y%m%d-%H%M%S')}", label='batch') if profiling else None
+    profiled(profiler, run.run)()
+    if profiler:
+        print(f"[batch] Profile: {get_profile_path(profiler.profile_id, 'speedscope')} (open in https://www.speedscope.app)")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
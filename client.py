@@ -1,27 +1,146 @@
-from http.client import HTTPSConnection
+import os
+import select
+from http.client import HTTPConnection, HTTPSConnection, HTTPException
+from urllib.parse import urlsplit
 from base64 import b64encode
+from gzip import compress, decompress
 from json import loads
 from json import dumps
+import threading
+from profiling import stage
+
+# Bytes sent and received by all clients, before (raw) and after (wire) gzip
+transfer_stats = {
+    'requests': 0,
+    'request_bytes_raw': 0,
+    'request_bytes_wire': 0,
+    'response_bytes_raw': 0,
+    'response_bytes_wire': 0
+}
+transfer_stats_lock = threading.Lock()
+
+def record_transfer(request_raw, request_wire, response_raw, response_wire):
+    """Add one request/response pair to the transfer counters."""
+    with transfer_stats_lock:
+        transfer_stats['requests'] += 1
+        transfer_stats['request_bytes_raw'] += request_raw
+        transfer_stats['request_bytes_wire'] += request_wire
+        transfer_stats['response_bytes_raw'] += response_raw
+        transfer_stats['response_bytes_wire'] += response_wire
+
+def get_transfer_stats():
+    """Return the transfer counters together with the bytes saved by compression."""
+    with transfer_stats_lock:
+        stats = dict(transfer_stats)
+    raw_total = stats['request_bytes_raw'] + stats['response_bytes_raw']
+    wire_total = stats['request_bytes_wire'] + stats['response_bytes_wire']
+    stats['bytes_saved'] = raw_total - wire_total
+    stats['compression_ratio'] = round(wire_total / raw_total, 3) if raw_total else None
+    return stats
+
+# Requests that may be sent again after the server dropped a reused connection
+# without answering: repeating a POST (task_post, live SERP) could be charged twice
+IDEMPOTENT_METHODS = {'GET', 'HEAD'}
+
+def is_stale(connection):
+    """True when the server closed an idle connection (or sent something unasked) while it was pooled."""
+    if connection.sock is None:
+        return True
+    readable, _, _ = select.select([connection.sock], [], [], 0)
+    return bool(readable)
+
+# API endpoint; DATAFORSEO_API_URL can point at the sandbox
+# (https://sandbox.dataforseo.com) or a local stand-in server
+DEFAULT_API_URL = "https://api.dataforseo.com"
 
 class RestClient:
     domain = "api.dataforseo.com"
 
-    def __init__(self, username, password):
+    def __init__(self, username, password, api_url=None, pool_size=0):
         self.username = username
         self.password = password
+        url = urlsplit(api_url or os.environ.get('DATAFORSEO_API_URL', DEFAULT_API_URL))
+        self.domain = url.netloc
+        self.connection_class = HTTPConnection if url.scheme == 'http' else HTTPSConnection
+        # Response sizes of the calling thread's last request; one client serves many threads
+        self.local = threading.local()
+        # With pool_size > 0, up to that many idle keep-alive connections are reused
+        self.pool_size = pool_size
+        self.idle_connections = []
+        self.pool_lock = threading.Lock()
+
+    @property
+    def last_response_size(self):
+        return getattr(self.local, 'last_response_size', 0)
+
+    @property
+    def last_response_wire_size(self):
+        return getattr(self.local, 'last_response_wire_size', 0)
+
+    def get_connection(self):
+        """Return (connection, reused): an idle pooled connection if one is still open, else a new one."""
+        if self.pool_size:
+            while True:
+                with self.pool_lock:
+                    if not self.idle_connections:
+                        break
+                    connection = self.idle_connections.pop()
+                if not is_stale(connection):
+                    return connection, True
+                connection.close()
+        return self.connection_class(self.domain), False
+
+    def release_connection(self, connection, response):
+        if self.pool_size and not response.will_close:
+            with self.pool_lock:
+                if len(self.idle_connections) < self.pool_size:
+                    self.idle_connections.append(connection)
+                    return
+        connection.close()
 
     def request(self, path, method, data=None):
-        connection = HTTPSConnection(self.domain)
-        try:
-            base64_bytes = b64encode(
-                ("%s:%s" % (self.username, self.password)).encode("ascii")
-                ).decode("ascii")
-            headers = {'Authorization' : 'Basic %s' %  base64_bytes, 'Content-Encoding' : 'gzip'}
-            connection.request(method, path, headers=headers, body=data)
-            response = connection.getresponse()
-            return loads(response.read().decode())
-        finally:
-            connection.close()
+        base64_bytes = b64encode(
+            ("%s:%s" % (self.username, self.password)).encode("ascii")
+            ).decode("ascii")
+        headers = {'Authorization' : 'Basic %s' %  base64_bytes, 'Accept-Encoding' : 'gzip'}
+        body = None
+        request_raw = 0
+        if data is not None:
+            raw_body = data.encode("utf-8")
+            body = compress(raw_body)
+            request_raw = len(raw_body)
+            headers['Content-Type'] = 'application/json'
+            headers['Content-Encoding'] = 'gzip'
+        while True:
+            connection, reused = self.get_connection()
+            sent = False
+            try:
+                with stage('network'):
+                    connection.request(method, path, headers=headers, body=body)
+                    sent = True
+                    response = connection.getresponse()
+                    wire_body = response.read()
+            except (HTTPException, ConnectionError):
+                connection.close()
+                if reused and (not sent or method in IDEMPOTENT_METHODS):
+                    # The server closed the reused connection; send again on a new one unless
+                    # it may have received a request that must not be repeated
+                    continue
+                raise
+            except Exception:
+                connection.close()
+                raise
+            self.release_connection(connection, response)
+            break
+        with stage('decode'):
+            if (response.getheader('Content-Encoding') or '').lower() == 'gzip':
+                raw_response = decompress(wire_body)
+            else:
+                raw_response = wire_body
+            self.local.last_response_size = len(raw_response)
+            self.local.last_response_wire_size = len(wire_body)
+            record_transfer(request_raw, len(body) if body else 0, len(raw_response), len(wire_body))
+            return loads(raw_response.decode())
 
     def get(self, path):
         return self.request(path, 'GET')
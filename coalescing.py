@@ -0,0 +1,88 @@
+import threading
+
+class Flight:
+    """One in-progress call that later callers can wait on."""
+    __slots__ = ('event', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one execution.
+
+    The first caller for a key runs the function; callers arriving while it
+    is still running wait and receive the same result (or exception).
+    Nothing is remembered once the call finishes; caching is left to the
+    caller.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}
+        self.stats = {'calls': 0, 'executions': 0, 'deduplicated': 0}
+
+    def do(self, key, fn):
+        with self.lock:
+            self.stats['calls'] += 1
+            flight = self.flights.get(key)
+            if flight is not None:
+                flight.waiters += 1
+                self.stats['deduplicated'] += 1
+                leader = False
+            else:
+                flight = self.flights[key] = Flight()
+                self.stats['executions'] += 1
+                leader = True
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn()
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.event.set()
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats, in_flight=len(self.flights))
+
+class AsyncSingleFlight:
+    """asyncio version of SingleFlight for coroutines on one event loop."""
+    def __init__(self):
+        self.flights = {}
+        self.stats = {'calls': 0, 'executions': 0, 'deduplicated': 0}
+
+    async def do(self, key, coroutine_fn):
+        # Imported here so the threaded code path never loads asyncio
+        import asyncio
+        self.stats['calls'] += 1
+        future = self.flights.get(key)
+        if future is not None:
+            self.stats['deduplicated'] += 1
+            # shield() keeps one cancelled waiter from cancelling the shared call
+            return await asyncio.shield(future)
+
+        self.stats['executions'] += 1
+        future = asyncio.ensure_future(coroutine_fn())
+        self.flights[key] = future
+        try:
+            return await asyncio.shield(future)
+        finally:
+            if future.done():
+                self.flights.pop(key, None)
+            else:
+                future.add_done_callback(lambda done: self.flights.pop(key, None))
+
+    def get_stats(self):
+        return dict(self.stats, in_flight=len(self.flights))
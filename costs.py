@@ -0,0 +1,100 @@
+import os
+import threading
+
+# Price assumed for a live SERP call before any real cost has been observed
+DEFAULT_COST_PER_CALL = float(os.environ.get('DATAFORSEO_COST_PER_CALL', '0.004'))
+
+# Ranking value of lookups skipped because the job's budget ran out
+BUDGET_EXCEEDED = "Budget Exceeded"
+
+def get_response_cost(response):
+    """Return the cost DataForSEO charged for a response, in USD."""
+    cost = response.get("cost")
+    if cost is None:
+        cost = sum(task.get("cost") or 0 for task in response.get("tasks") or [])
+    return float(cost or 0)
+
+class CostBudget:
+    """Tracks the API spend of one job or request, optionally with a hard cap.
+
+    Each call reserves its expected cost before it is sent, so concurrent
+    lookups of the same job cannot overshoot max_cost, and settles the
+    real cost when the response arrives.
+    """
+    def __init__(self, max_cost=None):
+        self.max_cost = max_cost
+        self.spent = 0.0
+        self.reserved = 0.0
+        self.calls = 0
+        self.refused = 0
+        self.lock = threading.Lock()
+
+    def try_reserve(self, estimate):
+        """Reserve the expected cost of one call. Returns False once the cap would be passed."""
+        with self.lock:
+            if self.max_cost is not None and self.spent + self.reserved + estimate > self.max_cost + 1e-9:
+                self.refused += 1
+                return False
+            self.reserved += estimate
+            return True
+
+    def settle(self, estimate, cost):
+        """Replace a reservation with the cost actually charged."""
+        with self.lock:
+            self.reserved = max(0.0, self.reserved - estimate)
+            self.spent += cost
+            self.calls += 1
+
+    def exceeded(self):
+        with self.lock:
+            return self.refused > 0
+
+    def get_state(self):
+        with self.lock:
+            return {
+                'spent': round(self.spent, 6),
+                'max_cost': self.max_cost,
+                'remaining': round(self.max_cost - self.spent, 6) if self.max_cost is not None else None,
+                'calls': self.calls,
+                'refused_calls': self.refused
+            }
+
+class CostTracker:
+    """Process-wide API spend per credential and per request profile."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.total = {'cost': 0.0, 'calls': 0}
+        self.credentials = {}
+        self.profiles = {}
+
+    def record(self, credential, profile_name, cost):
+        with self.lock:
+            for totals in (self.total,
+                           self.credentials.setdefault(credential or 'unknown', {'cost': 0.0, 'calls': 0}),
+                           self.profiles.setdefault(profile_name, {'cost': 0.0, 'calls': 0})):
+                totals['cost'] += cost
+                totals['calls'] += 1
+
+    def average_cost(self, profile_name):
+        """Average observed cost of one call for a profile, or the default price."""
+        with self.lock:
+            totals = self.profiles.get(profile_name)
+            if totals and totals['calls'] and totals['cost']:
+                return totals['cost'] / totals['calls']
+        return DEFAULT_COST_PER_CALL
+
+    def get_stats(self):
+        def summarize(totals):
+            return {
+                'cost': round(totals['cost'], 6),
+                'calls': totals['calls'],
+                'avg_cost': round(totals['cost'] / totals['calls'], 6) if totals['calls'] else 0.0
+            }
+        with self.lock:
+            return dict(
+                summarize(self.total),
+                credentials={name: summarize(totals) for name, totals in self.credentials.items()},
+                profiles={name: summarize(totals) for name, totals in self.profiles.items()}
+            )
+
+cost_tracker = CostTracker()
@@ -0,0 +1,268 @@
+import hmac
+import json
+import os
+import threading
+import time
+from client import RestClient
+from resilience import RateLimiter
+from profiling import stage
+from fetch_engine import has_priority
+
+# A pool of DataForSEO accounts that share the load of every job. Accounts
+# come from DATAFORSEO_ACCOUNTS (a JSON list) or DATAFORSEO_ACCOUNTS_FILE:
+#   [{"login": "...", "password": "...", "calls_per_second": 2, "burst": 2, "daily_limit": 5000}, ...]
+# Each account has its own rate limiter and keep-alive connections. Calls go
+# to the healthy account with the most quota left, and move on to the next
+# account when one reports an auth error, exhausted funds or a rate limit.
+
+# Status codes that take an account out of rotation
+AUTH_ERROR_CODES = {
+    40100,  # Not authorized
+    40101,  # Authentication failed
+    40104,  # Account not activated
+    40201   # Account blocked
+}
+QUOTA_ERROR_CODES = {
+    40200,  # Payment required
+    40210   # Insufficient funds
+}
+RATE_LIMIT_CODES = {
+    40202,  # Rate limit per minute exceeded
+    40203,  # Rate limit per day exceeded
+    40209   # Too many simultaneous requests
+}
+
+# How long an account sits out after each kind of failure
+RATE_LIMIT_COOLDOWN = float(os.environ.get('DATAFORSEO_RATE_LIMIT_COOLDOWN', '60'))
+ACCOUNT_ERROR_COOLDOWN = float(os.environ.get('DATAFORSEO_ACCOUNT_ERROR_COOLDOWN', '3600'))
+NETWORK_ERROR_COOLDOWN = 30.0
+
+# Consecutive network errors before an account sits out
+MAX_NETWORK_ERRORS = 3
+
+# API requests and schedules without credentials may use the pool only when
+# this is set; otherwise anyone who can reach the API could spend its funds
+POOL_FOR_ANONYMOUS = os.environ.get('RANK_POOL_FOR_ANONYMOUS', '').lower() in ('1', 'true', 'yes')
+
+# Idle keep-alive connections kept per account
+CONNECTIONS_PER_ACCOUNT = int(os.environ.get('DATAFORSEO_CONNECTIONS_PER_ACCOUNT', '4'))
+
+def get_failure_code(response):
+    """Return the top-level or first task-level status code that says the account itself failed, else None."""
+    codes = [response.get('status_code')] + [task.get('status_code') for task in response.get('tasks') or []]
+    for code in codes:
+        if code in AUTH_ERROR_CODES or code in QUOTA_ERROR_CODES or code in RATE_LIMIT_CODES:
+            return code
+    return None
+
+class PoolAccount:
+    """One account of the pool with its own client, rate limiter, quota and health."""
+    def __init__(self, login, password, calls_per_second=2, burst=2, daily_limit=None, api_url=None):
+        self.login = login
+        self.password = password
+        self.client = RestClient(login, password, api_url=api_url, pool_size=CONNECTIONS_PER_ACCOUNT)
+        self.rate_limiter = RateLimiter(float(calls_per_second), burst=int(burst))
+        self.daily_limit = int(daily_limit) if daily_limit else None
+        self.day = time.strftime('%Y-%m-%d')
+        self.calls_today = 0
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self.last_error = None
+        self.network_errors = 0
+        self.stats = {'calls': 0, 'failovers': 0, 'auth_errors': 0, 'quota_errors': 0,
+                      'rate_limited': 0, 'network_errors': 0}
+
+    def remaining(self):
+        """Calls left today, or None without a daily limit."""
+        today = time.strftime('%Y-%m-%d')
+        if today != self.day:
+            self.day = today
+            self.calls_today = 0
+        if self.daily_limit is None:
+            return None
+        return max(0, self.daily_limit - self.calls_today)
+
+    def is_available(self, now):
+        return now >= self.cooldown_until and self.remaining() != 0
+
+    def get_state(self, now):
+        return {
+            'login': self.login,
+            'available': self.is_available(now),
+            'cooldown_seconds': round(max(0.0, self.cooldown_until - now), 1),
+            'last_error': self.last_error,
+            'calls_today': self.calls_today,
+            'daily_limit': self.daily_limit,
+            'remaining': self.remaining(),
+            'in_flight': self.in_flight,
+            **self.stats
+        }
+
+class CredentialPool:
+    """Spreads API calls over several accounts; has the get/post surface of RestClient.
+
+    Pacing is per account, so rank_checker skips its process-wide rate
+    limiter for pool calls (paces_requests).
+    """
+    paces_requests = True
+
+    def __init__(self, accounts):
+        if not accounts:
+            raise ValueError("A credential pool needs at least one account")
+        self.accounts = accounts
+        self.lock = threading.Lock()
+        # Which account served the calling thread's last request, for cost and size accounting
+        self.local = threading.local()
+
+    @property
+    def username(self):
+        return getattr(self.local, 'username', None)
+
+    @property
+    def last_response_size(self):
+        return getattr(self.local, 'last_response_size', 0)
+
+    def has_account(self, login, password):
+        """True when login and password are those of one of the pool's accounts."""
+        return any(account.login == login and hmac.compare_digest(str(password or ''), account.password)
+                   for account in self.accounts)
+
+    def get_account(self, login):
+        """The pool account with this login, or None."""
+        return next((account for account in self.accounts if account.login == login), None)
+
+    def select(self, exclude=()):
+        """Reserve the available account with the most quota left, least busy first. None if all sit out."""
+        with self.lock:
+            now = time.time()
+            candidates = [account for account in self.accounts
+                          if account not in exclude and account.is_available(now)]
+            if not candidates:
+                return None
+            # Accounts without a daily limit rank above any limited one
+            account = max(candidates, key=lambda account: (
+                float('inf') if account.remaining() is None else account.remaining(), -account.in_flight))
+            account.in_flight += 1
+            account.calls_today += 1
+            account.stats['calls'] += 1
+            if exclude:
+                account.stats['failovers'] += 1
+            return account
+
+    def release(self, account, failure_code=None, network_error=False):
+        """Record the outcome of a call and put the account in cooldown if it failed."""
+        with self.lock:
+            account.in_flight -= 1
+            if network_error:
+                account.stats['network_errors'] += 1
+                account.network_errors += 1
+                account.last_error = 'network error'
+                if account.network_errors >= MAX_NETWORK_ERRORS:
+                    account.cooldown_until = time.time() + NETWORK_ERROR_COOLDOWN
+                    account.network_errors = 0
+                return
+            account.network_errors = 0
+            if failure_code is None:
+                return
+            account.last_error = failure_code
+            if failure_code in RATE_LIMIT_CODES:
+                account.stats['rate_limited'] += 1
+                cooldown = RATE_LIMIT_COOLDOWN
+            elif failure_code in QUOTA_ERROR_CODES:
+                account.stats['quota_errors'] += 1
+                cooldown = ACCOUNT_ERROR_COOLDOWN
+            else:
+                account.stats['auth_errors'] += 1
+                cooldown = ACCOUNT_ERROR_COOLDOWN
+            account.cooldown_until = time.time() + cooldown
+
+    def request(self, path, method, data=None):
+        tried = []
+        response = None
+        while True:
+            account = self.select(exclude=tried)
+            if account is None:
+                if response is not None:
+                    # Every account failed this call; hand the last answer to the retry logic
+                    return response
+                raise RuntimeError("No API account available: every account in the pool is cooling down")
+            tried.append(account)
+            with stage('rate_limit'):
+                account.rate_limiter.acquire(priority=has_priority())
+            try:
+                response = account.client.request(path, method, data)
+            except Exception as e:
+                self.release(account, network_error=True)
+                print(f"API account {account.login} failed: {e}")
+                if len(tried) < len(self.accounts):
+                    continue
+                raise
+            failure_code = get_failure_code(response)
+            self.release(account, failure_code)
+            self.local.username = account.login
+            self.local.last_response_size = account.client.last_response_size
+            if failure_code is None:
+                return response
+            print(f"API account {account.login} returned {failure_code}; failing over")
+
+    def get(self, path):
+        return self.request(path, 'GET')
+
+    def post(self, path, data):
+        return self.request(path, 'POST', data if isinstance(data, str) else json.dumps(data))
+
+    def get_stats(self):
+        with self.lock:
+            now = time.time()
+            accounts = [account.get_state(now) for account in self.accounts]
+        return {
+            'accounts': accounts,
+            'available': sum(1 for account in accounts if account['available'])
+        }
+
+def load_accounts():
+    """Read the account list from DATAFORSEO_ACCOUNTS or DATAFORSEO_ACCOUNTS_FILE; empty if neither is set."""
+    raw = os.environ.get('DATAFORSEO_ACCOUNTS')
+    path = os.environ.get('DATAFORSEO_ACCOUNTS_FILE')
+    if not raw and path:
+        with open(path, 'r') as file:
+            raw = file.read()
+    if not raw:
+        return []
+    accounts = []
+    for entry in json.loads(raw):
+        accounts.append(PoolAccount(entry['login'], entry['password'],
+                                    calls_per_second=entry.get('calls_per_second', 2),
+                                    burst=entry.get('burst', 2),
+                                    daily_limit=entry.get('daily_limit')))
+    return accounts
+
+credential_pool = None
+credential_pool_loaded = False
+credential_pool_lock = threading.Lock()
+
+def get_credential_pool():
+    """The process-wide credential pool, or None when no accounts are configured."""
+    global credential_pool, credential_pool_loaded
+    if not credential_pool_loaded:
+        with credential_pool_lock:
+            if not credential_pool_loaded:
+                accounts = load_accounts()
+                credential_pool = CredentialPool(accounts) if accounts else None
+                credential_pool_loaded = True
+    return credential_pool
+
+def make_client(api_login=None, api_password=None):
+    """Client for a job: the pool when no credentials are given or they are those of a pool account, else a RestClient.
+
+    Callers that serve untrusted requests decide whether requests without
+    credentials may use the pool before calling this.
+    """
+    pool = get_credential_pool()
+    if not api_login or not api_password:
+        if pool is None:
+            raise ValueError("No API credentials given and no credential pool configured")
+        return pool
+    if pool is not None and pool.has_account(api_login, api_password):
+        return pool
+    return RestClient(api_login, api_password)
@@ -0,0 +1,246 @@
+import json
+import os
+
+# Columnar export of ranking results. Parquet and Arrow need pyarrow, which
+# requirements.txt installs; without it only NDJSON can be written.
+
+FORMAT_PARQUET = 'parquet'
+FORMAT_ARROW = 'arrow'
+FORMAT_NDJSON = 'ndjson'
+EXPORT_FORMATS = (FORMAT_PARQUET, FORMAT_ARROW, FORMAT_NDJSON)
+
+CONTENT_TYPES = {
+    FORMAT_PARQUET: 'application/vnd.apache.parquet',
+    FORMAT_ARROW: 'application/vnd.apache.arrow.stream',
+    FORMAT_NDJSON: 'application/x-ndjson'
+}
+
+FILE_EXTENSIONS = {
+    '.parquet': FORMAT_PARQUET,
+    '.arrow': FORMAT_ARROW,
+    '.arrows': FORMAT_ARROW,
+    '.ndjson': FORMAT_NDJSON,
+    '.jsonl': FORMAT_NDJSON
+}
+
+# Rows per Parquet row group / Arrow record batch
+ROW_GROUP_SIZE = int(os.environ.get('EXPORT_ROW_GROUP_SIZE', '100000'))
+
+# Column name and type of every exported row. status is 'ranked',
+# 'not_ranked' or the error returned for the lookup.
+COLUMNS = (
+    ('domain', 'string'),
+    ('keyword', 'string'),
+    ('location_code', 'int32'),
+    ('location_name', 'string'),
+    ('device', 'string'),
+    ('date', 'date'),
+    ('position', 'int16'),
+    ('rank_group', 'int16'),
+    ('rank_absolute', 'int16'),
+    ('status', 'string'),
+    ('checked_at', 'timestamp')
+)
+COLUMN_NAMES = tuple(name for name, column_type in COLUMNS)
+
+def get_pyarrow():
+    """Return (pyarrow, pyarrow.parquet), or None when pyarrow is not installed."""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        return None
+    return pyarrow, pyarrow.parquet
+
+def available_formats():
+    return list(EXPORT_FORMATS) if get_pyarrow() else [FORMAT_NDJSON]
+
+def resolve_format(requested=None):
+    """Return the format to write: the requested one, or by default Parquet (NDJSON when pyarrow is missing).
+
+    Raises ValueError for an unknown format, or for Parquet or Arrow asked
+    for explicitly when pyarrow is not installed.
+    """
+    if not requested:
+        return FORMAT_PARQUET if get_pyarrow() else FORMAT_NDJSON
+    requested = requested.lower()
+    if requested not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format '{requested}'. Available: {', '.join(EXPORT_FORMATS)}")
+    if requested != FORMAT_NDJSON and get_pyarrow() is None:
+        raise ValueError(f"Export format '{requested}' needs pyarrow, which is not installed. Available: {FORMAT_NDJSON}")
+    return requested
+
+def result_row(domain, keyword, location_code, location_name, device, check_date, ranking_info, checked_at):
+    """Build an export row from one (keyword, ranking_info) result."""
+    position = rank_group = rank_absolute = None
+    if isinstance(ranking_info, dict):
+        position = ranking_info.get('position')
+        rank_group = ranking_info.get('rank_group')
+        rank_absolute = ranking_info.get('rank_absolute')
+        status = 'ranked'
+    elif ranking_info == "Not in top results":
+        status = 'not_ranked'
+    else:
+        status = str(ranking_info)
+    return {
+        'domain': domain,
+        'keyword': keyword,
+        'location_code': int(location_code),
+        'location_name': location_name or '',
+        'device': device,
+        'date': check_date,
+        'position': position,
+        'rank_group': rank_group,
+        'rank_absolute': rank_absolute,
+        'status': status,
+        'checked_at': int(checked_at)
+    }
+
+def history_row(row):
+    """Add the status column to a rank history row."""
+    row['status'] = 'ranked' if row['position'] is not None else 'not_ranked'
+    return row
+
+def get_arrow_schema(pa):
+    arrow_types = {
+        'string': pa.string(),
+        'int32': pa.int32(),
+        'int16': pa.int16(),
+        'date': pa.date32(),
+        'timestamp': pa.timestamp('s', tz='UTC')
+    }
+    return pa.schema([(name, arrow_types[column_type]) for name, column_type in COLUMNS])
+
+def to_record_batch(pa, schema, rows):
+    """Build one typed Arrow record batch from a list of row dicts."""
+    arrays = []
+    for field in schema:
+        values = [row.get(field.name) for row in rows]
+        if pa.types.is_date32(field.type):
+            # Dates are stored as ISO strings; Arrow parses them in C
+            arrays.append(pa.array(values, pa.string()).cast(field.type))
+        else:
+            arrays.append(pa.array(values, field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+class ChunkSink:
+    """Write-only file object that collects bytes until they are drained.
+
+    Lets Parquet and Arrow writers produce output piece by piece for an
+    HTTP response instead of into a file or one large buffer.
+    """
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def writable(self):
+        return True
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+class ExportWriter:
+    """Writes result rows to a binary file object in row groups.
+
+    Rows are buffered until row_group_size is reached, then written as one
+    Parquet row group, Arrow record batch or block of NDJSON lines, so at
+    most one row group is held in memory.
+    """
+    def __init__(self, sink, export_format, row_group_size=ROW_GROUP_SIZE, close_sink=False):
+        self.sink = sink
+        self.close_sink = close_sink
+        self.format = export_format
+        self.row_group_size = max(1, row_group_size)
+        self.buffer = []
+        self.rows_written = 0
+        self.writer = None
+        if export_format != FORMAT_NDJSON:
+            pa, pq = get_pyarrow()
+            self.pa = pa
+            self.schema = get_arrow_schema(pa)
+            if export_format == FORMAT_PARQUET:
+                self.writer = pq.ParquetWriter(sink, self.schema, compression='zstd')
+            else:
+                self.writer = pa.ipc.new_stream(sink, self.schema)
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.buffer.append(row)
+            if len(self.buffer) >= self.row_group_size:
+                self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        if self.format == FORMAT_NDJSON:
+            self.sink.write(''.join(json.dumps(row) + '\n' for row in self.buffer).encode('utf-8'))
+        else:
+            self.writer.write_batch(to_record_batch(self.pa, self.schema, self.buffer))
+        self.rows_written += len(self.buffer)
+        self.buffer = []
+
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+        if self.close_sink:
+            self.sink.close()
+
+def stream_export(rows, export_format, row_group_size=ROW_GROUP_SIZE):
+    """Yield an export of rows as bytes, one row group at a time."""
+    sink = ChunkSink()
+    writer = ExportWriter(sink, export_format, row_group_size)
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= writer.row_group_size:
+            writer.write_rows(chunk)
+            chunk = []
+            data = sink.drain()
+            if data:
+                yield data
+    writer.write_rows(chunk)
+    writer.close()
+    data = sink.drain()
+    if data:
+        yield data
+
+def resolve_export_path(path, export_format=None):
+    """Return (format, path) for an export file.
+
+    A format given explicitly or by a known extension (.parquet, .arrow,
+    .ndjson) is used as is, and Parquet or Arrow raise ValueError without
+    pyarrow. Any other path gets the default format, which is NDJSON
+    without pyarrow; the path then gets an .ndjson extension.
+    """
+    requested = export_format or FILE_EXTENSIONS.get(os.path.splitext(path)[1].lower())
+    export_format = resolve_format(requested)
+    if requested is None and export_format == FORMAT_NDJSON:
+        path = os.path.splitext(path)[0] + '.ndjson'
+    return export_format, path
+
+def open_export(path, export_format=None, row_group_size=ROW_GROUP_SIZE):
+    """Open an ExportWriter on a file. Returns (writer, path); closing the writer closes the file.
+
+    Raises ValueError for a Parquet or Arrow file without pyarrow (see resolve_export_path).
+    """
+    export_format, path = resolve_export_path(path, export_format)
+    return ExportWriter(open(path, 'wb'), export_format, row_group_size, close_sink=True), path
@@ -0,0 +1,151 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from profiling import current_profiler
+
+# Priority classes, highest first
+LANE_INTERACTIVE = 'interactive'
+LANE_BULK = 'bulk'
+LANES = (LANE_INTERACTIVE, LANE_BULK)
+
+# Lane of the task the current worker thread is running
+local = threading.local()
+
+def current_lane():
+    """Lane of the task running on this thread, or None outside the engine."""
+    return getattr(local, 'lane', None)
+
+def has_priority():
+    """True unless this thread runs bulk work; rate limiters serve such callers first."""
+    return current_lane() != LANE_BULK
+
+class FetchEngine:
+    """Shared worker pool that runs keyword lookups for every job in the process.
+
+    Work is queued per job (or tenant) inside a priority lane. Workers always
+    serve the interactive lane first and take one task at a time from each
+    job in round-robin order, so a large bulk upload cannot starve a small
+    one. Because every task is a single keyword, a newly submitted
+    interactive request overtakes bulk work at the next keyword boundary.
+    A few workers are reserved for the interactive lane so it never waits
+    behind a full pool of bulk lookups.
+    """
+    def __init__(self, workers=8, reserved_interactive=2):
+        self.workers = max(1, workers)
+        self.reserved_interactive = min(reserved_interactive, self.workers - 1)
+        self.condition = threading.Condition()
+        # lane -> {job_key: deque of (future, fn, args, kwargs)}
+        self.queues = {lane: {} for lane in LANES}
+        # lane -> round-robin order of job keys with queued work
+        self.rotation = {lane: deque() for lane in LANES}
+        self.threads = []
+        self.stats = {lane: {'submitted': 0, 'completed': 0} for lane in LANES}
+
+    def start(self):
+        with self.condition:
+            if self.threads:
+                return
+            for index in range(self.workers):
+                interactive_only = index < self.reserved_interactive
+                thread = threading.Thread(target=self.worker, args=(interactive_only,))
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+
+    def submit(self, fn, *args, lane=LANE_BULK, job_key=None, **kwargs):
+        """Queue fn(*args, **kwargs) and return a Future for its result."""
+        if lane not in LANES:
+            raise ValueError(f"Unknown lane '{lane}'. Available: {', '.join(LANES)}")
+        if not self.threads:
+            self.start()
+        # Lookups of a profiled job are profiled on whichever worker runs them
+        profiler = current_profiler()
+        if profiler is not None:
+            fn = profiler.wrap(fn, queued_at=time.perf_counter())
+        future = Future()
+        with self.condition:
+            job_queue = self.queues[lane].get(job_key)
+            if job_queue is None:
+                job_queue = self.queues[lane][job_key] = deque()
+                self.rotation[lane].append(job_key)
+            job_queue.append((future, fn, args, kwargs))
+            self.stats[lane]['submitted'] += 1
+            # Wake everyone: a reserved interactive worker cannot take bulk work
+            self.condition.notify_all()
+        return future
+
+    def map(self, fn, items, lane=LANE_BULK, job_key=None):
+        """Submit fn(item) for every item and return the results in order."""
+        futures = [self.submit(fn, item, lane=lane, job_key=job_key) for item in items]
+        return [future.result() for future in futures]
+
+    def next_task(self, interactive_only):
+        """Pop the next task by lane priority and round-robin across jobs. Caller holds the lock."""
+        lanes = (LANE_INTERACTIVE,) if interactive_only else LANES
+        for lane in lanes:
+            rotation = self.rotation[lane]
+            if not rotation:
+                continue
+            job_key = rotation.popleft()
+            job_queue = self.queues[lane][job_key]
+            task = job_queue.popleft()
+            if job_queue:
+                rotation.append(job_key)
+            else:
+                del self.queues[lane][job_key]
+            return lane, task
+        return None, None
+
+    def worker(self, interactive_only):
+        while True:
+            with self.condition:
+                lane, task = self.next_task(interactive_only)
+                while task is None:
+                    self.condition.wait()
+                    lane, task = self.next_task(interactive_only)
+
+            future, fn, args, kwargs = task
+            if not future.set_running_or_notify_cancel():
+                continue
+            local.lane = lane
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                local.lane = None
+            with self.condition:
+                self.stats[lane]['completed'] += 1
+
+    def get_stats(self):
+        with self.condition:
+            return {
+                'workers': self.workers,
+                'reserved_interactive': self.reserved_interactive,
+                'lanes': {
+                    lane: {
+                        'queued': sum(len(queue) for queue in self.queues[lane].values()),
+                        'jobs': len(self.queues[lane]),
+                        'submitted': self.stats[lane]['submitted'],
+                        'completed': self.stats[lane]['completed']
+                    }
+                    for lane in LANES
+                }
+            }
+
+# Shared engine, created on first use
+fetch_engine = None
+fetch_engine_lock = threading.Lock()
+
+def get_fetch_engine():
+    """Return the process-wide FetchEngine."""
+    global fetch_engine
+    with fetch_engine_lock:
+        if fetch_engine is None:
+            fetch_engine = FetchEngine(
+                workers=int(os.environ.get('FETCH_WORKERS', '32')),
+                reserved_interactive=int(os.environ.get('FETCH_RESERVED_INTERACTIVE', '2'))
+            )
+        return fetch_engine
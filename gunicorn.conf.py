@@ -0,0 +1,30 @@
+import os
+import time
+
+# Gunicorn settings and lifecycle hooks. Importing app.py has no side
+# effects, so the app can be preloaded once in the master and forked into
+# workers; background services start here, once per worker.
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', '4'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+boot_started_at = time.perf_counter()
+
+def when_ready(server):
+    # With preload_app this includes importing the app
+    from services import record_startup
+    seconds = time.perf_counter() - boot_started_at
+    record_startup('master_boot_seconds', seconds)
+    server.log.info(f"Master ready in {seconds:.3f}s (preload_app={preload_app})")
+
+def post_fork(server, worker):
+    worker.forked_at = time.perf_counter()
+
+def post_worker_init(worker):
+    from services import record_startup, start_services
+    start_services()
+    seconds = time.perf_counter() - worker.forked_at
+    record_startup('worker_boot_seconds', seconds)
+    worker.log.info(f"Worker {worker.pid} booted in {seconds:.3f}s")
@@ -0,0 +1,192 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+# Job records live in SQLite so every gunicorn worker sees every job
+DEFAULT_JOBS_DB = os.environ.get('RANK_JOBS_DB', os.path.join('data', 'jobs.db'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    schedule_id TEXT,
+    params TEXT NOT NULL DEFAULT '{}',
+    total_keywords INTEGER NOT NULL DEFAULT 0,
+    processed_keywords INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    csv_file_path TEXT,
+    original_filename TEXT,
+    cost REAL NOT NULL DEFAULT 0,
+    max_cost REAL,
+    created_at INTEGER NOT NULL,
+    started_at INTEGER,
+    finished_at INTEGER
+);
+
+CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs (created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_schedule ON jobs (schedule_id, created_at);
+
+-- Results spilled from memory by long jobs; ranking columns are untyped so
+-- positions stay integers next to values like 'Not in top results'
+CREATE TABLE IF NOT EXISTS job_results (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    keyword TEXT NOT NULL,
+    ranking,
+    rank_group,
+    rank_absolute,
+    device TEXT,
+    PRIMARY KEY (job_id, seq)
+) WITHOUT ROWID;
+"""
+
+# Columns added after the first release, created on databases that predate them
+ADDED_COLUMNS = {
+    'cost': "REAL NOT NULL DEFAULT 0",
+    'max_cost': "REAL"
+}
+
+# Job kinds
+JOB_UPLOAD = 'upload'
+JOB_SCHEDULED = 'scheduled'
+JOB_POSTBACK = 'postback'
+
+# Job statuses
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_COMPLETED = 'completed'
+STATUS_FAILED = 'failed'
+
+UPDATABLE_FIELDS = {
+    'status', 'total_keywords', 'processed_keywords', 'error',
+    'csv_file_path', 'original_filename', 'cost', 'max_cost', 'started_at', 'finished_at'
+}
+
+class JobStore:
+    """Persistent job records shared by all worker processes."""
+    def __init__(self, db_path=DEFAULT_JOBS_DB):
+        self.db_path = db_path
+        self.local = threading.local()
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = self.get_connection()
+        connection.executescript(SCHEMA)
+        existing = {row['name'] for row in connection.execute("PRAGMA table_info(jobs)")}
+        with connection:
+            for name, definition in ADDED_COLUMNS.items():
+                if name not in existing:
+                    connection.execute(f"ALTER TABLE jobs ADD COLUMN {name} {definition}")
+
+    def get_connection(self):
+        """Return this thread's connection, opening it on first use."""
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+        return connection
+
+    def create_job(self, kind, params=None, schedule_id=None, job_id=None, **fields):
+        """Create a queued job and return its ID."""
+        job_id = job_id or uuid.uuid4().hex
+        connection = self.get_connection()
+        with connection:
+            connection.execute(
+                "INSERT INTO jobs (id, kind, status, schedule_id, params, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, kind, STATUS_QUEUED, schedule_id, json.dumps(params or {}), int(time.time())))
+        if fields:
+            self.update_job(job_id, **fields)
+        return job_id
+
+    def update_job(self, job_id, **fields):
+        """Update progress or status fields of a job."""
+        unknown = set(fields) - UPDATABLE_FIELDS
+        if unknown:
+            raise ValueError(f"Unknown job fields: {', '.join(sorted(unknown))}")
+        if not fields:
+            return
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        connection = self.get_connection()
+        with connection:
+            connection.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def start_job(self, job_id, total_keywords=0):
+        self.update_job(job_id, status=STATUS_RUNNING, total_keywords=total_keywords, started_at=int(time.time()))
+
+    def finish_job(self, job_id, error=None):
+        self.update_job(job_id,
+                        status=STATUS_FAILED if error else STATUS_COMPLETED,
+                        error=error,
+                        finished_at=int(time.time()))
+
+    def get_job(self, job_id):
+        row = self.get_connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return job_from_row(row) if row else None
+
+    def list_jobs(self, status=None, schedule_id=None, limit=50):
+        """Return the most recent jobs, newest first."""
+        query = "SELECT * FROM jobs WHERE 1 = 1"
+        params = []
+        if status:
+            query += " AND status = ?"
+            params.append(status)
+        if schedule_id:
+            query += " AND schedule_id = ?"
+            params.append(schedule_id)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit)
+        return [job_from_row(row) for row in self.get_connection().execute(query, params)]
+
+    def add_results(self, job_id, start_seq, rows):
+        """Store (keyword, ranking, rank_group, rank_absolute, device) rows of a job from position start_seq on."""
+        connection = self.get_connection()
+        with connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO job_results (job_id, seq, keyword, ranking, rank_group, rank_absolute, device) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(job_id, start_seq + index, *row) for index, row in enumerate(rows)])
+
+    def get_results(self, job_id, offset=0, limit=None):
+        """Return stored result rows of a job in order, as tuples."""
+        cursor = self.get_connection().execute(
+            "SELECT keyword, ranking, rank_group, rank_absolute, device FROM job_results "
+            "WHERE job_id = ? AND seq >= ? ORDER BY seq LIMIT ?",
+            (job_id, offset, -1 if limit is None else limit))
+        return [tuple(row) for row in cursor]
+
+    def count_results(self, job_id):
+        return self.get_connection().execute(
+            "SELECT COUNT(*) FROM job_results WHERE job_id = ?", (job_id,)).fetchone()[0]
+
+    def purge_results(self, finished_before):
+        """Delete the stored results of jobs that finished before a timestamp. Returns the number of rows removed."""
+        connection = self.get_connection()
+        with connection:
+            cursor = connection.execute(
+                "DELETE FROM job_results WHERE job_id IN (SELECT id FROM jobs WHERE finished_at < ?)",
+                (int(finished_before),))
+        return cursor.rowcount
+
+def job_from_row(row):
+    job = dict(row)
+    job['params'] = json.loads(job['params'] or '{}')
+    return job
+
+# Shared store, created on first use
+job_store = None
+job_store_lock = threading.Lock()
+
+def get_job_store():
+    """Return the process-wide JobStore."""
+    global job_store
+    with job_store_lock:
+        if job_store is None:
+            job_store = JobStore()
+        return job_store
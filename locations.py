@@ -0,0 +1,269 @@
+import difflib
+import json
+import os
+import sys
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left
+
+# Local catalog of DataForSEO locations and languages, read from a JSON
+# snapshot so that inputs can be checked (and autocompleted) without a paid
+# request. The bundled snapshot lists countries and languages; refresh it with
+# the full location list (cities, regions) using:
+#   python locations.py --refresh [api_login api_password]
+# Only a refreshed snapshot ("complete": true) rejects unknown codes; the
+# bundled one is advisory and passes codes it does not know through.
+
+CATALOG_FILE = os.environ.get('RANK_LOCATIONS_FILE',
+                              os.path.join(os.path.dirname(os.path.abspath(__file__)), 'locations.json'))
+
+# Broader places first in suggestions: "ind" should offer India before Indiana
+LOCATION_TYPE_ORDER = {'Country': 0, 'State': 1, 'Region': 1, 'Province': 1, 'Territory': 1, 'City': 2}
+
+def normalize_text(text):
+    """Lower-case, accent-free, single-spaced form of a name; commas and hyphens count as spaces."""
+    text = unicodedata.normalize('NFKD', str(text))
+    text = ''.join(char for char in text if not unicodedata.combining(char)).lower()
+    for separator in (',', '-', '.', '/', '(', ')'):
+        text = text.replace(separator, ' ')
+    return ' '.join(text.split())
+
+def word_suffixes(text):
+    """'mumbai maharashtra india' -> itself, 'maharashtra india' and 'india', so any word can start a match."""
+    words = text.split()
+    return [' '.join(words[index:]) for index in range(len(words))]
+
+class PrefixIndex:
+    """Prefix search over names through a sorted array of their word suffixes.
+
+    A prefix matches one contiguous range of the array, found by bisection.
+    One- and two-letter prefixes match large ranges, so their best entries
+    are worked out once when the index is built.
+    """
+    SHORT_PREFIX = 2
+
+    def __init__(self, names, rank, top=25):
+        # rank(id) orders the matches of a prefix, best first
+        pairs = sorted((suffix, entry_id) for entry_id, name in enumerate(names)
+                       for suffix in word_suffixes(normalize_text(name)))
+        self.keys = [key for key, _ in pairs]
+        self.ids = array('i', (entry_id for _, entry_id in pairs))
+        self.rank = rank
+        self.top = top
+        short = {}
+        for key, entry_id in pairs:
+            for length in range(1, min(self.SHORT_PREFIX, len(key)) + 1):
+                short.setdefault(key[:length], set()).add(entry_id)
+        self.short = {prefix: sorted(ids, key=rank)[:top] for prefix, ids in short.items()}
+
+    def range_ids(self, prefix):
+        low = bisect_left(self.keys, prefix)
+        high = bisect_left(self.keys, prefix + '\uffff', low)
+        return set(self.ids[low:high])
+
+    def search(self, query, limit=10, accept=None):
+        """Ids of the names with a word starting with query, best first; accept(id) filters them."""
+        prefix = normalize_text(query)
+        if not prefix:
+            return []
+        if accept is None and limit <= self.top and prefix in self.short:
+            return self.short[prefix][:limit]
+        ids = self.range_ids(prefix)
+        if accept is not None:
+            ids = [entry_id for entry_id in ids if accept(entry_id)]
+        return sorted(ids, key=self.rank)[:limit]
+
+class LocationCatalog:
+    """Locations and languages in the DataForSEO list format, with lookup, autocomplete and validation."""
+    def __init__(self, locations=(), languages=(), fetched_at=None, source=None, complete=False):
+        self.locations = [location for location in locations if location.get('location_code')]
+        self.languages = [language for language in languages if language.get('language_code')]
+        self.fetched_at = fetched_at
+        self.source = source
+        # A complete catalog holds every location the API knows, so anything else is an error
+        self.complete = bool(complete) and bool(self.locations)
+        self.by_code = {int(location['location_code']): location for location in self.locations}
+        self.by_name = {}
+        # Short names ("Mumbai" of "Mumbai,Maharashtra,India") per country, for location_name checks
+        self.short_names = {}
+        self.covered_countries = set()
+        for location in self.locations:
+            self.by_name.setdefault(normalize_text(location['location_name']), location)
+            if location.get('location_type') != 'Country':
+                country = location.get('country_iso_code')
+                self.covered_countries.add(country)
+                short_name = location['location_name'].split(',')[0]
+                self.short_names.setdefault(country, {}).setdefault(normalize_text(short_name), short_name)
+        self.location_index = PrefixIndex(
+            [location['location_name'] for location in self.locations],
+            lambda entry_id: (LOCATION_TYPE_ORDER.get(self.locations[entry_id].get('location_type'), 3),
+                              len(self.locations[entry_id]['location_name']), self.locations[entry_id]['location_name']))
+        self.languages_by_code = {language['language_code'].lower(): language for language in self.languages}
+        self.language_index = PrefixIndex(
+            [f"{language['language_name']} {language['language_code']}" for language in self.languages],
+            lambda entry_id: self.languages[entry_id]['language_name'])
+
+    @classmethod
+    def from_file(cls, path=CATALOG_FILE):
+        with open(path, 'r', encoding='utf-8') as file:
+            snapshot = json.load(file)
+        return cls(snapshot.get('locations', []), snapshot.get('languages', []), snapshot.get('fetched_at'), path,
+                   snapshot.get('complete', False))
+
+    def get_location(self, location_code):
+        try:
+            return self.by_code.get(int(location_code))
+        except (TypeError, ValueError):
+            return None
+
+    def search_locations(self, query, limit=10, country_iso_code=None, location_type=None):
+        accept = None
+        if country_iso_code or location_type:
+            country = (country_iso_code or '').upper()
+            accept = lambda entry_id: ((not country or self.locations[entry_id].get('country_iso_code') == country)
+                                       and (not location_type or self.locations[entry_id].get('location_type') == location_type))
+        return [self.locations[entry_id] for entry_id in self.location_index.search(query, limit, accept)]
+
+    def search_languages(self, query, limit=10):
+        return [self.languages[entry_id] for entry_id in self.language_index.search(query, limit)]
+
+    def countries(self):
+        return sorted((location for location in self.locations if location.get('location_type') == 'Country'),
+                      key=lambda location: location['location_name'])
+
+    def find_location(self, text):
+        """A location by code or by exact (normalized) name, else None."""
+        text = str(text).strip()
+        if text.isdigit():
+            return self.get_location(text)
+        return self.by_name.get(normalize_text(text))
+
+    def suggest(self, text, country_iso_code=None, limit=5):
+        """Names close to a misspelt text, for error messages."""
+        matches = [location['location_name'] for location in self.search_locations(text, limit, country_iso_code)]
+        names = self.short_names.get(country_iso_code) or {
+            normalize_text(location['location_name']): location['location_name'] for location in self.locations
+            if not country_iso_code or location.get('country_iso_code') == country_iso_code}
+        matches += [names[name] for name in difflib.get_close_matches(normalize_text(text), list(names), n=limit)]
+        return list(dict.fromkeys(matches))[:limit]
+
+    def resolve(self, location_code, location_name=''):
+        """Check a location_code and optional location_name and return them normalized.
+
+        Raises ValueError with suggestions for an unknown code or name. A
+        location_name is matched against the places of the code's country;
+        countries the snapshot has no places for accept any name, with its
+        whitespace tidied. A catalog that is not complete (the bundled
+        snapshot) accepts codes it does not know, with any name.
+        """
+        try:
+            location_code = int(location_code)
+        except (TypeError, ValueError):
+            raise ValueError(f"location_code must be a number, got '{location_code}'")
+        location_name = ' '.join(str(location_name or '').split())
+        location = self.by_code.get(location_code)
+        if location is None:
+            if not self.complete:
+                return location_code, location_name
+            raise ValueError(f"Unknown location_code {location_code}; find codes with /locations?q=<name> "
+                             "or python locations.py --search <name>")
+        if not location_name:
+            return location_code, ''
+        country = location.get('country_iso_code')
+        if country not in self.covered_countries:
+            return location_code, location_name
+        match = self.by_name.get(normalize_text(location_name))
+        if match is not None and match.get('country_iso_code') == country:
+            return location_code, match['location_name']
+        short_name = self.short_names[country].get(normalize_text(location_name))
+        if short_name is not None:
+            return location_code, short_name
+        message = f"Unknown location_name '{location_name}' in {location['location_name']}"
+        suggestions = self.suggest(location_name, country)
+        raise ValueError(message + (f". Did you mean: {', '.join(suggestions)}?" if suggestions else ""))
+
+    def resolve_language(self, language_code):
+        """Return the catalog spelling of a language code (e.g. 'EN' -> 'en'); raises ValueError if unknown."""
+        language = self.languages_by_code.get(str(language_code or '').strip().lower())
+        if language is not None:
+            return language['language_code']
+        if not self.complete:
+            return language_code
+        suggestions = [match['language_code'] for match in self.search_languages(str(language_code or ''), 5)]
+        raise ValueError(f"Unknown language_code '{language_code}'"
+                         + (f". Did you mean: {', '.join(suggestions)}?" if suggestions else ""))
+
+    def get_stats(self):
+        return {
+            'locations': len(self.locations),
+            'countries': sum(1 for location in self.locations if location.get('location_type') == 'Country'),
+            'countries_with_places': len(self.covered_countries),
+            'languages': len(self.languages),
+            'fetched_at': self.fetched_at,
+            'complete': self.complete,
+            'source': self.source
+        }
+
+location_catalog = None
+location_catalog_lock = threading.Lock()
+
+def get_location_catalog():
+    """The process-wide catalog, loaded from the snapshot on first use; empty if the snapshot is missing."""
+    global location_catalog
+    if location_catalog is None:
+        with location_catalog_lock:
+            if location_catalog is None:
+                try:
+                    location_catalog = LocationCatalog.from_file(CATALOG_FILE)
+                except FileNotFoundError:
+                    print(f"Location catalog {CATALOG_FILE} not found; locations are not validated")
+                    location_catalog = LocationCatalog()
+    return location_catalog
+
+def resolve_location(location_code, location_name=''):
+    return get_location_catalog().resolve(location_code, location_name)
+
+def fetch_catalog(client):
+    """Download the location and language lists from DataForSEO as a snapshot dict."""
+    snapshot = {'fetched_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), 'complete': True}
+    for key, path in (('locations', '/v3/serp/google/locations'), ('languages', '/v3/serp/google/languages')):
+        response = client.get(path)
+        tasks = response.get('tasks') or []
+        if response.get('status_code') != 20000 or not tasks or tasks[0].get('status_code') != 20000:
+            raise RuntimeError(f"Could not fetch {key}: {response.get('status_message')}")
+        snapshot[key] = tasks[0].get('result') or []
+    return snapshot
+
+def save_catalog(snapshot, path=CATALOG_FILE):
+    """Write a snapshot atomically so a running process never reads half a file."""
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'w', encoding='utf-8') as file:
+        json.dump(snapshot, file, ensure_ascii=False, separators=(',', ':'))
+    os.replace(temporary_path, path)
+
+def main():
+    args = sys.argv[1:]
+    if args and args[0] == '--refresh':
+        from credentials import make_client
+        try:
+            client = make_client(*args[1:3])
+        except (TypeError, ValueError):
+            print("Usage: python locations.py --refresh <api_login> <api_password>  (optional with DATAFORSEO_ACCOUNTS)")
+            sys.exit(1)
+        snapshot = fetch_catalog(client)
+        save_catalog(snapshot)
+        print(f"Saved {len(snapshot['locations'])} locations and {len(snapshot['languages'])} languages to {CATALOG_FILE}")
+    elif args and args[0] == '--search' and len(args) > 1:
+        catalog = get_location_catalog()
+        for location in catalog.search_locations(' '.join(args[1:]), limit=20):
+            print(f"  {location['location_code']} - {location['location_name']} ({location.get('location_type')})")
+    else:
+        print("Usage:")
+        print("  python locations.py --search <name>  # Find location codes")
+        print("  python locations.py --refresh [<api_login> <api_password>]  # Download the full catalog")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,363 @@
+import gzip
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from jobs import DEFAULT_JOBS_DB, get_job_store
+from request_profiles import get_request_profile, DEFAULT_PROFILE
+from rank_history import get_rank_history
+from serp_cache import serp_cache
+from costs import cost_tracker, get_response_cost, BUDGET_EXCEEDED
+from client import RestClient
+from credentials import get_credential_pool
+
+# Lookups posted as standard-queue tasks. DataForSEO sends each finished task
+# to the postback URL (or calls the pingback URL so it can be fetched), so
+# results arrive without polling and without holding a live request open.
+TASK_POST_PATH = "/v3/serp/google/organic/task_post"
+TASK_GET_PATH = "/v3/serp/google/organic/task_get/advanced/{task_id}"
+
+# DataForSEO accepts up to 100 tasks per task_post call
+TASKS_PER_POST = 100
+
+# Task status codes
+TASK_CREATED = 20100
+TASK_OK = 20000
+
+# Postback items share the jobs database with their jobs
+DEFAULT_POSTBACKS_DB = os.environ.get('RANK_POSTBACKS_DB', DEFAULT_JOBS_DB)
+
+# Public base URL of this app as DataForSEO reaches it, e.g. https://ranks.example.com
+POSTBACK_BASE_URL = os.environ.get('RANK_POSTBACK_BASE_URL')
+
+# 'postback': DataForSEO posts the finished task (gzip'd JSON) to /postback.
+# 'pingback': it calls /pingback, which fetches the task with task_get.
+CALLBACK_MODE = os.environ.get('RANK_CALLBACK_MODE', 'postback')
+
+# Shared secret added to callback URLs; /postback and /pingback refuse every call while it is unset
+POSTBACK_TOKEN = os.environ.get('RANK_POSTBACK_TOKEN')
+
+# Item statuses
+ITEM_POSTED = 'posted'
+ITEM_COMPLETED = 'completed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS postback_items (
+    id TEXT PRIMARY KEY,
+    task_id TEXT,
+    job_id TEXT NOT NULL,
+    keyword TEXT NOT NULL,
+    target_url TEXT NOT NULL,
+    location_code INTEGER NOT NULL,
+    location_name TEXT NOT NULL DEFAULT '',
+    device TEXT NOT NULL,
+    profile TEXT NOT NULL,
+    status TEXT NOT NULL,
+    ranking TEXT,
+    cost REAL NOT NULL DEFAULT 0,
+    created_at INTEGER NOT NULL,
+    completed_at INTEGER
+);
+
+CREATE INDEX IF NOT EXISTS idx_postback_items_task ON postback_items (task_id);
+CREATE INDEX IF NOT EXISTS idx_postback_items_job ON postback_items (job_id, status);
+
+-- Per-request credentials of a job until it finishes, so pingbacks fetch its tasks with the same account
+CREATE TABLE IF NOT EXISTS postback_credentials (
+    job_id TEXT PRIMARY KEY,
+    login TEXT NOT NULL,
+    password TEXT NOT NULL
+);
+"""
+
+# Columns added after the first release, created on existing databases at startup
+ADDED_COLUMNS = {
+    'login': "TEXT"
+}
+
+def read_postback_body(body, content_encoding=None):
+    """Decode a postback request body, gzip-compressed or plain JSON."""
+    if (content_encoding or '').lower() == 'gzip' or body[:2] == b'\x1f\x8b':
+        body = gzip.decompress(body)
+    return json.loads(body.decode('utf-8'))
+
+class PostbackStore:
+    """One row per posted lookup, completed when its postback arrives."""
+    def __init__(self, db_path=DEFAULT_POSTBACKS_DB):
+        self.db_path = db_path
+        self.local = threading.local()
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = self.get_connection()
+        connection.executescript(SCHEMA)
+        existing = {row['name'] for row in connection.execute("PRAGMA table_info(postback_items)")}
+        with connection:
+            for name, definition in ADDED_COLUMNS.items():
+                if name not in existing:
+                    connection.execute(f"ALTER TABLE postback_items ADD COLUMN {name} {definition}")
+
+    def get_connection(self):
+        """Return this thread's connection, opening it on first use."""
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+        return connection
+
+    def add_items(self, job_id, keywords, target_url, location_code, location_name, device, profile):
+        """Create one posted item per keyword. Returns the items."""
+        now = int(time.time())
+        items = [{'id': uuid.uuid4().hex, 'job_id': job_id, 'keyword': keyword, 'target_url': target_url,
+                  'location_code': int(location_code), 'location_name': location_name or '', 'device': device,
+                  'profile': profile}
+                 for keyword in keywords]
+        connection = self.get_connection()
+        with connection:
+            connection.executemany(
+                "INSERT INTO postback_items (id, job_id, keyword, target_url, location_code, location_name, "
+                "device, profile, status, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(item['id'], job_id, item['keyword'], target_url, item['location_code'], item['location_name'],
+                  device, profile, ITEM_POSTED, now) for item in items])
+        return items
+
+    def set_tasks(self, tasks, login=None):
+        """Record the DataForSEO task ID and cost of each posted item, from {item_id: (task_id, cost)}, and the posting login."""
+        connection = self.get_connection()
+        with connection:
+            connection.executemany("UPDATE postback_items SET task_id = ?, cost = ?, login = ? WHERE id = ?",
+                                   [(task_id, cost, login, item_id) for item_id, (task_id, cost) in tasks.items()])
+
+    def save_credentials(self, job_id, login, password):
+        connection = self.get_connection()
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO postback_credentials (job_id, login, password) VALUES (?, ?, ?)",
+                               (job_id, login, password))
+
+    def get_credentials(self, job_id):
+        """Return the (login, password) a job was posted with, or None for pool jobs and finished jobs."""
+        row = self.get_connection().execute(
+            "SELECT login, password FROM postback_credentials WHERE job_id = ?", (job_id,)).fetchone()
+        return (row['login'], row['password']) if row else None
+
+    def drop_credentials(self, job_id):
+        connection = self.get_connection()
+        with connection:
+            connection.execute("DELETE FROM postback_credentials WHERE job_id = ?", (job_id,))
+
+    def find_item(self, item_id=None, task_id=None):
+        if item_id:
+            row = self.get_connection().execute("SELECT * FROM postback_items WHERE id = ?", (item_id,)).fetchone()
+            if row:
+                return dict(row)
+        if task_id:
+            row = self.get_connection().execute(
+                "SELECT * FROM postback_items WHERE task_id = ?", (task_id,)).fetchone()
+            if row:
+                return dict(row)
+        return None
+
+    def complete_item(self, item_id, ranking_info, cost=0.0):
+        """Store an item's ranking. Returns False if it was already completed (a repeated callback)."""
+        connection = self.get_connection()
+        with connection:
+            cursor = connection.execute(
+                "UPDATE postback_items SET status = ?, ranking = ?, cost = cost + ?, completed_at = ? "
+                "WHERE id = ? AND status = ?",
+                (ITEM_COMPLETED, json.dumps(ranking_info), cost, int(time.time()), item_id, ITEM_POSTED))
+        return cursor.rowcount == 1
+
+    def job_progress(self, job_id):
+        progress = {ITEM_POSTED: 0, ITEM_COMPLETED: 0, 'cost': 0.0}
+        for row in self.get_connection().execute(
+                "SELECT status, COUNT(*) AS items, SUM(cost) AS cost FROM postback_items WHERE job_id = ? "
+                "GROUP BY status", (job_id,)):
+            progress[row['status']] = row['items']
+            progress['cost'] += row['cost'] or 0.0
+        progress['cost'] = round(progress['cost'], 6)
+        return progress
+
+    def job_results(self, job_id):
+        """Return (keyword, ranking_info) for the completed items of a job, in posting order."""
+        return [(row['keyword'], json.loads(row['ranking'])) for row in self.get_connection().execute(
+            "SELECT keyword, ranking FROM postback_items WHERE job_id = ? AND status = ? ORDER BY rowid",
+            (job_id, ITEM_COMPLETED))]
+
+def callback_urls(base_url):
+    """Return the (postback_url, pingback_url) DataForSEO should call, with its $id/$tag placeholders."""
+    base_url = (POSTBACK_BASE_URL or base_url).rstrip('/')
+    token = f"&token={POSTBACK_TOKEN}" if POSTBACK_TOKEN else ''
+    return (f"{base_url}/postback?id=$id&tag=$tag{token}",
+            f"{base_url}/pingback?id=$id&tag=$tag{token}")
+
+def complete(store, item, ranking_info, cost=0.0):
+    """Complete one item: store its ranking, append it to the rank history and update its job."""
+    if not store.complete_item(item['id'], ranking_info, cost):
+        return False
+    try:
+        get_rank_history().record_results(item['target_url'], item['location_code'], item['location_name'],
+                                          item['device'], [(item['keyword'], ranking_info)])
+    except Exception as e:
+        print(f"Error recording rank history: {e}")
+    update_job(store, item['job_id'])
+    return True
+
+def update_job(store, job_id):
+    """Copy item progress into the job record and finish the job when no items are outstanding."""
+    progress = store.job_progress(job_id)
+    job_store = get_job_store()
+    job_store.update_job(job_id, processed_keywords=progress[ITEM_COMPLETED], cost=progress['cost'])
+    if progress[ITEM_POSTED] == 0:
+        store.drop_credentials(job_id)
+        job = job_store.get_job(job_id)
+        if job and job['finished_at'] is None:
+            job_store.finish_job(job_id)
+
+def post_tasks(client, job_id, keywords, target_url, location_code, location_name='', device='desktop',
+               profile=None, base_url='', cost_budget=None, store=None, language_code="en"):
+    """Post one task per keyword with callback URLs. Returns counts of posted, cached and failed items.
+
+    Keywords whose SERP is already cached are completed right away, and
+    once cost_budget is spent the remaining keywords are completed as
+    "Budget Exceeded" without being posted.
+    """
+    from rank_checker import build_post_data, get_serp_key
+    store = store or get_postback_store()
+    profile_name = profile or DEFAULT_PROFILE
+    settings = get_request_profile(profile_name)
+    postback_url, pingback_url = callback_urls(base_url)
+    items = store.add_items(job_id, keywords, target_url, location_code, location_name, device, profile_name)
+    if isinstance(client, RestClient):
+        # Pool accounts are found again by login; per-request credentials are kept until the job finishes
+        store.save_credentials(job_id, client.username, client.password)
+    get_job_store().start_job(job_id, total_keywords=len(items))
+    counts = {'posted': 0, 'cached': 0, 'failed': 0, 'refused': 0}
+
+    pending = []
+    for item in items:
+        serp = serp_cache.get(get_serp_key(item['keyword'], location_code, language_code, location_name, device, settings))
+        if serp is not None:
+            complete(store, item, serp.find(target_url, settings['item_types']))
+            counts['cached'] += 1
+        elif cost_budget is not None and not cost_budget.try_reserve(cost_tracker.average_cost(profile_name)):
+            complete(store, item, BUDGET_EXCEEDED)
+            counts['refused'] += 1
+        else:
+            pending.append(item)
+
+    for start in range(0, len(pending), TASKS_PER_POST):
+        batch = pending[start:start + TASKS_PER_POST]
+        post_data = {}
+        for item in batch:
+            task = build_post_data(item['keyword'], location_code, language_code, location_name, device, profile_name)[0]
+            if CALLBACK_MODE == 'pingback':
+                task.update(tag=item['id'], pingback_url=pingback_url)
+            else:
+                task.update(tag=item['id'], postback_url=postback_url, postback_data='advanced')
+            post_data[len(post_data)] = task
+        try:
+            response = client.post(TASK_POST_PATH, post_data)
+        except Exception as e:
+            response = {'status_code': None, 'status_message': str(e), 'tasks': []}
+
+        # Tasks are charged when posted; the postback repeats the cost, so it is recorded here only
+        cost_tracker.record(getattr(client, 'username', None), profile_name, get_response_cost(response))
+        estimate = cost_tracker.average_cost(profile_name)
+
+        # Tasks come back in posting order
+        posted = {}
+        tasks = response.get('tasks') or []
+        for index, item in enumerate(batch):
+            task = tasks[index] if index < len(tasks) else {}
+            task_cost = float(task.get('cost') or 0)
+            if cost_budget is not None:
+                cost_budget.settle(estimate, task_cost)
+            if task.get('status_code') == TASK_CREATED and task.get('id'):
+                posted[item['id']] = (task['id'], task_cost)
+                counts['posted'] += 1
+            else:
+                print(f"Task for '{item['keyword']}' was not created: "
+                      f"{task.get('status_message') or response.get('status_message')}")
+                complete(store, item, "API Error", task_cost)
+                counts['failed'] += 1
+        store.set_tasks(posted, getattr(client, 'username', None))
+    update_job(store, job_id)
+    return counts
+
+def handle_postback(response, store=None):
+    """Complete the items of every task in a postback or task_get response. Returns the completed count.
+
+    Each task is parsed into a CompactSerp and searched for the item's
+    target URL exactly as get_ranking does with a live response, and the
+    SERP is cached for other lookups of the same keyword.
+    """
+    from rank_checker import get_serp_key, parse_serp
+    store = store or get_postback_store()
+    completed = 0
+    for task in response.get('tasks') or []:
+        tag = (task.get('data') or {}).get('tag')
+        item = store.find_item(item_id=tag, task_id=task.get('id'))
+        if item is None:
+            print(f"Postback for unknown task {task.get('id')}")
+            continue
+        if task.get('status_code') != TASK_OK:
+            print(f"Task {task.get('id')} failed. Code: {task.get('status_code')} Message: {task.get('status_message')}")
+            ranking_info = "API Error"
+        else:
+            settings = get_request_profile(item['profile'])
+            serp_key = get_serp_key(item['keyword'], item['location_code'], task['data'].get('language_code', 'en'),
+                                    item['location_name'], item['device'], settings)
+            serp = parse_serp({'tasks': [task]}, serp_key)
+            ranking_info = serp.find(item['target_url'], settings['item_types'])
+        if complete(store, item, ranking_info):
+            completed += 1
+    return completed
+
+def get_item_client(store, item):
+    """Client for the account that posted an item's task, or None when its credentials are gone.
+
+    Pool accounts are looked up by the stored login and paced by their own
+    rate limiter; per-request credentials come from the job. Items posted
+    before logins were recorded fall back to DATAFORSEO_LOGIN/PASSWORD.
+    """
+    pool = get_credential_pool()
+    account = pool.get_account(item['login']) if pool is not None and item['login'] else None
+    if account is not None:
+        account.rate_limiter.acquire()
+        return account.client
+    credentials = store.get_credentials(item['job_id'])
+    if credentials and (item['login'] is None or credentials[0] == item['login']):
+        return RestClient(*credentials)
+    if item['login'] is None and os.environ.get('DATAFORSEO_LOGIN') and os.environ.get('DATAFORSEO_PASSWORD'):
+        return RestClient(os.environ['DATAFORSEO_LOGIN'], os.environ['DATAFORSEO_PASSWORD'])
+    return None
+
+def handle_pingback(task_id, tag=None, store=None):
+    """Fetch a finished task that was announced by a pingback, with the account that posted it, and complete its item."""
+    store = store or get_postback_store()
+    item = store.find_item(item_id=tag, task_id=task_id)
+    if item is None:
+        print(f"Pingback for unknown task {task_id}")
+        return 0
+    client = get_item_client(store, item)
+    if client is None:
+        print(f"No credentials for account {item['login']} to fetch task {task_id}")
+        return 0
+    return handle_postback(client.get(TASK_GET_PATH.format(task_id=task_id)), store)
+
+# Shared store, created on first use
+postback_store = None
+postback_store_lock = threading.Lock()
+
+def get_postback_store():
+    """Return the process-wide PostbackStore."""
+    global postback_store
+    with postback_store_lock:
+        if postback_store is None:
+            postback_store = PostbackStore()
+        return postback_store
@@ -0,0 +1,305 @@
+import json
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import nullcontext
+
+# Opt-in profiling of one job or request. A sampler thread records the call
+# stacks of every thread working for the job (the job thread and the fetch
+# engine workers running its lookups) a few hundred times a second, and the
+# pipeline marks its stages (queue wait, rate limit, network, JSON decoding,
+# SERP matching, CSV writes, history) so both the time per stage and the
+# flame graph under each stage are known. Profiles are saved as a summary
+# and a speedscope file (https://www.speedscope.app) under PROFILES_DIR.
+
+PROFILES_DIR = os.environ.get('RANK_PROFILES_DIR', os.path.join('data', 'profiles'))
+
+# Seconds between stack samples
+SAMPLE_INTERVAL = float(os.environ.get('RANK_PROFILE_SAMPLE_MS', '5')) / 1000.0
+
+# Saved profiles kept; older ones are deleted
+PROFILES_KEPT = int(os.environ.get('RANK_PROFILES_KEPT', '50'))
+
+# Deepest stack recorded per sample
+MAX_STACK_DEPTH = 80
+
+PROFILE_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]+$')
+
+# The profiler the current thread works for, if any
+local = threading.local()
+
+def current_profiler():
+    return getattr(local, 'profiler', None)
+
+class Stage:
+    """Times one pipeline stage of the current thread and labels its samples."""
+    __slots__ = ('profiler', 'name', 'previous', 'started')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.previous = self.profiler.set_stage(self.name)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.record_stage(self.name, time.perf_counter() - self.started)
+        self.profiler.set_stage(self.previous)
+        return False
+
+NO_STAGE = nullcontext()
+
+def stage(name):
+    """Context manager marking a pipeline stage; does nothing unless the thread is profiled."""
+    profiler = getattr(local, 'profiler', None)
+    if profiler is None:
+        return NO_STAGE
+    return Stage(profiler, name)
+
+class JobProfiler:
+    """Sampling profiler and stage timer for the threads of one job."""
+    def __init__(self, profile_id, label='', interval=SAMPLE_INTERVAL):
+        self.profile_id = profile_id
+        self.label = label
+        self.interval = interval
+        self.lock = threading.Lock()
+        # thread ident -> [role, attach depth, current stage]
+        self.threads = {}
+        self.stages = {}
+        # (role, stage, frame indexes root first) -> sample count
+        self.samples = {}
+        self.frames = []
+        self.frame_indexes = {}
+        self.started_at = None
+        self.finished_at = None
+        self.stopped = threading.Event()
+        self.sampler = None
+
+    def start(self):
+        self.started_at = time.time()
+        self.sampler = threading.Thread(target=self.sample_loop, name=f"profiler-{self.profile_id}")
+        self.sampler.daemon = True
+        self.sampler.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.sampler is not None:
+            self.sampler.join()
+        self.finished_at = time.time()
+
+    def attach(self, role):
+        """Count the calling thread as working for this job until detach()."""
+        ident = threading.get_ident()
+        with self.lock:
+            entry = self.threads.get(ident)
+            if entry is None:
+                self.threads[ident] = [role, 1, None]
+            else:
+                entry[1] += 1
+        previous = getattr(local, 'profiler', None)
+        local.profiler = self
+        return previous
+
+    def detach(self, previous=None):
+        ident = threading.get_ident()
+        with self.lock:
+            entry = self.threads.get(ident)
+            if entry is not None:
+                entry[1] -= 1
+                if entry[1] <= 0:
+                    del self.threads[ident]
+        local.profiler = previous
+
+    def set_stage(self, name):
+        """Set the calling thread's stage and return the one it replaces."""
+        entry = self.threads.get(threading.get_ident())
+        if entry is None:
+            return None
+        previous = entry[2]
+        entry[2] = name
+        return previous
+
+    def record_stage(self, name, seconds):
+        with self.lock:
+            totals = self.stages.get(name)
+            if totals is None:
+                totals = self.stages[name] = {'seconds': 0.0, 'calls': 0, 'max_seconds': 0.0}
+            totals['seconds'] += seconds
+            totals['calls'] += 1
+            totals['max_seconds'] = max(totals['max_seconds'], seconds)
+
+    def wrap(self, fn, queued_at=None):
+        """fn run as lookup work of this job, with its time in the queue recorded as a stage."""
+        def run(*args, **kwargs):
+            if queued_at is not None:
+                self.record_stage('queue_wait', time.perf_counter() - queued_at)
+            previous = self.attach('lookups')
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.detach(previous)
+        return run
+
+    def run(self, fn, *args, **kwargs):
+        """Run fn on the calling thread as the job thread, profiled from start to finish, then save the profile."""
+        self.start()
+        previous = self.attach('job')
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.detach(previous)
+            self.stop()
+            try:
+                save_profile(self)
+            except OSError as e:
+                print(f"Could not save profile {self.profile_id}: {e}")
+
+    def frame_index(self, code):
+        # Called by the sampler thread only
+        key = (code.co_filename, code.co_firstlineno, code.co_name)
+        index = self.frame_indexes.get(key)
+        if index is None:
+            index = self.frame_indexes[key] = len(self.frames)
+            self.frames.append({'name': code.co_name, 'file': code.co_filename, 'line': code.co_firstlineno})
+        return index
+
+    def sample(self):
+        frames = sys._current_frames()
+        with self.lock:
+            threads = [(ident, entry[0], entry[2]) for ident, entry in self.threads.items()]
+        for ident, role, stage_name in threads:
+            frame = frames.get(ident)
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                stack.append(self.frame_index(frame.f_code))
+                frame = frame.f_back
+            if not stack:
+                continue
+            stack.reverse()
+            key = (role, stage_name or 'other', tuple(stack))
+            self.samples[key] = self.samples.get(key, 0) + 1
+
+    def sample_loop(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def get_summary(self):
+        duration = (self.finished_at or time.time()) - (self.started_at or time.time())
+        with self.lock:
+            stages = {name: dict(totals) for name, totals in self.stages.items()}
+        sampled = {}
+        self_counts = {}
+        total_samples = 0
+        for (role, stage_name, stack), count in list(self.samples.items()):
+            total_samples += count
+            sampled[stage_name] = sampled.get(stage_name, 0) + count
+            self_counts[stack[-1]] = self_counts.get(stack[-1], 0) + count
+        stage_seconds = sum(totals['seconds'] for totals in stages.values())
+        for name, totals in stages.items():
+            totals['seconds'] = round(totals['seconds'], 4)
+            totals['max_seconds'] = round(totals['max_seconds'], 4)
+            totals['share'] = round(totals['seconds'] / stage_seconds, 3) if stage_seconds else 0.0
+        hottest = sorted(self_counts.items(), key=lambda item: item[1], reverse=True)[:15]
+        return {
+            'profile_id': self.profile_id,
+            'label': self.label,
+            'started_at': self.started_at,
+            'duration_seconds': round(duration, 3),
+            'sample_interval_ms': self.interval * 1000,
+            'samples': total_samples,
+            'stages': dict(sorted(stages.items(), key=lambda item: item[1]['seconds'], reverse=True)),
+            'samples_per_stage': sampled,
+            'hottest_functions': [dict(self.frames[index], samples=count,
+                                       share=round(count / total_samples, 3)) for index, count in hottest]
+        }
+
+    def to_speedscope(self):
+        """The samples as a speedscope file: one sampled profile per role, each stack rooted at its stage."""
+        frames = list(self.frames)
+        stage_frames = {}
+        profiles = {}
+        for (role, stage_name, stack), count in list(self.samples.items()):
+            if stage_name not in stage_frames:
+                stage_frames[stage_name] = len(frames)
+                frames.append({'name': f"[{stage_name}]"})
+            profile = profiles.setdefault(role, {'samples': [], 'weights': []})
+            profile['samples'].append([stage_frames[stage_name]] + list(stack))
+            profile['weights'].append(round(count * self.interval, 6))
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': f"{self.label or 'job'} {self.profile_id}",
+            'exporter': 'rank-checker',
+            'activeProfileIndex': 0,
+            'shared': {'frames': frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': f"{role} threads",
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': round(sum(profile['weights']), 6),
+                'samples': profile['samples'],
+                'weights': profile['weights']
+            } for role, profile in sorted(profiles.items())]
+        }
+
+def profiled(profiler, fn):
+    """fn itself without a profiler, else fn run and saved under the profiler."""
+    if profiler is None:
+        return fn
+    return lambda *args, **kwargs: profiler.run(fn, *args, **kwargs)
+
+def is_valid_profile_id(profile_id):
+    return bool(profile_id and PROFILE_ID_PATTERN.match(profile_id))
+
+def get_profile_path(profile_id, kind='summary'):
+    """Path of a saved profile's summary or speedscope file; None for an invalid ID."""
+    if not is_valid_profile_id(profile_id):
+        return None
+    suffix = '.speedscope.json' if kind == 'speedscope' else '.summary.json'
+    return os.path.join(PROFILES_DIR, profile_id + suffix)
+
+def save_profile(profiler):
+    """Write the summary and speedscope files of a finished profile and drop the oldest beyond PROFILES_KEPT."""
+    os.makedirs(PROFILES_DIR, exist_ok=True)
+    summary = profiler.get_summary()
+    for kind, content in (('speedscope', profiler.to_speedscope()), ('summary', summary)):
+        path = get_profile_path(profiler.profile_id, kind)
+        with open(path + '.tmp', 'w') as file:
+            json.dump(content, file)
+        os.replace(path + '.tmp', path)
+    stages = ', '.join(f"{name} {totals['seconds']:.2f}s" for name, totals in summary['stages'].items())
+    print(f"Saved profile {profiler.profile_id}: {summary['samples']} samples over {summary['duration_seconds']}s ({stages})")
+    for old in list_saved_profiles()[PROFILES_KEPT:]:
+        for kind in ('summary', 'speedscope'):
+            try:
+                os.remove(get_profile_path(old['profile_id'], kind))
+            except OSError:
+                pass
+    return summary
+
+def load_summary(profile_id):
+    path = get_profile_path(profile_id)
+    if path is None or not os.path.exists(path):
+        return None
+    with open(path, 'r') as file:
+        return json.load(file)
+
+def list_saved_profiles():
+    """Summaries of the saved profiles (without per-function detail), newest first."""
+    if not os.path.isdir(PROFILES_DIR):
+        return []
+    profiles = []
+    for name in os.listdir(PROFILES_DIR):
+        if name.endswith('.summary.json'):
+            try:
+                summary = load_summary(name[:-len('.summary.json')])
+            except (OSError, ValueError):
+                continue
+            if summary is not None:
+                summary.pop('hottest_functions', None)
+                profiles.append(summary)
+    return sorted(profiles, key=lambda summary: summary.get('started_at') or 0, reverse=True)
@@ -4,7 +4,19 @@ import time
 import random
 import json
 import os
-from client import RestClient
+import threading
+from client import get_transfer_stats
+from resilience import RetryPolicy, RetryBudget, CircuitBreaker, RateLimiter, ConcurrencyController, classify_status_code, STATUS_OK
+from rank_history import get_rank_history, normalize_domain
+from exporters import open_export, result_row
+from coalescing import SingleFlight, AsyncSingleFlight
+from serp_cache import CompactSerp, serp_cache, negative_cache
+from costs import CostBudget, cost_tracker, get_response_cost, BUDGET_EXCEEDED
+from credentials import make_client, get_failure_code, get_credential_pool
+from locations import get_location_catalog, resolve_location
+from profiling import stage
+from fetch_engine import has_priority
+from request_profiles import REQUEST_PROFILES, DEFAULT_PROFILE, get_request_profile
 
 def read_keywords_from_csv(csv_file):
     """Read keywords from a CSV file."""
@@ -19,25 +31,70 @@ def read_keywords_from_csv(csv_file):
         print(f"Error reading CSV file: {e}")
         sys.exit(1)
 
-# Cache for storing API responses to avoid redundant calls
-ranking_cache = {}
+# Retries for transient upstream failures, and a breaker shared by every job
+# so a DataForSEO outage fails fast instead of tying up workers
+default_retry_policy = RetryPolicy()
+upstream_breaker = CircuitBreaker()
 
-def get_ranking(client, keyword, target_url, location_code, language_code="en", location_name='', device='desktop'):
-    """Get the ranking of a target URL for a specific keyword."""
-    # Create a cache key based on all parameters
-    cache_key = f"{keyword}_{target_url}_{location_code}_{language_code}_{location_name}_{device}"
-    
-    # Check if we have a cached result
-    if cache_key in ranking_cache:
-        print(f"  Using cached result for '{keyword}'")
-        return ranking_cache[cache_key]
+# Pace of live SERP calls shared by every job, request and schedule in the process
+rate_limiter = RateLimiter(
+    float(os.environ.get('DATAFORSEO_CALLS_PER_SECOND', '2')),
+    burst=int(os.environ.get('DATAFORSEO_BURST', '2'))
+)
+
+# Concurrent identical SERP lookups share one upstream call
+serp_flights = SingleFlight()
+async_serp_flights = AsyncSingleFlight()
+
+# Adaptive limit on live SERP calls in flight, driven by upstream latency and errors
+concurrency_controller = ConcurrencyController(
+    initial_limit=int(os.environ.get('ADAPTIVE_INITIAL_CONCURRENCY', '4')),
+    max_limit=int(os.environ.get('ADAPTIVE_MAX_CONCURRENCY', '32'))
+)
+
+# How often async lookups check for a free slot of the controller while it is full
+CONCURRENCY_POLL_SECONDS = 0.01
+
+# Response size and latency measured per request profile
+profile_stats = {}
+profile_stats_lock = threading.Lock()
+
+def record_profile_stats(profile_name, response_bytes, latency):
+    """Record the response size and latency of one API call for a profile."""
+    with profile_stats_lock:
+        stats = profile_stats.setdefault(profile_name, {
+            'requests': 0,
+            'response_bytes': 0,
+            'latency': 0.0
+        })
+        stats['requests'] += 1
+        stats['response_bytes'] += response_bytes or 0
+        stats['latency'] += latency
+
+def get_profile_stats():
+    """Return per-profile request counts with average response size and latency."""
+    summary = {}
+    with profile_stats_lock:
+        for profile_name, stats in profile_stats.items():
+            requests = stats['requests']
+            summary[profile_name] = {
+                'requests': requests,
+                'avg_response_bytes': int(stats['response_bytes'] / requests) if requests else 0,
+                'avg_latency_ms': round(stats['latency'] * 1000 / requests, 1) if requests else 0.0
+            }
+    return summary
+
+def build_post_data(keyword, location_code, language_code="en", location_name='', device='desktop', profile=None):
+    """Build the live/advanced request payload for one keyword using a request profile."""
+    settings = get_request_profile(profile)
     
     post_data = dict()
     post_data[len(post_data)] = dict(
         language_code=language_code,
         location_code=location_code,
         keyword=keyword,
-        calculate_rectangles=True,
+        depth=settings['depth'],
+        calculate_rectangles=settings['calculate_rectangles'],
         device=device
     )
     
@@ -45,80 +102,327 @@ def get_ranking(client, keyword, target_url, location_code, language_code="en",
     if location_name:
         post_data[len(post_data)-1]['geo_location'] = location_name
     
-    # Simplified logging
-    print(f"  Searching for '{keyword}' ({device}, location: {location_code})")
+    return post_data
+
+def parse_ranking_response(response, target_url, item_types=('organic',)):
+    """Find the target URL in a successful live/advanced response.
     
-    # Add a delay to avoid hitting API rate limits
-    time.sleep(2)
+    Returns a rank_info dict, "Not in top results" or "No results found".
+    """
+    return CompactSerp.from_response(response).find(target_url, item_types)
+
+def get_response_outcome(response):
+    """Classify a response by its top-level and task-level DataForSEO status codes.
     
-    try:
-        response = client.post("/v3/serp/google/organic/live/advanced", post_data)
-        
-        if response["status_code"] == 20000:
-            # Process the response to find the ranking of the target URL
-            if "tasks" in response and len(response["tasks"]) > 0:
-                task = response["tasks"][0]
-                if "result" in task and task["result"] is not None and len(task["result"]) > 0:
-                    result = task["result"][0]
-                    if "items" in result and result["items"] is not None:
-                        # Handle different structures of the API response
-                        organic_results = []
-                        
-                        if isinstance(result["items"], dict) and "organic" in result["items"]:
-                            if result["items"]["organic"] is not None:
-                                organic_results = result["items"]["organic"]
-                            else:
-                                return "No results found"
-                        elif isinstance(result["items"], list):
-                            # If items is a list, check if any item has a type of "organic"
-                            organic_results = [item for item in result["items"]
-                                              if isinstance(item, dict) and item.get("type") == "organic"]
-                            
-                            if not organic_results:
-                                return "No results found"
-                        else:
-                            return "No results found"
-                        
-                        # Process organic results to find target URL
-                        target = target_url.lower()
-                        target_no_www = target.replace("www.", "")
-                        target_with_www = "www." + target
-                        
-                        for position, item in enumerate(organic_results, 1):
-                            if "url" in item:
-                                result_url = item["url"].lower()
-                                
-                                # Try different variations of the target URL
-                                if (target in result_url or
-                                    target_no_www in result_url or
-                                    target_with_www in result_url):
-                                    # Extract additional ranking metrics if available
-                                    rank_info = {
-                                        "position": position,
-                                        "rank_group": item.get("rank_group", position),
-                                        "rank_absolute": item.get("rank_absolute", position)
-                                    }
-                                    
-                                    # Cache the result
-                                    ranking_cache[cache_key] = rank_info
-                                    return rank_info
-                        
-                        # If the URL is not found in the results
-                        result = "Not in top results"
-                        ranking_cache[cache_key] = result
-                        return result
-                    else:
-                        return "No results found"
-                else:
-                    return "No results found"
-            else:
-                return "No results found"
-        else:
-            print(f"API Error. Code: {response['status_code']} Message: {response['status_message']}")
-            return "API Error"
-    except Exception as e:
-        print(f"Exception during API call: {e}")
-        return "Error"
+    Returns (outcome, error) where outcome is 'ok', 'retry' or 'fatal'.
+    """
+    status_code = response.get("status_code")
+    status_message = response.get("status_message", "")
+    outcome = classify_status_code(status_code)
+    if outcome == 'ok' and response.get("tasks"):
+        # A task-level failure counts like a top-level one: transient ones are
+        # retried, permanent ones (e.g. an invalid keyword) become an API Error
+        task = response["tasks"][0]
+        task_outcome = classify_status_code(task.get("status_code", STATUS_OK))
+        if task_outcome != 'ok':
+            outcome = task_outcome
+            status_code = task.get("status_code")
+            status_message = task.get("status_message", "")
+    if outcome != 'ok':
+        print(f"API Error. Code: {status_code} Message: {status_message}")
+    return outcome, "API Error"
+
+def get_retry_delay(outcome, attempt, retry_policy, retry_budget):
+    """Record a failed attempt and return the backoff before the next one, or None to give up."""
+    if outcome == 'fatal':
+        # The upstream answered, it just rejected this task
+        upstream_breaker.record_success()
+        return None
+    
+    upstream_breaker.record_failure()
+    if attempt >= retry_policy.max_attempts:
+        print(f"  Giving up after {attempt} attempts")
+        return None
+    if retry_budget is not None and not retry_budget.try_spend():
+        print("  Retry budget for this job is exhausted")
+        return None
+    
+    delay = retry_policy.get_delay(attempt)
+    print(f"  Retrying in {delay:.1f}s (attempt {attempt + 1}/{retry_policy.max_attempts})")
+    return delay
+
+def reserve_cost(profile_name, cost_budget):
+    """Reserve the expected cost of one call. Returns the estimate, or None if the budget is spent."""
+    estimate = cost_tracker.average_cost(profile_name)
+    if cost_budget is not None and not cost_budget.try_reserve(estimate):
+        print("  Cost budget for this job is exhausted, skipping API call")
+        return None
+    return estimate
+
+def record_cost(client, profile_name, cost_budget, estimate, response):
+    """Account the cost of a response to the job, the credential and the profile."""
+    cost = get_response_cost(response) if response is not None else 0.0
+    if cost_budget is not None:
+        cost_budget.settle(estimate, cost)
+    if response is not None:
+        cost_tracker.record(getattr(client, 'username', None), profile_name, cost)
+
+def record_failure(serp_key, error, response=None):
+    """Back off a SERP key whose lookup failed after reaching the upstream.
+
+    Auth, funds and rate-limit errors belong to the account that made the
+    call, not to the keyword, so they are never cached: the next caller may
+    bring working credentials.
+    """
+    if response is not None and get_failure_code(response) is not None:
+        return
+    if serp_key is not None:
+        ttl = negative_cache.record_error(serp_key, error)
+        print(f"  Caching '{error}' for {ttl:.0f}s")
+
+def fetch_serp(client, post_data, profile_name=DEFAULT_PROFILE, retry_budget=None, retry_policy=None, cost_budget=None, serp_key=None):
+    """Post a live SERP task, retrying transient failures with jittered backoff.
+    
+    Returns (response, None) on success or (None, "API Error"/"Error") when the
+    call failed permanently, retries or the job's retry budget ran out, or the
+    circuit breaker is open. Returns (None, "Budget Exceeded") once the
+    job's cost budget cannot cover another call. With a serp_key, failures
+    that reached the upstream are cached in the negative cache.
+    """
+    retry_policy = retry_policy or default_retry_policy
+    attempt = 1
+    while True:
+        if not upstream_breaker.allow_request():
+            print("  Upstream circuit breaker is open, skipping API call")
+            return None, "API Error"
+        
+        estimate = reserve_cost(profile_name, cost_budget)
+        if estimate is None:
+            return None, BUDGET_EXCEEDED
+        
+        concurrency_controller.acquire()
+        start_time = time.time()
+        response = None
+        outcome = 'retry'
+        try:
+            try:
+                response = client.post("/v3/serp/google/organic/live/advanced", post_data)
+                record_profile_stats(profile_name, getattr(client, 'last_response_size', 0), time.time() - start_time)
+                outcome, error = get_response_outcome(response)
+            except Exception as e:
+                print(f"Exception during API call: {e}")
+                outcome, error = 'retry', "Error"
+            record_cost(client, profile_name, cost_budget, estimate, response)
+        finally:
+            # The slot must come back even if accounting fails, or workers block on acquire()
+            concurrency_controller.release(time.time() - start_time, overloaded=(outcome == 'retry'))
+        
+        if outcome == 'ok':
+            upstream_breaker.record_success()
+            return response, None
+        
+        delay = get_retry_delay(outcome, attempt, retry_policy, retry_budget)
+        if delay is None:
+            record_failure(serp_key, error, response)
+            return None, error
+        time.sleep(delay)
+        attempt += 1
+
+async def fetch_serp_async(client, post_data, profile_name=DEFAULT_PROFILE, retry_budget=None, retry_policy=None, cost_budget=None, serp_key=None):
+    """Async version of fetch_serp for an AsyncRestClient.
+
+    Calls take a slot of the same concurrency controller as threaded
+    lookups; waiting for one yields to the event loop.
+    """
+    # asyncio is only loaded by the async code path
+    import asyncio
+    retry_policy = retry_policy or default_retry_policy
+    attempt = 1
+    while True:
+        if not upstream_breaker.allow_request():
+            print("  Upstream circuit breaker is open, skipping API call")
+            return None, "API Error"
+        
+        estimate = reserve_cost(profile_name, cost_budget)
+        if estimate is None:
+            return None, BUDGET_EXCEEDED
+        
+        while not concurrency_controller.try_acquire():
+            await asyncio.sleep(CONCURRENCY_POLL_SECONDS)
+        start_time = time.time()
+        response = None
+        outcome = 'retry'
+        try:
+            try:
+                response = await client.post("/v3/serp/google/organic/live/advanced", post_data)
+                record_profile_stats(profile_name, getattr(client, 'last_response_size', 0), time.time() - start_time)
+                outcome, error = get_response_outcome(response)
+            except Exception as e:
+                print(f"Exception during API call: {e}")
+                outcome, error = 'retry', "Error"
+            record_cost(client, profile_name, cost_budget, estimate, response)
+        finally:
+            concurrency_controller.release(time.time() - start_time, overloaded=(outcome == 'retry'))
+        
+        if outcome == 'ok':
+            upstream_breaker.record_success()
+            return response, None
+        
+        delay = get_retry_delay(outcome, attempt, retry_policy, retry_budget)
+        if delay is None:
+            record_failure(serp_key, error, response)
+            return None, error
+        await asyncio.sleep(delay)
+        attempt += 1
+
+def get_serp_key(keyword, location_code, language_code, location_name, device, settings):
+    """Identify the upstream SERP request, independent of the target URL being looked up."""
+    return (keyword, int(location_code), language_code, location_name or '', device, settings['depth'])
+
+def parse_serp(response, serp_key):
+    """Parse a successful response into a CompactSerp and cache it, or remember that it was empty."""
+    serp = CompactSerp.from_response(response)
+    if len(serp):
+        serp_cache.put(serp_key, serp)
+        negative_cache.clear(serp_key)
+    else:
+        negative_cache.record_empty(serp_key)
+    return serp
+
+def get_ranking(client, keyword, target_url, location_code, language_code="en", location_name='', device='desktop', profile=None, retry_budget=None, cost_budget=None):
+    """Get the ranking of a target URL for a specific keyword."""
+    profile_name = profile or DEFAULT_PROFILE
+    settings = get_request_profile(profile_name)
+    serp_key = get_serp_key(keyword, location_code, language_code, location_name, device, settings)
+    
+    # A cached SERP answers any target URL for the same keyword, location and device
+    serp = serp_cache.get(serp_key)
+    if serp is not None:
+        print(f"  Using cached result for '{keyword}'")
+        with stage('match'):
+            return serp.find(target_url, settings['item_types'])
+    
+    # Empty SERPs and recent failures of the same lookup are answered without a call
+    negative = negative_cache.get(serp_key)
+    if negative is not None:
+        print(f"  Using cached '{negative}' for '{keyword}'")
+        return negative
+    
+    post_data = build_post_data(keyword, location_code, language_code, location_name, device, profile_name)
+    fetched = False
+    
+    def fetch():
+        nonlocal fetched
+        fetched = True
+        # Simplified logging
+        print(f"  Searching for '{keyword}' ({device}, location: {location_code}, profile: {profile_name})")
+        
+        # Wait for the shared rate limiter to avoid hitting API rate limits;
+        # a credential pool paces each of its accounts itself
+        if not getattr(client, 'paces_requests', False):
+            with stage('rate_limit'):
+                rate_limiter.acquire(priority=has_priority())
+        response, error = fetch_serp(client, post_data, profile_name, retry_budget=retry_budget, cost_budget=cost_budget,
+                                     serp_key=serp_key)
+        if error:
+            return None, error
+        with stage('match'):
+            return parse_serp(response, serp_key), None
+    
+    # Identical lookups already in flight (from any job or request) share one upstream call
+    serp, error = serp_flights.do(serp_key, fetch)
+    if error and not fetched:
+        # Only SERPs are shared: the leader may have failed on its own job's
+        # budget, credentials or retry budget, so this job tries with its own
+        # unless the failure was cached for the keyword itself
+        negative = negative_cache.get(serp_key)
+        if negative is not None:
+            return negative
+        serp, error = fetch()
+    if error:
+        return error
+    with stage('match'):
+        return serp.find(target_url, settings['item_types'])
+
+async def get_ranking_async(client, keyword, target_url, location_code, language_code="en", location_name='', device='desktop', profile=None, retry_budget=None, cost_budget=None):
+    """Async version of get_ranking for an AsyncRestClient.
+    
+    Calls are paced by the shared rate limiter and limited by the shared
+    concurrency controller, like threaded lookups; the client's
+    max_connections caps its own sockets.
+    """
+    profile_name = profile or DEFAULT_PROFILE
+    settings = get_request_profile(profile_name)
+    serp_key = get_serp_key(keyword, location_code, language_code, location_name, device, settings)
+    
+    serp = serp_cache.get(serp_key)
+    if serp is not None:
+        print(f"  Using cached result for '{keyword}'")
+        return serp.find(target_url, settings['item_types'])
+    
+    negative = negative_cache.get(serp_key)
+    if negative is not None:
+        print(f"  Using cached '{negative}' for '{keyword}'")
+        return negative
+    
+    post_data = build_post_data(keyword, location_code, language_code, location_name, device, profile_name)
+    fetched = False
+    
+    async def fetch():
+        import asyncio
+        nonlocal fetched
+        fetched = True
+        print(f"  Searching for '{keyword}' ({device}, location: {location_code}, profile: {profile_name})")
+        delay = rate_limiter.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        response, error = await fetch_serp_async(client, post_data, profile_name, retry_budget=retry_budget,
+                                                 cost_budget=cost_budget, serp_key=serp_key)
+        if error:
+            return None, error
+        return parse_serp(response, serp_key), None
+    
+    serp, error = await async_serp_flights.do(serp_key, fetch)
+    if error and not fetched:
+        negative = negative_cache.get(serp_key)
+        if negative is not None:
+            return negative
+        serp, error = await fetch()
+    if error:
+        return error
+    return serp.find(target_url, settings['item_types'])
+
+async def get_rankings_async(client, keywords, target_url, location_code, language_code="en", location_name='', device='desktop', profile=None, retry_budget=None, cost_budget=None):
+    """Fetch rankings for many keywords concurrently on one event loop, in input order."""
+    import asyncio
+    return await asyncio.gather(*[
+        get_ranking_async(client, keyword, target_url, location_code, language_code,
+                          location_name, device, profile, retry_budget, cost_budget)
+        for keyword in keywords
+    ])
+
+def estimate_cost(keywords, location_code, language_code="en", location_name='', device='desktop', profile=None):
+    """Predict what checking keywords will cost before any call is made.
+    
+    Duplicate keywords share one call, and SERPs already in the cache or
+    answered by the negative cache are free; every other keyword is priced at the average observed cost of
+    the profile.
+    """
+    profile_name = profile or DEFAULT_PROFILE
+    settings = get_request_profile(profile_name)
+    serp_keys = {get_serp_key(keyword, location_code, language_code, location_name, device, settings)
+                 for keyword in keywords}
+    cached = sum(1 for serp_key in serp_keys if serp_cache.contains(serp_key) or negative_cache.contains(serp_key))
+    billable = len(serp_keys) - cached
+    cost_per_call = cost_tracker.average_cost(profile_name)
+    return {
+        'keywords': len(keywords),
+        'unique_serps': len(serp_keys),
+        'predicted_cache_hits': cached,
+        'billable_calls': billable,
+        'cost_per_call': round(cost_per_call, 6),
+        'estimated_cost': round(billable * cost_per_call, 6)
+    }
 
 def get_mock_ranking(keyword, target_url):
     """Generate mock ranking data for testing purposes."""
@@ -280,6 +584,13 @@ def update_csv_with_rankings(csv_file, keywords_with_rankings):
     except Exception as e:
         print(f"Error updating CSV file: {e}")
 
+def print_location_help():
+    """Print how to find location codes in the local location catalog."""
+    catalog = get_location_catalog()
+    print(f"\nLocation codes: {catalog.get_stats()['locations']} locations in the catalog ({catalog.source})")
+    print("  Find a code with: python locations.py --search <name>")
+    print("  --location also takes an exact name, e.g. --location \"United Kingdom\"")
+
 def load_config(config_file):
     """Load configuration from a JSON file."""
     try:
@@ -297,12 +608,13 @@ def load_config(config_file):
         if 'location_code' not in config:
             config['location_code'] = 2840  # Default to USA
         
-        # Validate API credentials if not in test mode
+        # Validate API credentials if not in test mode; without them the credential pool is used
         if 'test_mode' not in config or not config['test_mode']:
             if 'api_credentials' not in config:
-                print("Error: API credentials are required when not in test mode")
-                sys.exit(1)
-            if not all(field in config['api_credentials'] for field in ['login', 'password']):
+                if get_credential_pool() is None:
+                    print("Error: API credentials are required when not in test mode and no DATAFORSEO_ACCOUNTS pool is configured")
+                    sys.exit(1)
+            elif not all(field in config['api_credentials'] for field in ['login', 'password']):
                 print("Error: API credentials must include login and password")
                 sys.exit(1)
         
@@ -321,10 +633,19 @@ def main():
     target_url = None
     api_login = None
     api_password = None
+    profile = DEFAULT_PROFILE
+    max_cost = None
+    export_path = None
     
     # Process command line arguments
     args = sys.argv.copy()
     
+    # Many config files or keyword CSVs in one run on the shared fetch engine
+    if "--batch" in args:
+        from batch import main as run_batch
+        run_batch([arg for arg in args[1:] if arg != "--batch"])
+        return
+    
     # Check for config file
     if "--config" in args:
         config_index = args.index("--config")
@@ -340,6 +661,9 @@ def main():
             target_url = config['target_url']
             location_code = config.get('location_code', 2840)
             limit = config.get('limit')
+            profile = config.get('profile', DEFAULT_PROFILE)
+            max_cost = config.get('max_cost')
+            export_path = config.get('export')
             
             # Check if test mode is enabled
             test_mode = config.get('test_mode', False)
@@ -381,46 +705,96 @@ def main():
     if "--location" in args:
         location_index = args.index("--location")
         if location_index + 1 < len(args):
-            try:
+            location = get_location_catalog().find_location(args[location_index + 1])
+            if location is not None:
+                location_code = location['location_code']
+            elif args[location_index + 1].isdigit():
+                # Checked against the catalog below
                 location_code = int(args[location_index + 1])
-                print(f"Using location code: {location_code}")
-                # Remove the location argument and its value
-                args.pop(location_index)  # Remove --location
-                args.pop(location_index)  # Remove the value
-            except ValueError:
-                print("Error: --location must be followed by a number")
+            else:
+                suggestions = get_location_catalog().suggest(args[location_index + 1])
+                print(f"Error: Unknown location '{args[location_index + 1]}'"
+                      + (f". Did you mean: {', '.join(suggestions)}?" if suggestions else ""))
                 sys.exit(1)
+            print(f"Using location code: {location_code}")
+            # Remove the location argument and its value
+            args.pop(location_index)  # Remove --location
+            args.pop(location_index)  # Remove the value
         else:
             print("Error: --location requires a value")
             sys.exit(1)
     
+    # Check for request profile
+    if "--profile" in args:
+        profile_index = args.index("--profile")
+        if profile_index + 1 < len(args):
+            profile = args[profile_index + 1]
+            # Remove the profile argument and its value
+            args.pop(profile_index)  # Remove --profile
+            args.pop(profile_index)  # Remove the value
+        else:
+            print("Error: --profile requires a value")
+            sys.exit(1)
+    
+    # Check for a cost cap
+    if "--max-cost" in args:
+        max_cost_index = args.index("--max-cost")
+        if max_cost_index + 1 < len(args):
+            try:
+                max_cost = float(args[max_cost_index + 1])
+                # Remove the max cost argument and its value
+                args.pop(max_cost_index)  # Remove --max-cost
+                args.pop(max_cost_index)  # Remove the value
+            except ValueError:
+                print("Error: --max-cost must be followed by an amount in USD")
+                sys.exit(1)
+        else:
+            print("Error: --max-cost requires a value")
+            sys.exit(1)
+    
+    # Check for a columnar export of the results
+    if "--export" in args:
+        export_index = args.index("--export")
+        if export_index + 1 < len(args):
+            export_path = args[export_index + 1]
+            # Remove the export argument and its value
+            args.pop(export_index)  # Remove --export
+            args.pop(export_index)  # Remove the value
+        else:
+            print("Error: --export requires a file path")
+            sys.exit(1)
+    
+    if profile not in REQUEST_PROFILES:
+        print(f"Error: Unknown profile '{profile}'. Available profiles: {', '.join(REQUEST_PROFILES)}")
+        sys.exit(1)
+    print(f"Using request profile: {profile}")
+    
+    # Check the location before any keyword is fetched
+    try:
+        location_code, _ = resolve_location(location_code)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    
     # Check remaining arguments if not using config file
     if config_file is None:
         if test_mode and len(args) < 3:
             print("Usage:")
             print("  python rank_checker.py --config <config_file>")
-            print("  python rank_checker.py --test <csv_file> <target_url> [--limit <number>] [--location <code>]")
-            print("  python rank_checker.py <csv_file> <target_url> <api_login> <api_password> [--limit <number>] [--location <code>]")
-            print("\nLocation codes examples:")
-            print("  2840 - United States")
-            print("  2356 - India")
-            print("  2826 - United Kingdom")
-            print("  2036 - Australia")
-            print("  2124 - Canada")
-            print("  2784 - United Arab Emirates")
+            print("  python rank_checker.py --batch <config_file|csv_file|directory> [...]  # Many jobs at once, see --batch --help")
+            print("  python rank_checker.py --test <csv_file> <target_url> [--limit <number>] [--location <code|name>] [--profile <name>] [--max-cost <usd>] [--export <file>]")
+            print("  python rank_checker.py <csv_file> <target_url> <api_login> <api_password> [--limit <number>] [--location <code|name>] [--profile <name>] [--max-cost <usd>] [--export <file>]")
+            print_location_help()
+            print(f"\nRequest profiles: {', '.join(REQUEST_PROFILES)} (default: {DEFAULT_PROFILE})")
             sys.exit(1)
         elif not test_mode and len(args) < 5:
             print("Usage:")
             print("  python rank_checker.py --config <config_file>")
-            print("  python rank_checker.py <csv_file> <target_url> <api_login> <api_password> [--limit <number>] [--location <code>]")
-            print("  python rank_checker.py --test <csv_file> <target_url> [--limit <number>] [--location <code>]  # Test mode with mock data")
-            print("\nLocation codes examples:")
-            print("  2840 - United States")
-            print("  2356 - India")
-            print("  2826 - United Kingdom")
-            print("  2036 - Australia")
-            print("  2124 - Canada")
-            print("  2784 - United Arab Emirates")
+            print("  python rank_checker.py --batch <config_file|csv_file|directory> [...]  # Many jobs at once, see --batch --help")
+            print("  python rank_checker.py <csv_file> <target_url> <api_login> <api_password> [--limit <number>] [--location <code|name>] [--profile <name>] [--max-cost <usd>] [--export <file>]")
+            print("  python rank_checker.py --test <csv_file> <target_url> [--limit <number>] [--location <code|name>] [--profile <name>] [--max-cost <usd>] [--export <file>]  # Test mode with mock data")
+            print_location_help()
+            print(f"\nRequest profiles: {', '.join(REQUEST_PROFILES)} (default: {DEFAULT_PROFILE})")
             sys.exit(1)
         
         # Get the required arguments
@@ -436,10 +810,12 @@ def main():
         client = MockClient()
         print(f"Using mock client to check rankings for {target_url}")
     else:
-        if not api_login or not api_password:
+        # A config file may leave out api_credentials when DATAFORSEO_ACCOUNTS configures a pool
+        try:
+            client = make_client(api_login, api_password)
+        except ValueError:
             print("Error: API credentials are required when not in test mode")
             sys.exit(1)
-        client = RestClient(api_login, api_password)
         print(f"Using DataForSEO API to check rankings for {target_url}")
     
     # Read keywords from CSV
@@ -451,6 +827,8 @@ def main():
         print(f"Limited to first {limit} keywords")
     
     print(f"Processing {len(keywords_data)} keywords...")
+    retry_budget = RetryBudget.for_keywords(len(keywords_data))
+    cost_budget = CostBudget(max_cost)
     
     # Make a copy of the CSV file before updating
     backup_file = csv_file + ".backup"
@@ -488,6 +866,25 @@ def main():
         print("Error: No keywords found in CSV file.")
         sys.exit(1)
     
+    # Show what the run is expected to cost before spending anything
+    if not test_mode:
+        estimate = estimate_cost([row[keyword_column] for row in keywords_data], location_code, profile=profile)
+        print(f"Estimated cost: ${estimate['estimated_cost']:.4f} for {estimate['billable_calls']} API calls")
+        if max_cost is not None:
+            print(f"Cost budget: ${max_cost:.4f}")
+    
+    # Results are also written to a Parquet/Arrow/NDJSON file as they arrive
+    export_writer = None
+    if export_path:
+        try:
+            export_writer, export_path = open_export(export_path)
+            print(f"Exporting results to {export_path} ({export_writer.format})")
+        except (OSError, ValueError) as e:
+            print(f"Error: Could not open export file: {e}")
+            sys.exit(1)
+    export_domain = normalize_domain(target_url)
+    export_date = time.strftime('%Y-%m-%d')
+    
     # Process keywords in batches to improve performance
     batch_size = 10  # Process 10 keywords before writing to CSV
     total_keywords = len(keywords_data)
@@ -500,6 +897,8 @@ def main():
         
         print(f"Processing batch {batch_index + 1}/{total_batches} (keywords {start_idx + 1}-{end_idx} of {total_keywords})")
         
+        history_results = []
+        
         # Process each keyword in the batch
         for j, keyword_row in enumerate(batch):
             keyword = keyword_row[keyword_column]
@@ -510,7 +909,12 @@ def main():
             if test_mode:
                 ranking_info = get_mock_ranking(keyword, target_url)
             else:
-                ranking_info = get_ranking(client, keyword, target_url, location_code, location_name='', device='desktop')
+                ranking_info = get_ranking(client, keyword, target_url, location_code, location_name='', device='desktop', profile=profile, retry_budget=retry_budget, cost_budget=cost_budget)
+                history_results.append((keyword, ranking_info))
+            
+            if export_writer:
+                export_writer.write_rows([result_row(export_domain, keyword, location_code, '', 'desktop',
+                                                     export_date, ranking_info, time.time())])
             
             # Handle different types of ranking values
             if isinstance(ranking_info, dict):
@@ -543,6 +947,17 @@ def main():
             writer.writerows(all_rows)
         
         print(f"  Updated CSV file with rankings for batch {batch_index + 1}/{total_batches}")
+        
+        # Append real (non-mock) results to the rank history
+        if history_results:
+            try:
+                get_rank_history().record_results(target_url, location_code, '', 'desktop', history_results)
+            except Exception as e:
+                print(f"  Warning: Could not record rank history: {e}")
+    
+    if export_writer:
+        export_writer.close()
+        print(f"Exported {export_writer.rows_written} rows to {export_path}")
     
     # Verify the file exists and has content
     try:
@@ -553,6 +968,22 @@ def main():
     except Exception as e:
         print(f"Warning: Could not verify file size: {e}")
     
+    # Report response size and latency for the request profile
+    for profile_name, stats in get_profile_stats().items():
+        print(f"Profile '{profile_name}': {stats['requests']} requests, avg {stats['avg_response_bytes']} bytes, avg {stats['avg_latency_ms']} ms")
+    
+    # Report what the run cost
+    spend = cost_budget.get_state()
+    if spend['calls']:
+        print(f"API cost: ${spend['spent']:.4f} for {spend['calls']} calls")
+    if cost_budget.exceeded():
+        print(f"Warning: cost budget of ${max_cost:.4f} reached, {spend['refused_calls']} lookups were skipped")
+    
+    # Report bandwidth used and saved by gzip
+    transfer = get_transfer_stats()
+    if transfer['requests']:
+        print(f"Transferred {transfer['request_bytes_wire'] + transfer['response_bytes_wire']} bytes on the wire, {transfer['bytes_saved']} bytes saved by gzip")
+    
     print("Ranking check completed!")
 
 if __name__ == "__main__":
@@ -0,0 +1,264 @@
+import os
+import sqlite3
+import threading
+import time
+from datetime import date
+
+# Default location of the history database, next to the other persistent data
+DEFAULT_HISTORY_DB = os.environ.get('RANK_HISTORY_DB', os.path.join('data', 'rank_history.db'))
+
+# Position used for "Not in top results" when ordering movers
+NOT_RANKED_POSITION = 101
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rank_history (
+    domain TEXT NOT NULL,
+    keyword TEXT NOT NULL,
+    location_code INTEGER NOT NULL,
+    location_name TEXT NOT NULL DEFAULT '',
+    device TEXT NOT NULL,
+    date TEXT NOT NULL,
+    position INTEGER,
+    rank_group INTEGER,
+    rank_absolute INTEGER,
+    checked_at INTEGER NOT NULL,
+    PRIMARY KEY (domain, keyword, location_code, location_name, device, date)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_rank_history_domain_date
+    ON rank_history (domain, date, location_code, device, keyword, location_name, position);
+
+-- Bumped on every write to a domain, so cached analytics know when to reload
+CREATE TABLE IF NOT EXISTS rank_history_versions (
+    domain TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+"""
+
+class RankHistory:
+    """Append-only time series of ranking results stored in SQLite.
+
+    One row per (domain, keyword, location, device, date); a later check on
+    the same day replaces the earlier one. The primary key serves per-keyword
+    history and the (domain, date, ...) index serves date-to-date comparisons
+    without touching the base table.
+    """
+    def __init__(self, db_path=DEFAULT_HISTORY_DB):
+        self.db_path = db_path
+        self.local = threading.local()
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.get_connection().executescript(SCHEMA)
+
+    def get_connection(self):
+        """Return this thread's connection, opening it on first use."""
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+        return connection
+
+    def record_results(self, domain, location_code, location_name, device, results, check_date=None):
+        """Append a batch of (keyword, ranking_info) results.
+
+        ranking_info is a rank_info dict or "Not in top results"; errors and
+        empty SERPs are not observations and are skipped. Returns the number
+        of rows written.
+        """
+        check_date = check_date or date.today().isoformat()
+        checked_at = int(time.time())
+        rows = []
+        for keyword, ranking_info in results:
+            if isinstance(ranking_info, dict):
+                position = ranking_info.get('position')
+                rank_group = ranking_info.get('rank_group')
+                rank_absolute = ranking_info.get('rank_absolute')
+            elif ranking_info == "Not in top results":
+                position = rank_group = rank_absolute = None
+            else:
+                continue
+            rows.append((normalize_domain(domain), keyword, int(location_code), location_name or '', device,
+                         check_date, position, rank_group, rank_absolute, checked_at))
+
+        if rows:
+            connection = self.get_connection()
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO rank_history VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                connection.execute(
+                    "INSERT INTO rank_history_versions (domain, version) VALUES (?, 1) "
+                    "ON CONFLICT (domain) DO UPDATE SET version = version + 1", (normalize_domain(domain),))
+        return len(rows)
+
+    def get_version(self, domain):
+        """Return a counter that changes whenever results are written for a domain."""
+        row = self.get_connection().execute(
+            "SELECT version FROM rank_history_versions WHERE domain = ?", (normalize_domain(domain),)).fetchone()
+        return row['version'] if row else 0
+
+    def get_dates(self, domain, limit=30):
+        """Return the most recent dates with results for a domain, newest first."""
+        cursor = self.get_connection().execute(
+            "SELECT DISTINCT date FROM rank_history WHERE domain = ? ORDER BY date DESC LIMIT ?",
+            (normalize_domain(domain), limit))
+        return [row['date'] for row in cursor]
+
+    def keyword_history(self, domain, keyword, location_code=None, location_name=None, device=None,
+                        start_date=None, end_date=None, limit=365):
+        """Return the history of one keyword, oldest first."""
+        query = "SELECT * FROM rank_history WHERE domain = ? AND keyword = ?"
+        params = [normalize_domain(domain), keyword]
+        query, params = add_filters(query, params, location_code, location_name, device)
+        if start_date:
+            query += " AND date >= ?"
+            params.append(start_date)
+        if end_date:
+            query += " AND date <= ?"
+            params.append(end_date)
+        # The unary + keeps the planner on the primary key (domain, keyword, ...)
+        # instead of the date index, which would scan every keyword of the domain
+        query += " ORDER BY +date DESC LIMIT ?"
+        params.append(limit)
+        rows = [dict(row) for row in self.get_connection().execute(query, params)]
+        rows.reverse()
+        return rows
+
+    def iter_rows(self, domain=None, start_date=None, end_date=None, location_code=None, location_name=None,
+                  device=None, batch_size=10000):
+        """Yield history rows one at a time, fetching batch_size rows per round trip.
+
+        Used for exports, so the whole table is never held in memory.
+        """
+        query = "SELECT * FROM rank_history WHERE 1 = 1"
+        params = []
+        if domain:
+            query += " AND domain = ?"
+            params.append(normalize_domain(domain))
+        query, params = add_filters(query, params, location_code, location_name, device)
+        if start_date:
+            query += " AND date >= ?"
+            params.append(start_date)
+        if end_date:
+            query += " AND date <= ?"
+            params.append(end_date)
+        # A dedicated connection keeps the long read independent of this thread's other queries
+        connection = sqlite3.connect(self.db_path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        try:
+            cursor = connection.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(row)
+        finally:
+            connection.close()
+
+    def scan_positions(self, domain, start_date=None, end_date=None, location_code=None, location_name=None,
+                       device=None, batch_size=50000):
+        """Yield (date, keyword, location_code, location_name, device, position) tuples for a domain.
+
+        Reads only the (domain, date, ...) index and skips the Row wrapper,
+        for loading large result sets into analytics arrays.
+        """
+        query = ("SELECT date, keyword, location_code, location_name, device, position "
+                 "FROM rank_history WHERE domain = ?")
+        params = [normalize_domain(domain)]
+        query, params = add_filters(query, params, location_code, location_name, device)
+        if start_date:
+            query += " AND date >= ?"
+            params.append(start_date)
+        if end_date:
+            query += " AND date <= ?"
+            params.append(end_date)
+        connection = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            cursor = connection.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            connection.close()
+
+    def rank_deltas(self, domain, from_date, to_date, location_code=None, location_name=None, device=None,
+                    order='keyword', limit=100, offset=0):
+        """Compare positions between two dates for every keyword checked on both.
+
+        delta is old position minus new position, so a positive value is an
+        improvement. Keywords outside the top results count as position 101.
+        order is 'keyword', 'best' (biggest gains first) or 'worst'.
+        """
+        query = """
+            SELECT cur.keyword, cur.location_code, cur.location_name, cur.device,
+                   prev.position AS previous_position, cur.position AS current_position,
+                   COALESCE(prev.position, {nr}) - COALESCE(cur.position, {nr}) AS delta
+            FROM rank_history AS cur
+            JOIN rank_history AS prev
+              ON prev.domain = cur.domain AND prev.date = ?
+             AND prev.location_code = cur.location_code AND prev.device = cur.device
+             AND prev.keyword = cur.keyword AND prev.location_name = cur.location_name
+            WHERE cur.domain = ? AND cur.date = ?
+        """.format(nr=NOT_RANKED_POSITION)
+        params = [from_date, normalize_domain(domain), to_date]
+        if location_code is not None:
+            query += " AND cur.location_code = ?"
+            params.append(int(location_code))
+        if location_name is not None:
+            query += " AND cur.location_name = ?"
+            params.append(location_name)
+        if device:
+            query += " AND cur.device = ?"
+            params.append(device)
+
+        if order == 'best':
+            query += " AND delta > 0 ORDER BY delta DESC, cur.keyword"
+        elif order == 'worst':
+            query += " AND delta < 0 ORDER BY delta ASC, cur.keyword"
+        else:
+            query += " ORDER BY cur.keyword, cur.location_code, cur.location_name, cur.device"
+        query += " LIMIT ? OFFSET ?"
+        params.extend([limit, offset])
+        return [dict(row) for row in self.get_connection().execute(query, params)]
+
+    def movers(self, domain, from_date, to_date, limit=20, **filters):
+        """Return the best and worst movers between two dates."""
+        return {
+            'best': self.rank_deltas(domain, from_date, to_date, order='best', limit=limit, **filters),
+            'worst': self.rank_deltas(domain, from_date, to_date, order='worst', limit=limit, **filters)
+        }
+
+def normalize_domain(domain):
+    """Store domains lower-cased and without a leading www."""
+    domain = (domain or '').strip().lower()
+    return domain[4:] if domain.startswith('www.') else domain
+
+def add_filters(query, params, location_code=None, location_name=None, device=None):
+    if location_code is not None:
+        query += " AND location_code = ?"
+        params.append(int(location_code))
+    if location_name is not None:
+        query += " AND location_name = ?"
+        params.append(location_name)
+    if device:
+        query += " AND device = ?"
+        params.append(device)
+    return query, params
+
+# Shared store, created on first use
+rank_history = None
+rank_history_lock = threading.Lock()
+
+def get_rank_history():
+    """Return the process-wide RankHistory store."""
+    global rank_history
+    with rank_history_lock:
+        if rank_history is None:
+            rank_history = RankHistory()
+        return rank_history
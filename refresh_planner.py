@@ -0,0 +1,96 @@
+import os
+from datetime import date, timedelta
+from rank_history import NOT_RANKED_POSITION
+
+# Volatility-aware refresh: instead of re-checking every keyword on every
+# run, each keyword gets a re-check interval from its recent rank history
+# and a run only fetches the keywords whose interval has passed.
+
+# Days of history the planner looks at
+LOOKBACK_DAYS = int(os.environ.get('RANK_REFRESH_LOOKBACK_DAYS', '30'))
+
+# Longest a keyword can go without a check
+MAX_INTERVAL_DAYS = int(os.environ.get('RANK_REFRESH_MAX_INTERVAL_DAYS', '7'))
+
+# Positions around the edges that matter (top 3, page 1, page 2) are always
+# checked: a small move there changes what gets reported
+THRESHOLD_BANDS = ((3, 4), (8, 12), (18, 22))
+
+# Average day-to-day move (in positions) above which a keyword counts as volatile
+VOLATILE_MOVE = 3.0
+SETTLED_MOVE = 1.0
+
+def is_near_threshold(position):
+    return position is not None and any(low <= position <= high for low, high in THRESHOLD_BANDS)
+
+def get_interval(observations):
+    """Return the re-check interval in days and the reason for it.
+
+    observations are (date, position) pairs, oldest first; position is None
+    when the domain was not in the results.
+    """
+    if len(observations) < 2:
+        return 1, 'new'
+    positions = [NOT_RANKED_POSITION if position is None else position for _, position in observations]
+    last = observations[-1][1]
+    if is_near_threshold(last):
+        return 1, 'near threshold'
+    moves = [abs(current - previous) for previous, current in zip(positions, positions[1:])]
+    # Recent moves weigh more than old ones
+    recent = moves[-3:]
+    volatility = max(sum(moves) / len(moves), sum(recent) / len(recent))
+    if volatility >= VOLATILE_MOVE:
+        return 1, 'volatile'
+    if volatility >= SETTLED_MOVE:
+        return min(2, MAX_INTERVAL_DAYS), 'moving'
+    # Every unchanged observation earns a longer interval, up to the maximum
+    stable_run = 0
+    for move in reversed(moves):
+        if move:
+            break
+        stable_run += 1
+    interval = 2 + stable_run if last is not None and last <= 3 else 1 + stable_run
+    return max(1, min(MAX_INTERVAL_DAYS, interval)), 'stable'
+
+def plan_refresh(history, domain, keywords, location_code, location_name='', device='desktop', today=None):
+    """Split keywords into those due for a check today and those that can wait.
+
+    With keywords None, every keyword checked within the lookback window is
+    planned. Returns a dict with 'due' (keywords to fetch, in input order), 'skipped'
+    and 'reasons' (a count per reason), and 'keywords' with each keyword's
+    interval, last check and next due date.
+    """
+    today = today or date.today()
+    since = (today - timedelta(days=LOOKBACK_DAYS)).isoformat()
+    wanted = set(keywords) if keywords is not None else None
+    observations = {}
+    for check_date, keyword, _, _, _, position in history.scan_positions(
+            domain, start_date=since, location_code=location_code, location_name=location_name or '', device=device):
+        if wanted is None or keyword in wanted:
+            observations.setdefault(keyword, []).append((check_date, position))
+    if keywords is None:
+        keywords = sorted(observations)
+
+    due, skipped, reasons, details = [], [], {}, {}
+    for keyword in dict.fromkeys(keywords):
+        keyword_observations = sorted(observations.get(keyword, []))
+        interval, reason = get_interval(keyword_observations)
+        last_checked = keyword_observations[-1][0] if keyword_observations else None
+        next_due = (date.fromisoformat(last_checked) + timedelta(days=interval)) if last_checked else today
+        if next_due <= today:
+            due.append(keyword)
+            reasons[reason] = reasons.get(reason, 0) + 1
+        else:
+            skipped.append(keyword)
+            reasons['not due'] = reasons.get('not due', 0) + 1
+        details[keyword] = {'interval_days': interval, 'reason': reason, 'last_checked': last_checked,
+                            'last_position': keyword_observations[-1][1] if keyword_observations else None,
+                            'next_due': next_due.isoformat()}
+    return {'due': due, 'skipped': skipped, 'reasons': reasons, 'keywords': details}
+
+def plan_keywords(history, target_urls, keywords, location_code, location_name='', device='desktop', today=None):
+    """Keywords due for any of the target URLs, in input order; one SERP call serves every target."""
+    due = set()
+    for target_url in target_urls:
+        due.update(plan_refresh(history, target_url, keywords, location_code, location_name, device, today)['due'])
+    return [keyword for keyword in dict.fromkeys(keywords) if keyword in due]
@@ -0,0 +1,45 @@
+# Request profiles live apart from rank_checker so that the web app, schedules
+# and postbacks can validate a profile without loading the fetch pipeline.
+
+# Request profiles control how much of the SERP is requested from the API.
+# - depth: number of results DataForSEO should collect (10, 20 or 100)
+# - calculate_rectangles: pixel rectangles for each item (never read here)
+# - item_types: SERP feature types scanned when looking for the target URL
+REQUEST_PROFILES = {
+    'top10': {
+        'depth': 10,
+        'calculate_rectangles': False,
+        'item_types': ['organic']
+    },
+    'top20': {
+        'depth': 20,
+        'calculate_rectangles': False,
+        'item_types': ['organic']
+    },
+    'top100': {
+        'depth': 100,
+        'calculate_rectangles': False,
+        'item_types': ['organic']
+    },
+    'top100_features': {
+        'depth': 100,
+        'calculate_rectangles': False,
+        'item_types': ['organic', 'featured_snippet', 'local_pack']
+    },
+    'full': {
+        'depth': 100,
+        'calculate_rectangles': True,
+        'item_types': ['organic']
+    }
+}
+
+# Default matches the depth the API used before profiles were introduced
+DEFAULT_PROFILE = 'top100'
+
+def get_request_profile(profile=None):
+    """Return the request profile settings for a profile name."""
+    if not profile:
+        profile = DEFAULT_PROFILE
+    if profile not in REQUEST_PROFILES:
+        raise ValueError(f"Unknown request profile '{profile}'. Available: {', '.join(REQUEST_PROFILES)}")
+    return REQUEST_PROFILES[profile]
@@ -0,0 +1,258 @@
+import random
+import threading
+import time
+from collections import deque
+
+# DataForSEO status codes
+STATUS_OK = 20000
+
+# Rate limit responses that succeed if sent again a little later
+RETRYABLE_STATUS_CODES = {
+    40202,  # Rate limit per minute exceeded
+    40209   # Too many simultaneous requests
+}
+
+def classify_status_code(status_code):
+    """Classify a DataForSEO status code as 'ok', 'retry' (transient) or 'fatal' (permanent)."""
+    if status_code == STATUS_OK:
+        return 'ok'
+    if status_code in RETRYABLE_STATUS_CODES:
+        return 'retry'
+    # 50000-range codes are internal upstream errors and timeouts
+    if isinstance(status_code, int) and 50000 <= status_code < 60000:
+        return 'retry'
+    return 'fatal'
+
+class RetryPolicy:
+    """Exponential backoff with full jitter between retry attempts."""
+    def __init__(self, max_attempts=4, base_delay=1.0, max_delay=30.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def get_delay(self, attempt):
+        """Return the sleep before retry number `attempt` (1-based)."""
+        ceiling = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return random.uniform(0, ceiling)
+
+class RetryBudget:
+    """Caps the total number of retries a single job may spend."""
+    def __init__(self, max_retries):
+        self.max_retries = max_retries
+        self.used = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def for_keywords(cls, keyword_count, ratio=0.2, minimum=10):
+        """Budget sized to a fraction of the job's keywords."""
+        return cls(max(minimum, int(keyword_count * ratio)))
+
+    def try_spend(self):
+        """Take one retry from the budget. Returns False once it is exhausted."""
+        with self.lock:
+            if self.used >= self.max_retries:
+                return False
+            self.used += 1
+            return True
+
+    def remaining(self):
+        with self.lock:
+            return self.max_retries - self.used
+
+class CircuitBreaker:
+    """Stops calls to the upstream after repeated transient failures.
+
+    closed: calls go through. open: calls fail fast until reset_timeout has
+    passed. half_open: one trial call decides whether to close or re-open.
+    """
+    def __init__(self, failure_threshold=5, reset_timeout=60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    def allow_request(self):
+        with self.lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.time() - self.opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+                self.trial_in_flight = False
+            if self.state == 'half_open' and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.state = 'closed'
+            self.failures = 0
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    print(f"Circuit breaker opened after {self.failures} upstream failures")
+                self.state = 'open'
+                self.opened_at = time.time()
+                self.trial_in_flight = False
+
+    def get_state(self):
+        with self.lock:
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'opened_at': self.opened_at if self.state != 'closed' else None
+            }
+
+class RateLimiter:
+    """Token bucket shared by every caller in the process.
+
+    rate is the sustained number of calls per second and burst the number
+    of calls that may go out back to back after an idle period. Callers of
+    acquire() without priority (bulk work) only take a token while no
+    priority caller is waiting, so interactive calls wait for at most one
+    token however much bulk work is queued.
+    """
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+        self.condition = threading.Condition()
+        self.priority_waiting = 0
+
+    def refill(self):
+        """Add the tokens earned since the last update. Caller holds the condition."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def reserve(self):
+        """Take a token and return how long the caller must wait before using it."""
+        with self.condition:
+            self.refill()
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def acquire(self, priority=True):
+        """Block until a call is allowed."""
+        with self.condition:
+            if priority:
+                self.priority_waiting += 1
+            try:
+                while True:
+                    self.refill()
+                    if self.tokens >= 1 and (priority or not self.priority_waiting):
+                        self.tokens -= 1
+                        return
+                    # Bulk callers held back by a priority caller are woken when it leaves
+                    self.condition.wait((1 - self.tokens) / self.rate if self.tokens < 1 else None)
+            finally:
+                if priority:
+                    self.priority_waiting -= 1
+                    self.condition.notify_all()
+
+class ConcurrencyController:
+    """AIMD limit on the number of upstream calls in flight.
+
+    While calls succeed and the recent p95 latency stays within
+    latency_tolerance times the long-run average, the limit grows by about
+    one per limit's worth of successful calls. A rate-limit or
+    50000-range response, a network error, or a p95 above that threshold
+    multiplies the limit by backoff_ratio, at most once per cooldown.
+    Callers beyond the limit wait in acquire().
+    """
+    def __init__(self, initial_limit=4, min_limit=1, max_limit=32, backoff_ratio=0.7,
+                 latency_tolerance=2.0, window_size=50, cooldown=2.0):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff_ratio = backoff_ratio
+        self.latency_tolerance = latency_tolerance
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.latencies = deque(maxlen=window_size)
+        self.baseline_latency = None
+        self.last_decrease = 0.0
+        self.history = deque(maxlen=200)
+        self.condition = threading.Condition()
+        self.record_change('initial')
+
+    def record_change(self, reason):
+        self.history.append({'time': round(time.time(), 3), 'limit': int(self.limit), 'reason': reason})
+
+    def acquire(self):
+        """Block until another upstream call may start."""
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def try_acquire(self):
+        """Start a call if the limit allows it. Returns False instead of waiting, for asyncio callers."""
+        with self.condition:
+            if self.in_flight >= int(self.limit):
+                return False
+            self.in_flight += 1
+            return True
+
+    def get_p95(self):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def release(self, latency, overloaded=False):
+        """Finish a call and adjust the limit from its latency and outcome."""
+        with self.condition:
+            self.in_flight -= 1
+            previous_limit = int(self.limit)
+            reason = None
+
+            if overloaded:
+                reason = 'upstream overload'
+            else:
+                self.latencies.append(latency)
+                # Slow-moving baseline of healthy latency
+                if self.baseline_latency is None:
+                    self.baseline_latency = latency
+                else:
+                    self.baseline_latency = 0.98 * self.baseline_latency + 0.02 * latency
+                p95 = self.get_p95()
+                if len(self.latencies) >= 10 and p95 > self.baseline_latency * self.latency_tolerance:
+                    reason = 'p95 latency rising'
+
+            now = time.time()
+            if reason and now - self.last_decrease >= self.cooldown:
+                self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+                self.last_decrease = now
+                # Start the next latency window fresh at the new limit
+                self.latencies.clear()
+            elif not reason:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+                reason = 'healthy'
+
+            if int(self.limit) != previous_limit:
+                self.record_change(reason)
+            self.condition.notify_all()
+
+    def get_state(self):
+        with self.condition:
+            p95 = self.get_p95()
+            return {
+                'limit': int(self.limit),
+                'in_flight': self.in_flight,
+                'min_limit': self.min_limit,
+                'max_limit': self.max_limit,
+                'p95_latency_ms': round(p95 * 1000, 1) if p95 is not None else None,
+                'baseline_latency_ms': round(self.baseline_latency * 1000, 1) if self.baseline_latency is not None else None,
+                'history': list(self.history)
+            }
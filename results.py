@@ -0,0 +1,129 @@
+import os
+import sys
+import threading
+from collections import deque
+from itertools import islice
+
+# Results of the job shown on the dashboard. Only the most recent ones stay
+# in memory; older results of a job are spilled to the job store in chunks.
+
+# Results kept in memory per job before older ones are spilled
+RESULTS_IN_MEMORY = int(os.environ.get('RANK_RESULTS_IN_MEMORY', '2000'))
+
+class ResultRecord:
+    """One keyword's result, without the per-instance dict of a plain object."""
+    __slots__ = ('keyword', 'ranking', 'rank_group', 'rank_absolute', 'device')
+
+    def __init__(self, keyword, ranking, rank_group, rank_absolute, device):
+        self.keyword = keyword
+        self.ranking = ranking
+        self.rank_group = rank_group
+        self.rank_absolute = rank_absolute
+        self.device = device
+
+    @classmethod
+    def from_ranking(cls, keyword, ranking_info, device):
+        """Build a record from a get_ranking result; repeated strings are interned."""
+        if isinstance(ranking_info, dict):
+            return cls(keyword, intern(ranking_info.get('position', 'N/A')),
+                       intern(ranking_info.get('rank_group', 'N/A')),
+                       intern(ranking_info.get('rank_absolute', 'N/A')), intern(device))
+        return cls(keyword, intern(ranking_info), 'N/A', 'N/A', intern(device))
+
+    def as_row(self):
+        return (self.keyword, self.ranking, self.rank_group, self.rank_absolute, self.device)
+
+    def to_dict(self):
+        return {"keyword": self.keyword, "ranking": self.ranking, "rank_group": self.rank_group,
+                "rank_absolute": self.rank_absolute, "device": self.device}
+
+def intern(value):
+    # Positions are small ints and already shared; 'N/A', 'Not in top results' and device names repeat
+    return sys.intern(value) if isinstance(value, str) else value
+
+def row_to_dict(row):
+    return dict(zip(('keyword', 'ranking', 'rank_group', 'rank_absolute', 'device'), row))
+
+class ResultBuffer:
+    """Ordered results of one job, holding at most limit of them in memory.
+
+    With a job store, the oldest half is written to it whenever the buffer
+    fills up, so page() can still return every result. Without one (jobs
+    whose results live elsewhere, like queued shards), older results are
+    only counted.
+    """
+    def __init__(self, job_id=None, limit=RESULTS_IN_MEMORY, store=None):
+        self.job_id = job_id
+        self.limit = max(2, limit)
+        self.store = store
+        self.records = deque()
+        self.total = 0
+        self.spilled = 0
+        self.lock = threading.Lock()
+        self.spill_lock = threading.Lock()
+
+    def append(self, record):
+        with self.lock:
+            self.records.append(record)
+            self.total += 1
+            full = len(self.records) > self.limit
+        if full:
+            self.spill()
+
+    def spill(self):
+        """Move the oldest in-memory records to the store (or drop them without one), down to half the limit.
+
+        The store write happens outside the lock; readers keep seeing the
+        records in memory until they are in the store.
+        """
+        with self.spill_lock:
+            with self.lock:
+                count = len(self.records) - self.limit // 2
+                if count <= 0:
+                    return
+                rows = [record.as_row() for record in islice(self.records, count)]
+                start = self.spilled
+            if self.store is not None:
+                self.store.add_results(self.job_id, start, rows)
+            with self.lock:
+                for _ in range(count):
+                    self.records.popleft()
+                self.spilled += count
+
+    def flush(self):
+        """Write the in-memory records to the store too, once the job is finished."""
+        with self.spill_lock:
+            with self.lock:
+                rows = [record.as_row() for record in self.records]
+                start = self.spilled
+            if self.store is not None and rows:
+                self.store.add_results(self.job_id, start, rows)
+
+    def recent(self, upto=None):
+        """The results still in memory, oldest first, as dicts; only those before position upto if given."""
+        with self.lock:
+            records = list(self.records)
+            spilled = self.spilled
+        if upto is not None:
+            records = records[:max(0, upto - spilled)]
+        return [record.to_dict() for record in records]
+
+    def page(self, offset=0, limit=None):
+        """Results offset..offset+limit as dicts, read from the store where they were spilled."""
+        with self.lock:
+            spilled = self.spilled
+            records = list(self.records)
+            total = self.total
+        end = total if limit is None else min(total, offset + limit)
+        results = []
+        if offset < spilled and self.store is not None:
+            results = [row_to_dict(row) for row in self.store.get_results(self.job_id, offset, min(end, spilled) - offset)]
+        start = max(offset, spilled)
+        results.extend(record.to_dict() for record in records[start - spilled:end - spilled])
+        return results
+
+    def __len__(self):
+        return self.total
+
+    def __repr__(self):
+        return f"<ResultBuffer {self.total} results, {self.spilled} spilled>"
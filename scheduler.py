@@ -0,0 +1,422 @@
+import csv
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from credentials import make_client, POOL_FOR_ANONYMOUS
+from jobs import get_job_store, JOB_SCHEDULED, DEFAULT_JOBS_DB
+from request_profiles import DEFAULT_PROFILE, REQUEST_PROFILES
+from rank_history import get_rank_history
+from resilience import RetryBudget
+from costs import CostBudget
+from fetch_engine import get_fetch_engine, LANE_BULK
+from refresh_planner import plan_keywords
+from locations import resolve_location
+
+# Schedules share the jobs database so runs and job records stay together
+DEFAULT_SCHEDULES_DB = os.environ.get('RANK_SCHEDULES_DB', DEFAULT_JOBS_DB)
+
+# How often the scheduler looks for due schedules
+POLL_INTERVAL = int(os.environ.get('RANK_SCHEDULER_POLL_SECONDS', '30'))
+
+# Default window over which schedule start times are spread
+DEFAULT_SPLAY_SECONDS = 600
+
+# Lookups queued on the fetch engine at a time by one scheduled run
+SUBMIT_CHUNK_SIZE = 20
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS schedules (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    cron TEXT NOT NULL,
+    definition TEXT NOT NULL,
+    enabled INTEGER NOT NULL DEFAULT 1,
+    splay_seconds INTEGER NOT NULL DEFAULT 600,
+    next_fire_time INTEGER,
+    next_run_at INTEGER,
+    created_at INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS schedule_runs (
+    schedule_id TEXT NOT NULL,
+    fire_time INTEGER NOT NULL,
+    job_id TEXT NOT NULL,
+    claimed_by TEXT NOT NULL,
+    claimed_at INTEGER NOT NULL,
+    PRIMARY KEY (schedule_id, fire_time)
+);
+"""
+
+CRON_ALIASES = {
+    '@hourly': '0 * * * *',
+    '@daily': '0 0 * * *',
+    '@weekly': '0 0 * * 0',
+    '@monthly': '0 0 1 * *'
+}
+
+# (minimum, maximum) for minute, hour, day of month, month, day of week
+CRON_FIELD_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 6)]
+
+class CronSchedule:
+    """Five-field cron expression (minute hour day-of-month month day-of-week).
+
+    Supports '*', single values, ranges 'a-b', steps '*/n' or 'a-b/n', comma
+    lists and the @hourly/@daily/@weekly/@monthly aliases. Day of week is
+    0-6 starting on Sunday (7 is also Sunday).
+    """
+    def __init__(self, expression):
+        self.expression = expression.strip()
+        fields = CRON_ALIASES.get(self.expression, self.expression).split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression must have 5 fields: '{expression}'")
+        self.minutes, self.hours, self.days, self.months, self.weekdays = [
+            parse_cron_field(field, minimum, maximum, weekday=(index == 4))
+            for index, (field, (minimum, maximum)) in enumerate(zip(fields, CRON_FIELD_RANGES))
+        ]
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    def matches_day(self, moment):
+        weekday = (moment.weekday() + 1) % 7  # Python Monday=0 -> cron Sunday=0
+        day_match = moment.day in self.days
+        weekday_match = weekday in self.weekdays
+        # Standard cron: when both day fields are restricted either one may match
+        if not self.any_day and not self.any_weekday:
+            return day_match or weekday_match
+        return day_match and weekday_match
+
+    def next_after(self, moment):
+        """Return the first matching minute strictly after `moment`."""
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + timedelta(days=366 * 5)
+        while candidate < limit:
+            if candidate.month not in self.months:
+                candidate = (candidate.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+                continue
+            if not self.matches_day(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+            if candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+                continue
+            if candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+                continue
+            return candidate
+        raise ValueError(f"Cron expression never fires: '{self.expression}'")
+
+def parse_cron_field(field, minimum, maximum, weekday=False):
+    values = set()
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part, step_text = part.split('/', 1)
+            step = int(step_text)
+            if step < 1:
+                raise ValueError(f"Invalid cron step: '{field}'")
+        if part == '*':
+            start, end = minimum, maximum
+        elif '-' in part:
+            start_text, end_text = part.split('-', 1)
+            start, end = int(start_text), int(end_text)
+        else:
+            start = end = int(part)
+            if step > 1:
+                end = maximum
+        if weekday:
+            # Allow 7 for Sunday
+            if start == 7 and end == 7:
+                start = end = 0
+            end = min(end, 7)
+        if start < minimum or end > (7 if weekday else maximum) or start > end:
+            raise ValueError(f"Cron field out of range: '{field}'")
+        for value in range(start, end + 1, step):
+            values.add(0 if weekday and value == 7 else value)
+    return values
+
+def get_splay_offset(schedule_id, splay_seconds):
+    """Stable per-schedule delay so schedules sharing a cron time start spread out."""
+    if splay_seconds <= 0:
+        return 0
+    digest = hashlib.sha1(schedule_id.encode()).hexdigest()
+    return int(digest[:8], 16) % (splay_seconds + 1)
+
+def validate_definition(definition):
+    """Check a schedule definition and return it with defaults filled in."""
+    target_urls = definition.get('target_urls') or ([definition['target_url']] if definition.get('target_url') else [])
+    if not target_urls:
+        raise ValueError("Missing required field: target_urls")
+    if not definition.get('keywords') and not definition.get('csv_file'):
+        raise ValueError("Missing required field: keywords or csv_file")
+
+    locations = []
+    for location in definition.get('locations') or [{'location_code': 2356}]:
+        if isinstance(location, dict):
+            location_code, location_name = resolve_location(location.get('location_code'), location.get('location_name', ''))
+        else:
+            location_code, location_name = resolve_location(location)
+        locations.append({'location_code': location_code, 'location_name': location_name})
+
+    devices = definition.get('devices') or ['desktop']
+    profile = definition.get('profile', DEFAULT_PROFILE)
+    if profile not in REQUEST_PROFILES:
+        raise ValueError(f"Unknown profile '{profile}'. Available: {', '.join(REQUEST_PROFILES)}")
+
+    return {
+        'target_urls': target_urls,
+        'keywords': definition.get('keywords') or [],
+        'csv_file': definition.get('csv_file'),
+        'locations': locations,
+        'devices': devices,
+        'profile': profile,
+        'limit': definition.get('limit'),
+        'max_cost': float(definition['max_cost']) if definition.get('max_cost') is not None else None,
+        'smart_refresh': bool(definition.get('smart_refresh', False)),
+        'api_credentials': definition.get('api_credentials') or {}
+    }
+
+def load_schedule_keywords(definition):
+    """Return the keyword list of a schedule, reading its CSV file if it has one."""
+    keywords = list(definition['keywords'])
+    if definition.get('csv_file'):
+        with open(definition['csv_file'], 'r') as file:
+            reader = csv.DictReader(file)
+            for row in reader:
+                keyword = row.get('Keyword') or row.get('Keywords')
+                if keyword:
+                    keywords.append(keyword)
+    if definition.get('limit'):
+        keywords = keywords[:int(definition['limit'])]
+    return keywords
+
+class ScheduleStore:
+    """Recurring job definitions and the run claims that prevent double-firing."""
+    def __init__(self, db_path=DEFAULT_SCHEDULES_DB):
+        self.db_path = db_path
+        self.local = threading.local()
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.get_connection().executescript(SCHEMA)
+
+    def get_connection(self):
+        """Return this thread's connection, opening it on first use."""
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            self.local.connection = connection
+        return connection
+
+    def create_schedule(self, name, cron, definition, splay_seconds=DEFAULT_SPLAY_SECONDS, enabled=True):
+        cron_schedule = CronSchedule(cron)
+        definition = validate_definition(definition)
+        schedule_id = uuid.uuid4().hex
+        fire_time = cron_schedule.next_after(datetime.now())
+        next_fire_time = int(fire_time.timestamp())
+        connection = self.get_connection()
+        with connection:
+            connection.execute(
+                "INSERT INTO schedules (id, name, cron, definition, enabled, splay_seconds, next_fire_time, next_run_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (schedule_id, name, cron_schedule.expression, json.dumps(definition), int(enabled), int(splay_seconds),
+                 next_fire_time, next_fire_time + get_splay_offset(schedule_id, splay_seconds), int(time.time())))
+        return self.get_schedule(schedule_id)
+
+    def get_schedule(self, schedule_id):
+        row = self.get_connection().execute("SELECT * FROM schedules WHERE id = ?", (schedule_id,)).fetchone()
+        return schedule_from_row(row) if row else None
+
+    def list_schedules(self, enabled_only=False):
+        query = "SELECT * FROM schedules"
+        if enabled_only:
+            query += " WHERE enabled = 1"
+        query += " ORDER BY created_at"
+        return [schedule_from_row(row) for row in self.get_connection().execute(query)]
+
+    def delete_schedule(self, schedule_id):
+        connection = self.get_connection()
+        with connection:
+            cursor = connection.execute("DELETE FROM schedules WHERE id = ?", (schedule_id,))
+        return cursor.rowcount > 0
+
+    def get_due_schedules(self, now):
+        cursor = self.get_connection().execute(
+            "SELECT * FROM schedules WHERE enabled = 1 AND next_run_at <= ?", (int(now),))
+        return [schedule_from_row(row) for row in cursor]
+
+    def claim_run(self, schedule, job_id, worker_id):
+        """Claim the schedule's current fire time and advance it to the next one.
+
+        The (schedule_id, fire_time) primary key means only one worker
+        process can claim a given run. Returns True for the winner.
+        """
+        fire_time = schedule['next_fire_time']
+        cron_schedule = CronSchedule(schedule['cron'])
+        # Missed runs (e.g. while the service was down) collapse into this one
+        next_fire = cron_schedule.next_after(max(datetime.fromtimestamp(fire_time), datetime.now()))
+        next_fire_time = int(next_fire.timestamp())
+        next_run_at = next_fire_time + get_splay_offset(schedule['id'], schedule['splay_seconds'])
+
+        connection = self.get_connection()
+        with connection:
+            cursor = connection.execute(
+                "INSERT OR IGNORE INTO schedule_runs (schedule_id, fire_time, job_id, claimed_by, claimed_at) VALUES (?, ?, ?, ?, ?)",
+                (schedule['id'], fire_time, job_id, worker_id, int(time.time())))
+            claimed = cursor.rowcount == 1
+            connection.execute(
+                "UPDATE schedules SET next_fire_time = ?, next_run_at = ? WHERE id = ? AND next_fire_time = ?",
+                (next_fire_time, next_run_at, schedule['id'], fire_time))
+        return claimed
+
+def schedule_from_row(row):
+    schedule = dict(row)
+    schedule['definition'] = json.loads(schedule['definition'])
+    schedule['enabled'] = bool(schedule['enabled'])
+    # Never echo stored credentials back through the API
+    if schedule['definition'].get('api_credentials'):
+        schedule['definition'] = dict(schedule['definition'], api_credentials={'login': schedule['definition']['api_credentials'].get('login')})
+    return schedule
+
+def run_schedule(schedule_id, job_id, store=None):
+    """Run one occurrence of a schedule as a job, recording results to the rank history."""
+    from rank_checker import get_ranking
+    store = store or get_schedule_store()
+    job_store = get_job_store()
+    row = store.get_connection().execute("SELECT definition FROM schedules WHERE id = ?", (schedule_id,)).fetchone()
+    if row is None:
+        job_store.finish_job(job_id, error="Schedule was deleted")
+        return
+    definition = json.loads(row['definition'])
+
+    try:
+        keywords = load_schedule_keywords(definition)
+        combinations = []
+        for location in definition['locations']:
+            for device in definition['devices']:
+                planned = keywords
+                if definition.get('smart_refresh'):
+                    # Only keywords whose re-check interval has passed, from their rank history
+                    planned = plan_keywords(get_rank_history(), definition['target_urls'], keywords,
+                                            location['location_code'], location['location_name'], device)
+                    print(f"Smart refresh for schedule {schedule_id} ({location['location_code']}, {device}): "
+                          f"{len(planned)} of {len(set(keywords))} keywords due")
+                combinations.append((location, device, planned))
+        total = sum(len(planned) for _, _, planned in combinations) * len(definition['target_urls'])
+        job_store.start_job(job_id, total_keywords=total)
+
+        credentials = definition.get('api_credentials') or {}
+        api_login = credentials.get('login') or os.environ.get('DATAFORSEO_LOGIN')
+        api_password = credentials.get('password') or os.environ.get('DATAFORSEO_PASSWORD')
+        if (not api_login or not api_password) and not POOL_FOR_ANONYMOUS:
+            raise ValueError("No API credentials in the schedule or DATAFORSEO_LOGIN/DATAFORSEO_PASSWORD "
+                             "(set RANK_POOL_FOR_ANONYMOUS=1 to use DATAFORSEO_ACCOUNTS)")
+        try:
+            client = make_client(api_login, api_password)
+        except ValueError:
+            raise ValueError("No API credentials in the schedule, DATAFORSEO_LOGIN/DATAFORSEO_PASSWORD or DATAFORSEO_ACCOUNTS")
+        retry_budget = RetryBudget.for_keywords(total)
+        cost_budget = CostBudget(definition.get('max_cost'))
+        job_store.update_job(job_id, max_cost=cost_budget.max_cost)
+        engine = get_fetch_engine()
+        processed = 0
+
+        for location, device, planned in combinations:
+            results = {target_url: [] for target_url in definition['target_urls']}
+            # Queue lookups in chunks on the bulk lane so the job takes turns with others
+            for start in range(0, len(planned), SUBMIT_CHUNK_SIZE):
+                lookups = [(keyword, target_url)
+                           for keyword in planned[start:start + SUBMIT_CHUNK_SIZE]
+                           for target_url in definition['target_urls']]
+                futures = [
+                    engine.submit(get_ranking, client, keyword, target_url, location['location_code'],
+                                  location_name=location['location_name'], device=device,
+                                  profile=definition['profile'], retry_budget=retry_budget,
+                                  cost_budget=cost_budget, lane=LANE_BULK, job_key=job_id)
+                    for keyword, target_url in lookups
+                ]
+                for (keyword, target_url), future in zip(lookups, futures):
+                    results[target_url].append((keyword, future.result()))
+                processed += len(lookups)
+                job_store.update_job(job_id, processed_keywords=processed, cost=cost_budget.get_state()['spent'])
+
+            for target_url, target_results in results.items():
+                get_rank_history().record_results(target_url, location['location_code'],
+                                                  location['location_name'], device, target_results)
+
+        job_store.update_job(job_id, processed_keywords=processed, cost=cost_budget.get_state()['spent'])
+        if cost_budget.exceeded():
+            job_store.finish_job(job_id, error=f"Cost budget of ${cost_budget.max_cost} reached")
+            print(f"Scheduled job {job_id} stopped at its cost budget")
+            return
+        job_store.finish_job(job_id)
+        print(f"Scheduled job {job_id} completed: {processed} lookups")
+    except Exception as e:
+        print(f"Error running schedule {schedule_id}: {e}")
+        job_store.finish_job(job_id, error=str(e))
+
+class Scheduler:
+    """Background thread that starts due schedules.
+
+    Every worker process may run one; the run claim in the database makes
+    sure each occurrence starts exactly once.
+    """
+    def __init__(self, store=None, poll_interval=POLL_INTERVAL):
+        self.store = store
+        self.poll_interval = poll_interval
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def tick(self, now=None):
+        """Start every due schedule this worker manages to claim. Returns the started job IDs."""
+        store = self.store or get_schedule_store()
+        now = now or time.time()
+        started = []
+        for schedule in store.get_due_schedules(now):
+            job_id = uuid.uuid4().hex
+            if not store.claim_run(schedule, job_id, self.worker_id):
+                continue
+            get_job_store().create_job(JOB_SCHEDULED, params={'schedule_name': schedule['name']},
+                                       schedule_id=schedule['id'], job_id=job_id)
+            thread = threading.Thread(target=run_schedule, args=(schedule['id'], job_id, store))
+            thread.daemon = True
+            thread.start()
+            print(f"Started scheduled job {job_id} for schedule '{schedule['name']}'")
+            started.append(job_id)
+        return started
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"Error in scheduler: {e}")
+            self.stop_event.wait(self.poll_interval)
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+# Shared store, created on first use
+schedule_store = None
+schedule_store_lock = threading.Lock()
+
+def get_schedule_store():
+    """Return the process-wide ScheduleStore."""
+    global schedule_store
+    with schedule_store_lock:
+        if schedule_store is None:
+            schedule_store = ScheduleStore()
+        return schedule_store
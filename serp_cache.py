@@ -0,0 +1,278 @@
+import os
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+ORGANIC = sys.intern('organic')
+
+def normalize_host(host):
+    """Lower-case a host name and drop a leading www."""
+    host = (host or '').strip().lower()
+    return host[4:] if host.startswith('www.') else host
+
+def get_host(item):
+    host = item.get('domain')
+    if not host:
+        try:
+            host = urlsplit(item.get('url') or '').hostname
+        except ValueError:
+            host = None
+    return sys.intern(normalize_host(host))
+
+def host_suffixes(host):
+    """The host and each parent domain with at least two labels (blog.example.com -> example.com)."""
+    labels = host.split('.')
+    for index in range(max(1, len(labels) - 1)):
+        yield '.'.join(labels[index:])
+
+class CompactSerp:
+    """Parsed SERP kept in a compact, target-independent form.
+
+    Items are stored column-wise in order: interned type and host strings,
+    lower-cased URLs joined into a single string, and rank numbers in
+    unsigned short arrays (0 = missing). host_index maps every host and
+    parent domain to the first organic item on it, so any target domain is
+    resolved with one dict lookup.
+    """
+    __slots__ = ('types', 'hosts', 'urls', 'rank_groups', 'rank_absolutes',
+                 'organic_positions', 'organic_count', 'host_index')
+
+    def __init__(self, items):
+        types = []
+        hosts = []
+        urls = []
+        self.rank_groups = array('H')
+        self.rank_absolutes = array('H')
+        self.organic_positions = array('H')
+        self.organic_count = 0
+        self.host_index = {}
+
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            item_type = sys.intern(item.get('type') or ORGANIC)
+            host = get_host(item)
+            types.append(item_type)
+            hosts.append(host)
+            urls.append((item.get('url') or '').lower())
+            self.rank_groups.append(min(item.get('rank_group') or 0, 65535))
+            self.rank_absolutes.append(min(item.get('rank_absolute') or 0, 65535))
+
+            if item_type is ORGANIC:
+                self.organic_count += 1
+                self.organic_positions.append(self.organic_count)
+                index = len(types) - 1
+                for suffix in host_suffixes(host):
+                    self.host_index.setdefault(sys.intern(suffix), index)
+            else:
+                self.organic_positions.append(0)
+
+        self.types = tuple(types)
+        self.hosts = tuple(hosts)
+        self.urls = '\n'.join(urls)
+
+    @classmethod
+    def from_response(cls, response):
+        """Build a CompactSerp from a successful live/advanced response."""
+        items = []
+        tasks = response.get("tasks") or []
+        if tasks:
+            results = tasks[0].get("result") or []
+            if results:
+                result_items = results[0].get("items")
+                # Older responses group items by type
+                if isinstance(result_items, dict):
+                    for item in result_items.get("organic") or []:
+                        items.append(dict(item, type=ORGANIC))
+                elif isinstance(result_items, list):
+                    items = result_items
+        return cls(items)
+
+    def __len__(self):
+        return len(self.types)
+
+    def make_rank_info(self, index, position):
+        return {
+            "position": position,
+            "rank_group": self.rank_groups[index] or position,
+            "rank_absolute": self.rank_absolutes[index] or position
+        }
+
+    def find(self, target_url, item_types=('organic',)):
+        """Return the rank_info of target_url, "Not in top results" or "No results found".
+
+        position counts only items of item_types, as in the original
+        parsing. Plain domains scanned against organic results use the host
+        index; targets with a path or other item types fall back to matching
+        the URL text of each item in order.
+        """
+        target = target_url.strip().lower()
+        item_types = tuple(item_types)
+
+        if item_types == (ORGANIC,) and '/' not in target:
+            if not self.organic_count:
+                return "No results found"
+            index = self.host_index.get(normalize_host(target))
+            if index is None:
+                return "Not in top results"
+            return self.make_rank_info(index, self.organic_positions[index])
+
+        target_no_www = target.replace("www.", "")
+        target_with_www = "www." + target
+        urls = self.urls.split('\n')
+        position = 0
+        for index, item_type in enumerate(self.types):
+            if item_type not in item_types:
+                continue
+            position += 1
+            url = urls[index]
+            if url and (target in url or target_no_www in url or target_with_www in url):
+                return self.make_rank_info(index, position)
+        return "Not in top results" if position else "No results found"
+
+# Age after which a cached SERP is fetched again. Rankings move, and a
+# recurring schedule must record today's position, not one fetched hours ago,
+# so this stays well below the shortest schedule interval (@hourly).
+SERP_CACHE_TTL = float(os.environ.get('SERP_CACHE_TTL_SECONDS', '900'))
+
+class SerpCache:
+    """LRU cache of CompactSerp objects keyed by the upstream request, each kept for at most ttl seconds."""
+    def __init__(self, max_entries=200000, ttl=SERP_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # key -> (fetched_at, serp)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0}
+
+    def get(self, key, now=None):
+        now = now or time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] + self.ttl <= now:
+                del self.entries[key]
+                self.stats['expired'] += 1
+                entry = None
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry[1]
+
+    def contains(self, key, now=None):
+        """Check for an unexpired key without counting a hit or refreshing its position."""
+        now = now or time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry is not None and entry[0] + self.ttl > now
+
+    def put(self, key, serp, now=None):
+        with self.lock:
+            self.entries[key] = (now or time.time(), serp)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats, entries=len(self.entries), max_entries=self.max_entries, ttl_seconds=self.ttl)
+
+# Shared cache of parsed SERPs for every job in the process
+serp_cache = SerpCache(max_entries=int(os.environ.get('SERP_CACHE_MAX_ENTRIES', '200000')))
+
+# Lifetime of a "No results found" answer; the SERP may fill in later
+EMPTY_RESULT_TTL = float(os.environ.get('SERP_EMPTY_TTL_SECONDS', str(6 * 3600)))
+
+# Backoff of a key whose lookups failed: the first failure is cached for
+# ERROR_BASE_TTL, and every further one doubles it up to ERROR_MAX_TTL
+ERROR_BASE_TTL = float(os.environ.get('SERP_ERROR_BASE_TTL_SECONDS', '60'))
+ERROR_MAX_TTL = float(os.environ.get('SERP_ERROR_MAX_TTL_SECONDS', '3600'))
+
+class NegativeEntry:
+    __slots__ = ('result', 'expires_at', 'failures')
+
+    def __init__(self, result, expires_at, failures):
+        self.result = result
+        self.expires_at = expires_at
+        self.failures = failures
+
+class NegativeCache:
+    """Short-lived answers for lookups that produced no SERP.
+
+    An empty SERP is remembered as "No results found" for EMPTY_RESULT_TTL.
+    A failed lookup ("API Error"/"Error") is remembered for a TTL that
+    doubles with each consecutive failure of the same key, so a keyword the
+    API keeps rejecting is tried less and less often. An expired error entry
+    keeps its failure count until the key succeeds, which clears it.
+    """
+    def __init__(self, max_entries=50000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {'empty_hits': 0, 'error_hits': 0, 'empty_stored': 0, 'errors_stored': 0,
+                      'backoffs': 0, 'cleared': 0, 'evictions': 0}
+
+    def get(self, key, now=None):
+        """Return the cached negative result of a key, or None if there is none or it expired."""
+        now = now or time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry.expires_at <= now:
+                return None
+            self.stats['error_hits' if entry.failures else 'empty_hits'] += 1
+            return entry.result
+
+    def contains(self, key, now=None):
+        """Check for an unexpired entry without counting a hit."""
+        now = now or time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry is not None and entry.expires_at > now
+
+    def record_empty(self, key):
+        self.store(key, NegativeEntry("No results found", time.time() + EMPTY_RESULT_TTL, 0))
+        with self.lock:
+            self.stats['empty_stored'] += 1
+
+    def record_error(self, key, result):
+        """Cache a failed lookup and return how long the key now backs off."""
+        with self.lock:
+            previous = self.entries.get(key)
+            failures = (previous.failures if previous else 0) + 1
+            self.stats['errors_stored'] += 1
+            if failures > 1:
+                self.stats['backoffs'] += 1
+        ttl = min(ERROR_MAX_TTL, ERROR_BASE_TTL * 2 ** (failures - 1))
+        self.store(key, NegativeEntry(result, time.time() + ttl, failures))
+        return ttl
+
+    def clear(self, key):
+        """Forget a key after a successful lookup."""
+        with self.lock:
+            if self.entries.pop(key, None) is not None:
+                self.stats['cleared'] += 1
+
+    def store(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def get_stats(self, now=None):
+        now = now or time.time()
+        with self.lock:
+            active = [entry for entry in self.entries.values() if entry.expires_at > now]
+            return dict(self.stats, entries=len(self.entries), max_entries=self.max_entries,
+                        active_empty=sum(1 for entry in active if not entry.failures),
+                        active_errors=sum(1 for entry in active if entry.failures),
+                        max_failures=max((entry.failures for entry in self.entries.values()), default=0))
+
+# Shared negative results for every job in the process
+negative_cache = NegativeCache(max_entries=int(os.environ.get('SERP_NEGATIVE_CACHE_MAX_ENTRIES', '50000')))
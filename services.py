@@ -0,0 +1,114 @@
+import os
+import threading
+import time
+
+# Background services of the web app. Nothing here runs at import time:
+# start_services() is called once per process from a lifecycle hook
+# (gunicorn.conf.py, or app.py when run directly).
+
+# Longest the cleanup thread sleeps, so uploads indexed by other processes are seen
+CLEANUP_INTERVAL = int(os.environ.get('UPLOAD_CLEANUP_INTERVAL_SECONDS', '3600'))
+
+# Only the process holding this lock cleans uploads, however many workers run
+LEADER_LOCK_PATH = os.environ.get('RANK_SERVICES_LOCK', os.path.join('data', 'services.lock'))
+
+services_lock = threading.Lock()
+running_services = {}
+startup_stats = {}
+
+def acquire_leader_lock():
+    """Try to become the process that runs singleton services. Returns the held lock file or None."""
+    try:
+        import fcntl
+    except ImportError:
+        # No flock on this platform; every process acts as leader
+        return True
+    directory = os.path.dirname(LEADER_LOCK_PATH)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    lock_file = open(LEADER_LOCK_PATH, 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+def start_cleanup_service():
+    """Delete expired uploads in whichever process holds the leader lock.
+
+    The upload index says when the next file expires, so the thread sleeps
+    until then (at most CLEANUP_INTERVAL) instead of scanning the uploads
+    directory. Processes that don't hold the lock retry each interval, so
+    another worker takes over when the leader exits.
+    """
+    from uploads import get_upload_store
+    from worker import distributed_enabled
+    from work_queue import get_work_queue
+    from jobs import get_job_store
+
+    def cleanup_thread():
+        leader = None
+        while True:
+            delay = CLEANUP_INTERVAL
+            adopt = False
+            if leader is None:
+                leader = acquire_leader_lock()
+                adopt = leader is not None
+            if leader is not None:
+                try:
+                    store = get_upload_store()
+                    if adopt:
+                        # Files saved before the index existed are indexed once
+                        store.adopt_untracked()
+                    store.expire_due()
+                    # Results spilled to the job store by jobs finished before the retention window
+                    get_job_store().purge_results(time.time() - store.retention)
+                    if distributed_enabled():
+                        # Shard results of jobs finished before the retention window
+                        get_work_queue().purge(time.time() - store.retention)
+                    next_expiry = store.next_expiry()
+                    if next_expiry is not None:
+                        delay = min(CLEANUP_INTERVAL, max(1, next_expiry - time.time()))
+                except Exception as e:
+                    print(f"Error cleaning up old files: {e}")
+            time.sleep(delay)
+
+    thread = threading.Thread(target=cleanup_thread)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+def start_scheduler_service():
+    """Start the scheduler for recurring jobs unless RANK_SCHEDULER_ENABLED=0.
+
+    Runs are claimed in the database, so every worker can run one without
+    double-firing.
+    """
+    if os.environ.get('RANK_SCHEDULER_ENABLED', '1') != '1':
+        return None
+    from scheduler import Scheduler
+    scheduler = Scheduler()
+    scheduler.start()
+    return scheduler
+
+def start_services():
+    """Start the background services of this process. Safe to call more than once."""
+    with services_lock:
+        if running_services:
+            return running_services
+        start_time = time.perf_counter()
+        running_services['cleanup'] = start_cleanup_service()
+        running_services['scheduler'] = start_scheduler_service()
+        startup_stats['pid'] = os.getpid()
+        startup_stats['services_started_at'] = int(time.time())
+        startup_stats['services_seconds'] = round(time.perf_counter() - start_time, 4)
+        print(f"Background services started in process {os.getpid()}")
+        return running_services
+
+def record_startup(name, seconds):
+    """Record a boot phase duration, such as app import or worker init."""
+    startup_stats[name] = round(seconds, 4)
+
+def get_startup_stats():
+    return dict(startup_stats)
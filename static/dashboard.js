@@ -7,6 +7,7 @@ document.addEventListener('DOMContentLoaded', function() {
     const statusText = document.getElementById('status-text');
     const currentKeyword = document.getElementById('current-keyword');
     const progressText = document.getElementById('progress-text');
+    const costText = document.getElementById('cost-text');
     const progressBar = document.getElementById('progress-bar');
     const errorMessage = document.getElementById('error-message');
     const downloadBtn = document.getElementById('download-btn');
@@ -99,6 +100,7 @@ document.addEventListener('DOMContentLoaded', function() {
         statusText.textContent = 'Starting...';
         currentKeyword.textContent = '-';
         progressText.textContent = '0/0';
+        costText.textContent = '-';
         progressBar.style.width = '0%';
         progressBar.textContent = '0%';
         errorMessage.classList.add('d-none');
@@ -226,6 +228,12 @@ document.addEventListener('DOMContentLoaded', function() {
             progressBar.style.width = `${progress}%`;
             progressBar.textContent = `${progress}%`;
         }
+        
+        // Spend so far, with the estimate and budget when known
+        let cost = `$${(data.cost || 0).toFixed(4)}`;
+        if (data.estimate) cost += ` (estimated $${data.estimate.estimated_cost.toFixed(4)})`;
+        if (data.max_cost !== null && data.max_cost !== undefined) cost += ` of $${Number(data.max_cost).toFixed(2)} budget`;
+        costText.textContent = cost;
     }
     
     // Update results table
@@ -312,4 +320,134 @@ document.addEventListener('DOMContentLoaded', function() {
         errorMessage.textContent = message;
         errorMessage.classList.remove('d-none');
     }
+
+    // Rank analytics over the stored history
+    const analyticsForm = document.getElementById('analytics-form');
+    const analyticsBody = document.getElementById('analytics-body');
+    const analyticsError = document.getElementById('analytics-error');
+    const analyticsMovement = document.getElementById('analytics-movement');
+    const analyticsTiming = document.getElementById('analytics-timing');
+
+    analyticsForm.addEventListener('submit', function(e) {
+        e.preventDefault();
+
+        const domain = document.getElementById('analytics-domain').value.trim();
+        const start = document.getElementById('analytics-start').value;
+        const end = document.getElementById('analytics-end').value;
+        const params = new URLSearchParams({group_by: document.getElementById('analytics-group-by').value});
+        if (start) params.set('start', start);
+        if (end) params.set('end', end);
+
+        analyticsError.classList.add('d-none');
+        analyticsBody.innerHTML = '';
+        analyticsMovement.textContent = '';
+        analyticsTiming.textContent = '';
+
+        fetch(`/history/${encodeURIComponent(domain)}/analytics?${params}`)
+        .then(response => response.json())
+        .then(data => {
+            if (data.error) {
+                analyticsError.textContent = data.error;
+                analyticsError.classList.remove('d-none');
+                return;
+            }
+            updateAnalyticsTable(data.groups);
+            analyticsTiming.textContent = `${data.rows} rows, loaded in ${data.timing_ms.load} ms, computed in ${data.timing_ms.compute} ms`;
+
+            // Movement between the first and last date of the selection
+            const dates = data.groups.map(group => group.date).filter(Boolean);
+            if (dates.length >= 2) {
+                const movementParams = new URLSearchParams({from: dates[0], to: dates[dates.length - 1]});
+                return fetch(`/history/${encodeURIComponent(domain)}/movement?${movementParams}`)
+                    .then(response => response.json())
+                    .then(movement => {
+                        if (!movement.error) {
+                            analyticsMovement.textContent = `${movement.from} → ${movement.to}: ` +
+                                `${movement.improved} improved, ${movement.declined} declined, ` +
+                                `${movement.entered} entered, ${movement.dropped} dropped`;
+                        }
+                    });
+            }
+        })
+        .catch(error => {
+            analyticsError.textContent = 'Error loading analytics: ' + error.message;
+            analyticsError.classList.remove('d-none');
+        });
+    });
+
+    function updateAnalyticsTable(groups) {
+        groups.forEach(group => {
+            const row = document.createElement('tr');
+            const label = [group.date, group.location_name || group.location_code, group.device]
+                .filter(value => value !== undefined && value !== '').join(' / ');
+            const values = [
+                label,
+                group.keywords,
+                group.ranked,
+                group.average_position === null ? '-' : group.average_position,
+                (group.top3_share * 100).toFixed(1) + '%',
+                (group.top10_share * 100).toFixed(1) + '%',
+                group.visibility.toFixed(2)
+            ];
+            values.forEach(value => {
+                const cell = document.createElement('td');
+                cell.textContent = value;
+                row.appendChild(cell);
+            });
+            analyticsBody.appendChild(row);
+        });
+    }
+
+    // Location choices and autocomplete from the local location catalog
+    const locationCodeSelect = document.getElementById('location-code');
+    const locationNameInput = document.getElementById('location-name');
+    const locationSuggestions = document.getElementById('location-suggestions');
+    const countryCodes = {};  // location_code -> country_iso_code
+    let suggestTimer;
+
+    fetch('/locations')
+        .then(response => response.json())
+        .then(data => {
+            if (!data.locations || !data.locations.length) {
+                return;  // Keep the built-in options
+            }
+            const selected = locationCodeSelect.value;
+            locationCodeSelect.innerHTML = '';
+            data.locations.forEach(location => {
+                countryCodes[location.location_code] = location.country_iso_code;
+                const option = document.createElement('option');
+                option.value = location.location_code;
+                option.textContent = `${location.location_name} (${location.location_code})`;
+                option.selected = String(location.location_code) === selected;
+                locationCodeSelect.appendChild(option);
+            });
+        })
+        .catch(error => console.error('Error loading locations:', error));
+
+    locationNameInput.addEventListener('input', function() {
+        clearTimeout(suggestTimer);
+        const query = locationNameInput.value.trim();
+        if (query.length < 2) {
+            locationSuggestions.innerHTML = '';
+            return;
+        }
+        // Wait for a pause in typing before asking the server
+        suggestTimer = setTimeout(() => {
+            const country = countryCodes[locationCodeSelect.value] || '';
+            fetch(`/locations?q=${encodeURIComponent(query)}&country=${encodeURIComponent(country)}&limit=10`)
+                .then(response => response.json())
+                .then(data => {
+                    locationSuggestions.innerHTML = '';
+                    (data.locations || [])
+                        .filter(location => location.location_type !== 'Country')
+                        .forEach(location => {
+                            const option = document.createElement('option');
+                            option.value = location.location_name;
+                            option.textContent = location.location_type;
+                            locationSuggestions.appendChild(option);
+                        });
+                })
+                .catch(error => console.error('Error loading location suggestions:', error));
+        }, 150);
+    });
 });
\ No newline at end of file
@@ -0,0 +1,57 @@
+import threading
+from types import MappingProxyType
+
+# Processing status shared between the job thread that writes it and the
+# request threads that read it. Every change publishes a new read-only
+# snapshot with a higher version; readers take the current snapshot with a
+# single attribute read, so they never wait for a writer and never see half
+# of an update.
+
+class StatusBoard:
+    """Versioned, immutable status snapshots with one writer generation per job.
+
+    reset() starts a new generation. Updates from a job thread carry the
+    generation it was started with and are dropped once a newer job has
+    reset the board, so a finishing thread cannot overwrite its successor.
+    """
+    def __init__(self, initial):
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.current = MappingProxyType(dict(initial, version=0, generation=0))
+
+    def snapshot(self):
+        """The current status; a read-only mapping that never changes after it is published."""
+        return self.current
+
+    def publish(self, fields):
+        # Called with the lock held
+        self.current = MappingProxyType(dict(fields, version=self.current['version'] + 1,
+                                             generation=self.generation))
+
+    def reset(self, fields, unless_processing=False):
+        """Replace the status for a new job and return its generation.
+
+        With unless_processing, returns None instead when a job is still running.
+        """
+        with self.lock:
+            if unless_processing and self.current.get('is_processing'):
+                return None
+            self.generation += 1
+            self.publish(fields)
+            return self.generation
+
+    def update(self, generation=None, **fields):
+        """Publish changed fields. Returns False (changing nothing) if generation is not the current one."""
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return False
+            self.publish(dict(self.current, **fields))
+            return True
+
+    def claim(self, generation, **fields):
+        """Mark the board processing for generation unless a job is already running. Returns True on success."""
+        with self.lock:
+            if generation != self.generation or self.current.get('is_processing'):
+                return False
+            self.publish(dict(self.current, is_processing=True, **fields))
+            return True
@@ -0,0 +1,94 @@
+import asyncio
+import gzip
+import json
+import os
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# The async lookup path against a local stand-in for DataForSEO: the client
+# must follow DATAFORSEO_API_URL, and get_rankings_async must stay within the
+# shared concurrency controller's limit however many keywords it gathers.
+
+TARGET_URL = "example.com"
+LIMIT = 2
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+class StandIn(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    in_flight = 0
+    most_in_flight = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        body = gzip.decompress(self.rfile.read(int(self.headers["Content-Length"])))
+        tasks = json.loads(body)
+        keyword = next(iter(tasks.values() if isinstance(tasks, dict) else tasks))["keyword"]
+        with StandIn.lock:
+            StandIn.in_flight += 1
+            StandIn.most_in_flight = max(StandIn.most_in_flight, StandIn.in_flight)
+        time.sleep(0.05)
+        with StandIn.lock:
+            StandIn.in_flight -= 1
+        position = int(keyword.rsplit(" ", 1)[1]) + 1
+        items = [{"type": "organic", "rank_group": rank, "rank_absolute": rank,
+                  "url": f"https://site{rank}.test/", "domain": f"site{rank}.test"} for rank in range(1, 11)]
+        items[position - 1].update(url=f"https://{TARGET_URL}/", domain=TARGET_URL)
+        response = json.dumps({"status_code": 20000, "tasks": [
+            {"status_code": 20000, "cost": 0.002, "result": [{"items": items}]}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+def test_async_rankings_follow_api_url_and_controller():
+    import rank_checker
+    from async_client import AsyncRestClient
+    from resilience import RateLimiter
+
+    port = free_port()
+    server = ThreadingHTTPServer(("127.0.0.1", port), StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_url = os.environ.get("DATAFORSEO_API_URL")
+    os.environ["DATAFORSEO_API_URL"] = f"http://127.0.0.1:{port}"
+    controller = rank_checker.concurrency_controller
+    limiter, limit, max_limit = rank_checker.rate_limiter, controller.limit, controller.max_limit
+    rank_checker.rate_limiter = RateLimiter(1000, burst=100)
+    # Pin the adaptive limit so successes cannot raise it during the test
+    controller.limit = controller.max_limit = LIMIT
+    run = time.time_ns()
+    keywords = [f"async {run} {index}" for index in range(8)]
+
+    async def check():
+        client = AsyncRestClient("login", "password", max_connections=20)
+        try:
+            return await rank_checker.get_rankings_async(client, keywords, TARGET_URL, 2840)
+        finally:
+            await client.close()
+
+    try:
+        results = asyncio.run(check())
+    finally:
+        server.shutdown()
+        rank_checker.rate_limiter = limiter
+        controller.limit, controller.max_limit = limit, max_limit
+        if api_url is None:
+            os.environ.pop("DATAFORSEO_API_URL")
+        else:
+            os.environ["DATAFORSEO_API_URL"] = api_url
+
+    assert [result["rank_group"] for result in results] == [index + 1 for index in range(8)]
+    assert StandIn.most_in_flight <= LIMIT
+    assert controller.in_flight == 0
+
+if __name__ == "__main__":
+    test_async_rankings_follow_api_url_and_controller()
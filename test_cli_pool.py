@@ -0,0 +1,89 @@
+import base64
+import csv
+import gzip
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# The CLI with a config file that has no api_credentials: with
+# DATAFORSEO_ACCOUNTS set, the lookups go through the credential pool to a
+# local stand-in for DataForSEO; without a pool the config is refused.
+
+TARGET_URL = "example.com"
+ACCOUNT = {"login": "pool-account", "password": "pool-secret"}
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+class StandIn(BaseHTTPRequestHandler):
+    logins = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        tasks = json.loads(body)
+        task = next(iter(tasks.values() if isinstance(tasks, dict) else tasks))
+        StandIn.logins.append(self.headers.get("Authorization"))
+        items = [{"type": "organic", "rank_group": 2, "rank_absolute": 2,
+                  "url": f"https://{TARGET_URL}/{task['keyword'].replace(' ', '-')}", "domain": TARGET_URL}]
+        response = json.dumps({"status_code": 20000, "tasks": [
+            {"status_code": 20000, "cost": 0.002, "result": [{"items": items}]}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+def run_cli(config_path, env):
+    return subprocess.run([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "rank_checker.py"),
+                           "--config", config_path], env=env, capture_output=True, text=True, timeout=120)
+
+def test_cli_config_without_credentials_uses_pool():
+    data_dir = tempfile.mkdtemp()
+    csv_path = os.path.join(data_dir, "keywords.csv")
+    with open(csv_path, "w") as file:
+        file.write("Keyword\nrank tracker\nseo tools\n")
+    config_path = os.path.join(data_dir, "config.json")
+    with open(config_path, "w") as file:
+        json.dump({"csv_file": csv_path, "target_url": TARGET_URL, "location_code": 2840}, file)
+
+    port = free_port()
+    server = ThreadingHTTPServer(("127.0.0.1", port), StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    env = dict(os.environ, DATAFORSEO_API_URL=f"http://127.0.0.1:{port}",
+               RANK_HISTORY_DB=os.path.join(data_dir, "rank_history.db"),
+               RANK_JOBS_DB=os.path.join(data_dir, "jobs.db"))
+    env.pop("DATAFORSEO_ACCOUNTS", None)
+    env.pop("DATAFORSEO_ACCOUNTS_FILE", None)
+    try:
+        # Without a pool the config is refused before anything is fetched
+        refused = run_cli(config_path, env)
+        assert refused.returncode != 0
+        assert "API credentials are required" in refused.stdout
+        assert not StandIn.logins
+
+        env["DATAFORSEO_ACCOUNTS"] = json.dumps([ACCOUNT])
+        result = run_cli(config_path, env)
+        assert result.returncode == 0, result.stdout + result.stderr
+    finally:
+        server.shutdown()
+
+    pool_auth = "Basic " + base64.b64encode(f"{ACCOUNT['login']}:{ACCOUNT['password']}".encode()).decode()
+    assert StandIn.logins == [pool_auth, pool_auth]
+    with open(csv_path) as file:
+        rows = list(csv.DictReader(file))
+    assert [row["Ranking"] for row in rows] == ["1", "1"]
+
+if __name__ == "__main__":
+    test_cli_config_without_credentials_uses_pool()
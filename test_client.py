@@ -0,0 +1,98 @@
+import json
+import socket
+import socketserver
+import threading
+import time
+
+# Reused keep-alive connections: when the server drops one after receiving a
+# request, only a GET may be sent again, since a repeated POST (task_post or
+# a live SERP call) could be charged twice. An idle connection the server
+# has already closed is noticed before anything is sent on it.
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+class Handler(socketserver.StreamRequestHandler):
+    """Answers requests with keep-alive; the mode decides what happens to a connection after its first answer."""
+    mode = "keep"
+    received = []
+
+    def handle(self):
+        served = 0
+        while True:
+            request_line = self.rfile.readline()
+            if not request_line:
+                return
+            length = 0
+            for line in iter(self.rfile.readline, b"\r\n"):
+                name, _, value = line.decode("latin-1").partition(":")
+                if name.lower() == "content-length":
+                    length = int(value)
+            self.rfile.read(length)
+            Handler.received.append(request_line.split()[0].decode())
+            if served and Handler.mode == "drop":
+                # Dies after receiving the request, without answering
+                return
+            body = json.dumps({"status_code": 20000, "served": served}).encode()
+            self.wfile.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                             b"Content-Length: %d\r\n\r\n%s" % (len(body), body))
+            self.wfile.flush()
+            served += 1
+            if Handler.mode == "close":
+                return
+
+class Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+def start_server():
+    port = free_port()
+    server = Server(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{port}"
+
+def make_client(api_url):
+    from client import RestClient
+    return RestClient("login", "password", api_url=api_url, pool_size=2)
+
+def test_dropped_post_is_not_resent():
+    server, api_url = start_server()
+    Handler.mode = "drop"
+    try:
+        client = make_client(api_url)
+        Handler.received = []
+        client.post("/v3/serp/google/organic/task_post", {"0": {"keyword": "rank tracker"}})
+        try:
+            client.post("/v3/serp/google/organic/task_post", {"0": {"keyword": "seo tools"}})
+        except Exception:
+            pass
+        else:
+            raise AssertionError("POST on a dropped connection succeeded")
+        assert Handler.received == ["POST", "POST"]
+
+        # A GET is safe to repeat, so it is sent again on a new connection
+        Handler.received = []
+        client.get("/v3/serp/google/organic/task_get/advanced/1")
+        assert client.get("/v3/serp/google/organic/task_get/advanced/2")["served"] == 0
+        assert Handler.received == ["GET", "GET", "GET"]
+    finally:
+        server.shutdown()
+
+def test_closed_idle_connection_is_not_used():
+    server, api_url = start_server()
+    Handler.mode = "close"
+    try:
+        client = make_client(api_url)
+        Handler.received = []
+        client.post("/v3/serp/google/organic/task_post", {"0": {"keyword": "rank tracker"}})
+        time.sleep(0.1)
+        assert client.post("/v3/serp/google/organic/task_post", {"0": {"keyword": "seo tools"}})["served"] == 0
+        assert Handler.received == ["POST", "POST"]
+    finally:
+        server.shutdown()
+
+if __name__ == "__main__":
+    test_dropped_post_is_not_resent()
+    test_closed_idle_connection_is_not_used()
@@ -0,0 +1,66 @@
+import json
+import os
+import tempfile
+
+# Export format selection with and without pyarrow: an explicit Parquet or
+# Arrow file is refused without pyarrow instead of being swapped for NDJSON,
+# while a path without a known extension gets the default format, which
+# falls back to NDJSON.
+
+ROW = ("example.com", "rank tracker", 2840, "", "desktop", "2026-01-01", {"position": 3, "rank_group": 3,
+       "rank_absolute": 4}, 1767225600)
+
+def write_export(path):
+    import exporters
+    writer, path = exporters.open_export(path)
+    writer.write_rows([exporters.result_row(*ROW)])
+    writer.close()
+    return writer.format, path
+
+def without_pyarrow(fn):
+    import exporters
+    get_pyarrow = exporters.get_pyarrow
+    exporters.get_pyarrow = lambda: None
+    try:
+        return fn()
+    finally:
+        exporters.get_pyarrow = get_pyarrow
+
+def test_export_without_pyarrow():
+    directory = tempfile.mkdtemp()
+
+    def check():
+        for name in ("results.parquet", "results.arrow"):
+            try:
+                write_export(os.path.join(directory, name))
+            except ValueError as e:
+                assert "pyarrow" in str(e)
+            else:
+                raise AssertionError(f"{name} was written without pyarrow")
+        assert not os.listdir(directory)
+
+        export_format, path = write_export(os.path.join(directory, "results.out"))
+        assert export_format == "ndjson"
+        assert path == os.path.join(directory, "results.ndjson")
+        with open(path) as file:
+            assert json.loads(file.readline())["keyword"] == "rank tracker"
+
+        export_format, path = write_export(os.path.join(directory, "explicit.ndjson"))
+        assert (export_format, os.path.basename(path)) == ("ndjson", "explicit.ndjson")
+
+    without_pyarrow(check)
+
+def test_export_with_pyarrow():
+    import exporters
+    if exporters.get_pyarrow() is None:
+        return
+    directory = tempfile.mkdtemp()
+    assert write_export(os.path.join(directory, "results.parquet")) == \
+        ("parquet", os.path.join(directory, "results.parquet"))
+    assert write_export(os.path.join(directory, "results.out")) == ("parquet", os.path.join(directory, "results.out"))
+    pa, pq = exporters.get_pyarrow()
+    assert pq.read_table(os.path.join(directory, "results.parquet")).column("keyword").to_pylist() == ["rank tracker"]
+
+if __name__ == "__main__":
+    test_export_without_pyarrow()
+    test_export_with_pyarrow()
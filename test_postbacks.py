@@ -0,0 +1,230 @@
+import gzip
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+# End-to-end check of the postback receiver: the app posts tasks to a local
+# stand-in for DataForSEO, which answers like task_post and then sends each
+# finished task, gzip-compressed, to the task's postback_url. In pingback
+# mode it calls the pingback_url instead, and the app must fetch the task
+# with the account that posted it.
+
+TARGET_URL = "example.com"
+TOKEN = "callback-secret"
+
+# Keyword -> position of TARGET_URL in the stand-in's SERP (None = not ranked)
+POSITIONS = {
+    "rank tracker": 3,
+    "seo tools": None,
+    "keyword ranking api": 1
+}
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def read_json(handler):
+    body = handler.rfile.read(int(handler.headers.get("Content-Length", 0)))
+    if handler.headers.get("Content-Encoding") == "gzip":
+        body = gzip.decompress(body)
+    return json.loads(body)
+
+def serp_task(task_id, data):
+    """A finished task as DataForSEO returns it from task_get/advanced and in postbacks."""
+    position = POSITIONS.get(data["keyword"])
+    domains = ["competitor-%d.com" % index for index in range(1, 11)]
+    if position:
+        domains[position - 1] = TARGET_URL
+    items = [{"type": "organic", "rank_group": index, "rank_absolute": index + 1,
+              "domain": domain, "url": "https://%s/page" % domain}
+             for index, domain in enumerate(domains, 1)]
+    return {"id": task_id, "status_code": 20000, "status_message": "Ok.", "cost": 0.0006, "data": data,
+            "result": [{"keyword": data["keyword"], "items_count": len(items), "items": items}]}
+
+class StandInDataForSEO(BaseHTTPRequestHandler):
+    """Accepts task_post like DataForSEO and delivers every task to its postback_url (or pingback_url) shortly after."""
+    delivered = []
+    # task_id -> (Authorization of the task_post, task data), for task_get
+    posted = {}
+    fetched = []
+
+    def do_POST(self):
+        tasks = []
+        for data in read_json(self).values():
+            task_id = str(uuid.uuid4())
+            tasks.append({"id": task_id, "status_code": 20100, "status_message": "Task Created.",
+                          "cost": 0.0006, "data": data, "result": None})
+            StandInDataForSEO.posted[task_id] = (self.headers.get("Authorization"), data)
+            if "pingback_url" in data:
+                url = data["pingback_url"].replace("$id", task_id).replace("$tag", data.get("tag", ""))
+                timer = threading.Timer(0.2, self.send_pingback, args=(url,))
+            else:
+                url = data["postback_url"].replace("$id", task_id).replace("$tag", data.get("tag", ""))
+                timer = threading.Timer(0.2, self.send_postback, args=(url, serp_task(task_id, data)))
+            timer.start()
+        self.respond({"status_code": 20000, "status_message": "Ok.", "cost": 0.0006 * len(tasks), "tasks": tasks})
+
+    def do_GET(self):
+        task_id = self.path.rsplit("/", 1)[-1]
+        authorization, data = StandInDataForSEO.posted[task_id]
+        StandInDataForSEO.fetched.append((task_id, self.headers.get("Authorization")))
+        if self.headers.get("Authorization") != authorization:
+            task = {"id": task_id, "status_code": 40400, "status_message": "Task not found.", "data": data}
+        else:
+            task = serp_task(task_id, data)
+        self.respond({"status_code": 20000, "status_message": "Ok.", "tasks": [task]})
+
+    def send_pingback(self, url):
+        with urlopen(url) as response:
+            StandInDataForSEO.delivered.append((url, json.loads(response.read())))
+
+    def send_postback(self, url, task):
+        payload = gzip.compress(json.dumps({"status_code": 20000, "tasks": [task]}).encode("utf-8"))
+        request = Request(url, data=payload, headers={"Content-Type": "application/json", "Content-Encoding": "gzip"})
+        with urlopen(request) as response:
+            StandInDataForSEO.delivered.append((url, json.loads(response.read())))
+
+    def respond(self, payload):
+        body = gzip.compress(json.dumps(payload).encode("utf-8"))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def call(method, url, payload=None):
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    request = Request(url, data=data, method=method, headers={"Content-Type": "application/json"})
+    with urlopen(request) as response:
+        return json.loads(response.read())
+
+def start_servers():
+    """Start the stand-in and the app on free ports. Returns (api_server, app_server, base_url)."""
+    data_dir = tempfile.mkdtemp()
+    api_port = free_port()
+    app_port = free_port()
+    os.environ["RANK_JOBS_DB"] = os.path.join(data_dir, "jobs.db")
+    os.environ["RANK_HISTORY_DB"] = os.path.join(data_dir, "rank_history.db")
+    os.environ["DATAFORSEO_API_URL"] = "http://127.0.0.1:%d" % api_port
+
+    from werkzeug.serving import make_server
+    import app
+    import postbacks
+
+    # Callbacks are refused unless they carry the token
+    app.POSTBACK_TOKEN = postbacks.POSTBACK_TOKEN = TOKEN
+
+    api_server = ThreadingHTTPServer(("127.0.0.1", api_port), StandInDataForSEO)
+    app_server = make_server("127.0.0.1", app_port, app.app, threaded=True)
+    for server in (api_server, app_server):
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    return api_server, app_server, "http://127.0.0.1:%d" % app_port
+
+def post_and_wait(base_url, credentials, keywords=None):
+    """Post a /tasks job and wait for it to complete. Returns ({keyword: ranking}, created)."""
+    created = call("POST", base_url + "/tasks", {
+        "target_url": TARGET_URL,
+        "api_credentials": credentials,
+        "location_code": 2840,
+        "device": "desktop",
+        "profile": "top10",
+        "keywords": keywords or list(POSITIONS)
+    })
+    print("Posted: %s" % created)
+    assert created["posted"] == len(keywords or POSITIONS)
+
+    # Results arrive by callback only; nothing polls the stand-in
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        job = call("GET", base_url + "/jobs/" + created["job_id"])
+        if job["status"] == "completed":
+            break
+        time.sleep(0.1)
+    print("Job: %s, %d/%d keywords" % (job["status"], job["processed_keywords"], job["total_keywords"]))
+    assert job["status"] == "completed"
+
+    results = {result["keyword"]: result["ranking"]
+               for result in call("GET", base_url + created["results_url"])["results"]}
+    print("Results: %s" % results)
+    return results, created
+
+def test_postbacks():
+    api_server, app_server, base_url = start_servers()
+    try:
+        results, created = post_and_wait(base_url, {"login": "login", "password": "password"})
+        for keyword, position in POSITIONS.items():
+            assert results[keyword] == (position or "Not in top results")
+
+        # A repeated postback for a finished task is accepted and ignored
+        url, response = StandInDataForSEO.delivered[0]
+        assert response["completed"] == 1
+        repeated = Request(url, data=json.dumps({"tasks": [serp_task("repeat", {
+            "keyword": "rank tracker", "tag": url.split("tag=")[1], "language_code": "en"})]}).encode("utf-8"))
+        with urlopen(repeated) as response:
+            assert json.loads(response.read())["completed"] == 0
+
+        # Without the token, or with a wrong one, a callback is refused
+        for query in ("", "&token=wrong"):
+            try:
+                urlopen(Request(url.split("&token=")[0] + query, data=b"{}"))
+            except HTTPError as e:
+                assert e.code == 403
+            else:
+                raise AssertionError("Postback without the token was accepted")
+        print("Postbacks received: %d" % len(StandInDataForSEO.delivered))
+    finally:
+        api_server.shutdown()
+        app_server.shutdown()
+
+def test_pingbacks_use_posting_account():
+    import base64
+    import credentials
+    import postbacks
+
+    api_server, app_server, base_url = start_servers()
+    pool = credentials.CredentialPool([credentials.PoolAccount("pool-login", "pool-password")])
+    saved = (postbacks.CALLBACK_MODE, credentials.credential_pool, credentials.credential_pool_loaded,
+             os.environ.pop("DATAFORSEO_LOGIN", None), os.environ.pop("DATAFORSEO_PASSWORD", None))
+    postbacks.CALLBACK_MODE = "pingback"
+    # The first test's SERPs are cached; expire them so every keyword is posted
+    ttl, postbacks.serp_cache.ttl = postbacks.serp_cache.ttl, 0
+    credentials.credential_pool, credentials.credential_pool_loaded = pool, True
+    StandInDataForSEO.fetched = []
+    try:
+        # Per-request credentials, then a pool account: each task is fetched with the account that posted it
+        for login, password in (("request-login", "request-password"), ("pool-login", "pool-password")):
+            results, created = post_and_wait(base_url, {"login": login, "password": password})
+            for keyword, position in POSITIONS.items():
+                assert results[keyword] == (position or "Not in top results")
+            authorization = "Basic " + base64.b64encode(("%s:%s" % (login, password)).encode()).decode()
+            fetched = [auth for task_id, auth in StandInDataForSEO.fetched
+                       if StandInDataForSEO.posted[task_id][1]["tag"] in
+                       {item_id for item_id, in postbacks.get_postback_store().get_connection().execute(
+                           "SELECT id FROM postback_items WHERE job_id = ?", (created["job_id"],))}]
+            assert fetched == [authorization] * len(POSITIONS)
+            # Per-request credentials are not kept once the job has finished
+            assert postbacks.get_postback_store().get_credentials(created["job_id"]) is None
+    finally:
+        postbacks.CALLBACK_MODE, credentials.credential_pool, credentials.credential_pool_loaded = saved[:3]
+        postbacks.serp_cache.ttl = ttl
+        for name, value in zip(("DATAFORSEO_LOGIN", "DATAFORSEO_PASSWORD"), saved[3:]):
+            if value is not None:
+                os.environ[name] = value
+        api_server.shutdown()
+        app_server.shutdown()
+
+if __name__ == "__main__":
+    test_postbacks()
+    test_pingbacks_use_posting_account()
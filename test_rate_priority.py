@@ -0,0 +1,77 @@
+import threading
+import time
+
+# Interactive lookups must not queue behind bulk work for the shared rate
+# limit: with bulk jobs saturating the limiter through the fetch engine, an
+# interactive lookup should wait about one token interval, not for every
+# bulk caller ahead of it.
+
+RATE = 20
+BULK_WORKERS = 8
+TARGET_URL = "example.com"
+
+class InstantClient:
+    """Answers every live SERP call at once with TARGET_URL in first place."""
+    def post(self, path, data):
+        items = [{"type": "organic", "rank_group": 1, "rank_absolute": 1,
+                  "url": f"https://{TARGET_URL}/", "domain": TARGET_URL}]
+        return {"status_code": 20000, "tasks": [{"status_code": 20000, "cost": 0.0, "result": [{"items": items}]}]}
+
+def test_rate_limiter_priority():
+    from resilience import RateLimiter
+
+    limiter = RateLimiter(RATE, burst=1)
+    stop = threading.Event()
+
+    def bulk():
+        while not stop.is_set():
+            limiter.acquire(priority=False)
+
+    threads = [threading.Thread(target=bulk, daemon=True) for _ in range(BULK_WORKERS)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.3)
+    try:
+        waits = []
+        for _ in range(5):
+            started = time.monotonic()
+            limiter.acquire()
+            waits.append(time.monotonic() - started)
+    finally:
+        stop.set()
+    print("Interactive waits: %s" % ["%.3f" % wait for wait in waits])
+    # FIFO pacing would put each call behind all BULK_WORKERS waiters (0.4 s)
+    assert max(waits) < 2.5 / RATE
+
+def test_interactive_lane_overtakes_saturated_bulk():
+    import rank_checker
+    from fetch_engine import FetchEngine, LANE_BULK, LANE_INTERACTIVE
+    from resilience import RateLimiter
+
+    engine = FetchEngine(workers=BULK_WORKERS + 2, reserved_interactive=2)
+    client = InstantClient()
+    run = time.time_ns()
+    limiter = rank_checker.rate_limiter
+    rank_checker.rate_limiter = RateLimiter(RATE, burst=1)
+    try:
+        bulk = [engine.submit(rank_checker.get_ranking, client, f"bulk {run} {index}", TARGET_URL, 2840,
+                              lane=LANE_BULK, job_key="bulk") for index in range(200)]
+        time.sleep(0.5)
+        waits = []
+        for index in range(5):
+            started = time.monotonic()
+            ranking = engine.submit(rank_checker.get_ranking, client, f"interactive {run} {index}", TARGET_URL, 2840,
+                                    lane=LANE_INTERACTIVE, job_key="request").result(timeout=5)
+            waits.append(time.monotonic() - started)
+            assert ranking["rank_group"] == 1
+        assert not all(future.done() for future in bulk), "bulk work was not saturating the limiter"
+    finally:
+        for future in bulk:
+            future.cancel()
+        rank_checker.rate_limiter = limiter
+    print("Interactive lookups: %s" % ["%.3f" % wait for wait in waits])
+    assert max(waits) < 2.5 / RATE
+
+if __name__ == "__main__":
+    test_rate_limiter_priority()
+    test_interactive_lane_overtakes_saturated_bulk()
@@ -0,0 +1,56 @@
+import time
+
+# The SERP cache must not outlive SERP_CACHE_TTL_SECONDS: a stand-in client
+# moves the target from position 3 to 7, and once the cached SERP is older
+# than the TTL the next lookup has to fetch again and see the new position.
+
+TARGET_URL = "example.com"
+
+class MovingClient:
+    """Answers live SERP calls with TARGET_URL at self.position."""
+    def __init__(self, position):
+        self.position = position
+        self.calls = 0
+
+    def post(self, path, data):
+        self.calls += 1
+        items = [{"type": "organic", "rank_group": rank, "rank_absolute": rank,
+                  "url": f"https://site{rank}.test/", "domain": f"site{rank}.test"} for rank in range(1, 11)]
+        items[self.position - 1].update(url=f"https://{TARGET_URL}/", domain=TARGET_URL)
+        return {"status_code": 20000, "tasks": [{"status_code": 20000, "cost": 0.002, "result": [{"items": items}]}]}
+
+def test_serp_cache_expiry():
+    from serp_cache import SerpCache
+
+    cache = SerpCache(max_entries=10, ttl=60)
+    cache.put("key", "serp", now=1000.0)
+    assert cache.get("key", now=1059.0) == "serp"
+    assert cache.contains("key", now=1059.0)
+    assert not cache.contains("key", now=1060.0)
+    assert cache.get("key", now=1060.0) is None
+    assert cache.get_stats()["expired"] == 1
+    assert cache.get_stats()["entries"] == 0
+
+def test_get_ranking_refetches_expired_serp():
+    import rank_checker
+    from serp_cache import serp_cache
+
+    client = MovingClient(3)
+    keyword = "serp cache expiry %d" % time.time_ns()
+    ttl = serp_cache.ttl
+    serp_cache.ttl = 0.2
+    try:
+        assert rank_checker.get_ranking(client, keyword, TARGET_URL, 2840)["rank_group"] == 3
+        client.position = 7
+        # Within the TTL the cached SERP answers without a call
+        assert rank_checker.get_ranking(client, keyword, TARGET_URL, 2840)["rank_group"] == 3
+        assert client.calls == 1
+        time.sleep(0.3)
+        assert rank_checker.get_ranking(client, keyword, TARGET_URL, 2840)["rank_group"] == 7
+        assert client.calls == 2
+    finally:
+        serp_cache.ttl = ttl
+
+if __name__ == "__main__":
+    test_serp_cache_expiry()
+    test_get_ranking_refetches_expired_serp()
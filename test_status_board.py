@@ -0,0 +1,95 @@
+import os
+import tempfile
+import threading
+import time
+
+# Stress check of the dashboard status: one job thread publishes progress and
+# results as fast as it can while several request threads poll /status.
+# Every response must be one consistent snapshot: counters that belong
+# together, results that match them, and versions that never go backwards.
+
+KEYWORDS = 20000
+READERS = 6
+
+def test_status_board():
+    data_dir = tempfile.mkdtemp()
+    os.environ.setdefault("RANK_JOBS_DB", os.path.join(data_dir, "jobs.db"))
+    os.environ.setdefault("RANK_HISTORY_DB", os.path.join(data_dir, "rank_history.db"))
+
+    import app
+    from jobs import JobStore
+    from results import ResultBuffer, ResultRecord
+
+    store = JobStore(os.path.join(data_dir, "stress_jobs.db"))
+    generation = app.status_board.reset(app.new_status(session_id="stress"), unless_processing=True)
+    assert generation is not None
+    # Small buffer so results are spilled while readers are polling
+    results = ResultBuffer("stress", limit=200, store=store)
+    assert app.status_board.claim(generation, job_id="stress", results=results)
+
+    # A second upload cannot take over while the job runs
+    assert app.status_board.reset(app.new_status(), unless_processing=True) is None
+
+    done = threading.Event()
+    failures = []
+    polls = [0] * READERS
+
+    def writer():
+        app.status_board.update(generation, total_keywords=KEYWORDS)
+        for index in range(KEYWORDS):
+            app.status_board.update(generation, current_keyword="kw%d" % index, processed_keywords=index)
+            results.append(ResultRecord.from_ranking("kw%d" % index, {"position": index % 100 + 1}, "desktop"))
+            app.status_board.update(generation, processed_keywords=index + 1, results_total=len(results))
+        app.status_board.update(generation, is_processing=False, current_keyword="Completed")
+        done.set()
+
+    def reader(slot):
+        client = app.app.test_client()
+        last_version = -1
+        while not done.is_set() or polls[slot] == 0:
+            status = client.get("/status?session_id=stress").get_json()
+            polls[slot] += 1
+            try:
+                assert status["version"] >= last_version, "version went backwards"
+                last_version = status["version"]
+                assert status["processed_keywords"] <= status["total_keywords"] or status["total_keywords"] == 0
+                assert status["processed_keywords"] >= status["results_total"]
+                assert status["processed_keywords"] - status["results_total"] <= 1, "counters torn"
+                returned = status["results"]
+                if returned:
+                    # Results end exactly at the published total and have no gaps
+                    assert returned[-1]["keyword"] == "kw%d" % (status["results_total"] - 1)
+                    first = int(returned[0]["keyword"][2:])
+                    assert [result["keyword"] for result in returned] == \
+                        ["kw%d" % index for index in range(first, first + len(returned))]
+                assert len(returned) <= 200 + 1
+            except AssertionError as e:
+                failures.append("%s in %s" % (e, {key: status[key] for key in
+                                ("version", "processed_keywords", "results_total", "results_spilled")}))
+                return
+
+    threads = [threading.Thread(target=reader, args=(slot,)) for slot in range(READERS)]
+    for thread in threads:
+        thread.start()
+    started = time.time()
+    writer()
+    for thread in threads:
+        thread.join()
+
+    print("%d updates, %d polls in %.1fs" % (app.status_board.snapshot()["version"], sum(polls), time.time() - started))
+    assert not failures, failures[0]
+
+    # A stale job thread cannot overwrite the status of the next upload
+    next_generation = app.status_board.reset(app.new_status(session_id="next"), unless_processing=True)
+    assert next_generation == generation + 1
+    assert not app.status_board.update(generation, error="late write from the old job")
+    assert app.status_board.snapshot()["error"] is None
+
+    # Every result is still readable in order, partly from the store
+    results.flush()
+    assert [result["keyword"] for result in results.page(KEYWORDS - 250, 250)] == \
+        ["kw%d" % index for index in range(KEYWORDS - 250, KEYWORDS)]
+    assert store.count_results("stress") == KEYWORDS
+
+if __name__ == "__main__":
+    test_status_board()
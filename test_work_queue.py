@@ -0,0 +1,61 @@
+import os
+import tempfile
+
+# Paging through a distributed job's results: results_page has to return the
+# same slices as the full result list while reading only the shards a page
+# overlaps, on the SQLite and the Redis (MemoryRedis) backends alike.
+
+SHARD_SIZES = [3, 1, 4, 2]
+
+def fill_queue(queue, job_id):
+    """Queue a job with SHARD_SIZES shards and complete all but the third. Returns the expected results."""
+    keywords = iter(range(sum(SHARD_SIZES)))
+    shards = [[f"keyword {next(keywords)}" for _ in range(size)] for size in SHARD_SIZES]
+    queue.enqueue_job(job_id, {'target_url': 'example.com'}, shards)
+    leased = [queue.lease('worker', 60) for _ in shards]
+    expected = []
+    for shard in sorted(leased, key=lambda shard: shard['index']):
+        if shard['index'] == 2:
+            continue
+        result = [(keyword, {'position': position}) for position, keyword in enumerate(shard['items'], 1)]
+        assert queue.complete(shard, result)
+        expected.extend([keyword, ranking_info] for keyword, ranking_info in result)
+    return expected
+
+def check_paging(queue):
+    from work_queue import results_page
+
+    expected = fill_queue(queue, 'paged-job')
+    assert queue.completed_shards('paged-job') == [(0, 3), (1, 1), (3, 2)]
+    assert [list(pair) for pair in queue.results('paged-job')] == expected
+
+    read = []
+    shard_results = queue.shard_results
+    queue.shard_results = lambda job_id, indexes: read.append(list(indexes)) or shard_results(job_id, indexes)
+    try:
+        for offset in range(len(expected) + 2):
+            for limit in (1, 2, 3, 10):
+                page, total = results_page(queue, 'paged-job', offset, limit)
+                assert total == len(expected)
+                assert [list(pair) for pair in page] == expected[offset:offset + limit]
+        # A page inside the first shard does not read the others
+        read.clear()
+        results_page(queue, 'paged-job', 1, 2)
+        assert read == [[0]]
+        read.clear()
+        results_page(queue, 'paged-job', 3, 2)
+        assert read == [[1, 3]]
+    finally:
+        queue.shard_results = shard_results
+
+def test_results_page_sqlite():
+    from work_queue import SqliteWorkQueue
+    check_paging(SqliteWorkQueue(os.path.join(tempfile.mkdtemp(), 'queue.db')))
+
+def test_results_page_redis():
+    from work_queue import RedisWorkQueue, MemoryRedis
+    check_paging(RedisWorkQueue(MemoryRedis()))
+
+if __name__ == "__main__":
+    test_results_page_sqlite()
+    test_results_page_redis()
@@ -0,0 +1,174 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from werkzeug.utils import secure_filename
+from jobs import DEFAULT_JOBS_DB
+
+# The upload index shares the jobs database so files and jobs stay together
+DEFAULT_UPLOADS_DB = os.environ.get('RANK_UPLOADS_DB', DEFAULT_JOBS_DB)
+UPLOADS_DIR = 'uploads'
+
+# How long uploaded and processed files are kept
+RETENTION_SECONDS = int(float(os.environ.get('UPLOAD_RETENTION_HOURS', '24')) * 3600)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    id TEXT PRIMARY KEY,
+    job_id TEXT,
+    original_filename TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL DEFAULT 0,
+    created_at INTEGER NOT NULL,
+    expires_at INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_uploads_expires ON uploads (expires_at);
+CREATE INDEX IF NOT EXISTS idx_uploads_job ON uploads (job_id);
+"""
+
+class UploadStore:
+    """Index of stored upload files with their job, original name, size and expiry.
+
+    Downloads are resolved by ID through the index, and retention cleanup
+    reads only the expired rows from the expires_at index instead of
+    listing and stat-ing the whole uploads directory.
+    """
+    def __init__(self, db_path=DEFAULT_UPLOADS_DB, uploads_dir=UPLOADS_DIR, retention=RETENTION_SECONDS):
+        self.db_path = db_path
+        self.uploads_dir = uploads_dir
+        self.retention = retention
+        self.local = threading.local()
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.get_connection().executescript(SCHEMA)
+
+    def get_connection(self):
+        """Return this thread's connection, opening it on first use."""
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            self.local.connection = connection
+        return connection
+
+    def store_file(self, file, original_filename, job_id=None):
+        """Save an uploaded file (anything with a save(path) method) and index it. Returns the record."""
+        upload_id = uuid.uuid4().hex
+        original_filename = secure_filename(original_filename) or 'upload.csv'
+        os.makedirs(self.uploads_dir, exist_ok=True)
+        path = os.path.join(self.uploads_dir, f"{upload_id}_{original_filename}")
+        file.save(path)
+        return self.add(upload_id, path, original_filename, job_id)
+
+    def add(self, upload_id, path, original_filename, job_id=None, created_at=None):
+        """Index a file that is already on disk."""
+        created_at = int(created_at or time.time())
+        connection = self.get_connection()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO uploads (id, job_id, original_filename, path, size, created_at, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (upload_id, job_id, original_filename, path, os.path.getsize(path),
+                 created_at, created_at + self.retention))
+        return self.get_upload(upload_id)
+
+    def attach_job(self, upload_id, job_id):
+        connection = self.get_connection()
+        with connection:
+            connection.execute("UPDATE uploads SET job_id = ? WHERE id = ?", (job_id, upload_id))
+
+    def refresh_size(self, upload_id):
+        """Record the size of a file after it was rewritten with rankings."""
+        upload = self.get_upload(upload_id)
+        if upload and os.path.exists(upload['path']):
+            connection = self.get_connection()
+            with connection:
+                connection.execute("UPDATE uploads SET size = ? WHERE id = ?",
+                                   (os.path.getsize(upload['path']), upload_id))
+
+    def get_upload(self, upload_id):
+        row = self.get_connection().execute("SELECT * FROM uploads WHERE id = ?", (upload_id,)).fetchone()
+        return dict(row) if row else None
+
+    def list_uploads(self, job_id=None, limit=50):
+        query = "SELECT * FROM uploads"
+        params = []
+        if job_id:
+            query += " WHERE job_id = ?"
+            params.append(job_id)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit)
+        return [dict(row) for row in self.get_connection().execute(query, params)]
+
+    def delete_upload(self, upload_id):
+        upload = self.get_upload(upload_id)
+        if not upload:
+            return False
+        try:
+            os.remove(upload['path'])
+        except FileNotFoundError:
+            pass
+        connection = self.get_connection()
+        with connection:
+            connection.execute("DELETE FROM uploads WHERE id = ?", (upload_id,))
+        return True
+
+    def next_expiry(self):
+        """Return the earliest expires_at in the index, or None when it is empty."""
+        row = self.get_connection().execute("SELECT MIN(expires_at) FROM uploads").fetchone()
+        return row[0]
+
+    def expire_due(self, now=None, batch_size=500):
+        """Delete every file whose retention has passed. Returns the number removed."""
+        now = int(now or time.time())
+        removed = 0
+        while True:
+            rows = self.get_connection().execute(
+                "SELECT id, path FROM uploads WHERE expires_at <= ? ORDER BY expires_at LIMIT ?",
+                (now, batch_size)).fetchall()
+            if not rows:
+                return removed
+            for row in rows:
+                try:
+                    os.remove(row['path'])
+                    print(f"Cleaned up old file: {row['path']}")
+                except FileNotFoundError:
+                    pass
+            connection = self.get_connection()
+            with connection:
+                connection.executemany("DELETE FROM uploads WHERE id = ?", [(row['id'],) for row in rows])
+            removed += len(rows)
+
+    def adopt_untracked(self):
+        """Index files left in the uploads directory before the index existed.
+
+        The file name doubles as the ID, so download links handed out
+        earlier keep working, and retention counts from the file's mtime.
+        """
+        if not os.path.isdir(self.uploads_dir):
+            return 0
+        tracked = {row['path'] for row in self.get_connection().execute("SELECT path FROM uploads")}
+        adopted = 0
+        for filename in os.listdir(self.uploads_dir):
+            path = os.path.join(self.uploads_dir, filename)
+            if path in tracked or not os.path.isfile(path):
+                continue
+            self.add(filename, path, filename, created_at=os.path.getmtime(path))
+            adopted += 1
+        return adopted
+
+# Shared store, created on first use
+upload_store = None
+upload_store_lock = threading.Lock()
+
+def get_upload_store():
+    """Return the process-wide UploadStore."""
+    global upload_store
+    with upload_store_lock:
+        if upload_store is None:
+            upload_store = UploadStore()
+        return upload_store
@@ -0,0 +1,538 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from jobs import DEFAULT_JOBS_DB
+
+# Shard queue shared by distributed workers. The default backend is SQLite
+# (the jobs database, so a shared volume is enough); RANK_QUEUE_BACKEND=redis
+# uses a Redis server at RANK_QUEUE_REDIS_URL, and =memory an in-process
+# stand-in with the same commands.
+QUEUE_BACKEND = os.environ.get('RANK_QUEUE_BACKEND', 'sqlite')
+DEFAULT_QUEUE_DB = os.environ.get('RANK_QUEUE_DB', DEFAULT_JOBS_DB)
+REDIS_URL = os.environ.get('RANK_QUEUE_REDIS_URL', 'redis://localhost:6379/0')
+
+# Shard statuses
+SHARD_QUEUED = 'queued'
+SHARD_LEASED = 'leased'
+SHARD_DONE = 'done'
+SHARD_FAILED = 'failed'
+SHARD_STATUSES = (SHARD_QUEUED, SHARD_LEASED, SHARD_DONE, SHARD_FAILED)
+
+def empty_progress(shards=0):
+    progress = {status: 0 for status in SHARD_STATUSES}
+    progress.update({'shards': shards, 'keywords_done': 0, 'cost': 0.0, 'errors': []})
+    return progress
+
+def results_page(queue, job_id, offset, limit):
+    """Return (page, total): the (keyword, ranking_info) results offset..offset+limit of a job's completed
+    shards in shard order, and how many there are. Only the shards the page overlaps are read."""
+    start = 0
+    wanted = []
+    for index, size in queue.completed_shards(job_id):
+        if start < offset + limit and start + size > offset:
+            wanted.append((index, start))
+        start += size
+    results = queue.shard_results(job_id, [index for index, shard_start in wanted])
+    page = []
+    for index, shard_start in wanted:
+        page.extend(results[index][max(0, offset - shard_start):offset + limit - shard_start])
+    return page, start
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS queue_jobs (
+    job_id TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    shard_count INTEGER NOT NULL,
+    aggregated INTEGER NOT NULL DEFAULT 0,
+    created_at INTEGER NOT NULL,
+    finished_at INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS queue_shards (
+    job_id TEXT NOT NULL,
+    shard_index INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    result TEXT,
+    error TEXT,
+    cost REAL NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker_id TEXT,
+    lease TEXT,
+    lease_expires_at REAL,
+    updated_at REAL NOT NULL,
+    UNIQUE (job_id, shard_index)
+);
+
+CREATE INDEX IF NOT EXISTS idx_queue_shards_status ON queue_shards (status, lease_expires_at);
+"""
+
+class SqliteWorkQueue:
+    """Shard queue in SQLite, shared by every worker process that can open the file.
+
+    A lease is taken with a single UPDATE, which SQLite runs under its write
+    lock, so two workers can never hold the same shard. Leases expire after
+    the visibility timeout unless renewed by heartbeats, and an expired
+    shard is handed to the next worker that asks.
+    """
+    def __init__(self, db_path=DEFAULT_QUEUE_DB):
+        self.db_path = db_path
+        self.local = threading.local()
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.get_connection().executescript(SCHEMA)
+
+    def get_connection(self):
+        """Return this thread's connection, opening it on first use."""
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+        return connection
+
+    def enqueue_job(self, job_id, payload, shards):
+        """Queue a job's shards. payload is shared by all shards; each shard is a list of work items."""
+        now = time.time()
+        connection = self.get_connection()
+        with connection:
+            connection.execute(
+                "INSERT INTO queue_jobs (job_id, payload, shard_count, created_at) VALUES (?, ?, ?, ?)",
+                (job_id, json.dumps(payload), len(shards), int(now)))
+            connection.executemany(
+                "INSERT INTO queue_shards (job_id, shard_index, status, payload, size, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(job_id, index, SHARD_QUEUED, json.dumps(shard), len(shard), now)
+                 for index, shard in enumerate(shards)])
+
+    def get_job_payload(self, job_id):
+        row = self.get_connection().execute("SELECT payload FROM queue_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row['payload']) if row else None
+
+    def lease(self, worker_id, visibility_timeout):
+        """Lease the oldest queued or expired shard. Returns the shard or None when there is no work."""
+        now = time.time()
+        lease = uuid.uuid4().hex
+        connection = self.get_connection()
+        with connection:
+            cursor = connection.execute(
+                "UPDATE queue_shards SET status = ?, worker_id = ?, lease = ?, lease_expires_at = ?, "
+                "attempts = attempts + 1, updated_at = ? "
+                "WHERE rowid = (SELECT rowid FROM queue_shards "
+                "               WHERE status = ? OR (status = ? AND lease_expires_at < ?) "
+                "               ORDER BY rowid LIMIT 1)",
+                (SHARD_LEASED, worker_id, lease, now + visibility_timeout, now,
+                 SHARD_QUEUED, SHARD_LEASED, now))
+        if cursor.rowcount == 0:
+            return None
+        row = self.get_connection().execute(
+            "SELECT job_id, shard_index, payload, attempts, cost FROM queue_shards WHERE lease = ?", (lease,)).fetchone()
+        if row is None:
+            return None
+        return {'job_id': row['job_id'], 'index': row['shard_index'], 'lease': lease,
+                'attempts': row['attempts'], 'cost': row['cost'], 'items': json.loads(row['payload'])}
+
+    def heartbeat(self, shard, visibility_timeout):
+        """Extend a lease. Returns False when the lease has been lost to another worker."""
+        connection = self.get_connection()
+        with connection:
+            cursor = connection.execute(
+                "UPDATE queue_shards SET lease_expires_at = ?, updated_at = ? "
+                "WHERE job_id = ? AND shard_index = ? AND lease = ? AND status = ?",
+                (time.time() + visibility_timeout, time.time(), shard['job_id'], shard['index'],
+                 shard['lease'], SHARD_LEASED))
+        return cursor.rowcount == 1
+
+    def complete(self, shard, result, cost=0.0):
+        """Store a shard's result. Returns False (and keeps nothing) when the lease was lost."""
+        connection = self.get_connection()
+        with connection:
+            cursor = connection.execute(
+                "UPDATE queue_shards SET status = ?, result = ?, cost = cost + ?, lease_expires_at = NULL, updated_at = ? "
+                "WHERE job_id = ? AND shard_index = ? AND lease = ? AND status = ?",
+                (SHARD_DONE, json.dumps(result), cost, time.time(), shard['job_id'], shard['index'],
+                 shard['lease'], SHARD_LEASED))
+        return cursor.rowcount == 1
+
+    def fail(self, shard, error, max_attempts, cost=0.0):
+        """Give a shard back after an error. It is retried until max_attempts, then marked failed."""
+        status = SHARD_FAILED if shard['attempts'] >= max_attempts else SHARD_QUEUED
+        connection = self.get_connection()
+        with connection:
+            connection.execute(
+                "UPDATE queue_shards SET status = ?, error = ?, cost = cost + ?, lease = NULL, "
+                "lease_expires_at = NULL, updated_at = ? "
+                "WHERE job_id = ? AND shard_index = ? AND lease = ? AND status = ?",
+                (status, error, cost, time.time(), shard['job_id'], shard['index'], shard['lease'], SHARD_LEASED))
+        return status
+
+    def progress(self, job_id):
+        """Shard counts by status, keywords done, spend and shard errors of a job."""
+        row = self.get_connection().execute(
+            "SELECT shard_count FROM queue_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        progress = empty_progress(row['shard_count'])
+        cursor = self.get_connection().execute(
+            "SELECT status, COUNT(*) AS shards, SUM(size) AS size, SUM(cost) AS cost FROM queue_shards "
+            "WHERE job_id = ? GROUP BY status", (job_id,))
+        for row in cursor:
+            progress[row['status']] = row['shards']
+            progress['cost'] += row['cost'] or 0.0
+            if row['status'] in (SHARD_DONE, SHARD_FAILED):
+                progress['keywords_done'] += row['size']
+        progress['errors'] = [row['error'] for row in self.get_connection().execute(
+            "SELECT error FROM queue_shards WHERE job_id = ? AND status = ? ORDER BY shard_index",
+            (job_id, SHARD_FAILED))]
+        return progress
+
+    def results(self, job_id):
+        """Yield the results of a job's completed shards in shard order."""
+        cursor = self.get_connection().execute(
+            "SELECT result FROM queue_shards WHERE job_id = ? AND status = ? ORDER BY shard_index",
+            (job_id, SHARD_DONE))
+        for row in cursor.fetchall():
+            yield from json.loads(row['result'])
+
+    def completed_shards(self, job_id):
+        """(shard_index, size) of a job's completed shards in shard order, without reading their results."""
+        return [(row['shard_index'], row['size']) for row in self.get_connection().execute(
+            "SELECT shard_index, size FROM queue_shards WHERE job_id = ? AND status = ? ORDER BY shard_index",
+            (job_id, SHARD_DONE))]
+
+    def shard_results(self, job_id, indexes):
+        """{shard_index: results} for the given completed shards, in shard order."""
+        results = {}
+        indexes = sorted(indexes)
+        # Stay below SQLite's limit on bound parameters
+        for start in range(0, len(indexes), 500):
+            chunk = indexes[start:start + 500]
+            for row in self.get_connection().execute(
+                    f"SELECT shard_index, result FROM queue_shards WHERE job_id = ? AND status = ? "
+                    f"AND shard_index IN ({', '.join('?' * len(chunk))}) ORDER BY shard_index",
+                    (job_id, SHARD_DONE, *chunk)):
+                results[row['shard_index']] = json.loads(row['result'])
+        return results
+
+    def claim_aggregation(self, job_id):
+        """Return True exactly once, to the caller that should merge a finished job's results."""
+        connection = self.get_connection()
+        with connection:
+            cursor = connection.execute(
+                "UPDATE queue_jobs SET aggregated = 1 WHERE job_id = ? AND aggregated = 0 "
+                "AND NOT EXISTS (SELECT 1 FROM queue_shards WHERE job_id = ? AND status IN (?, ?))",
+                (job_id, job_id, SHARD_QUEUED, SHARD_LEASED))
+        return cursor.rowcount == 1
+
+    def finish_job(self, job_id, payload):
+        """Mark a job aggregated and replace its payload (dropping credentials)."""
+        connection = self.get_connection()
+        with connection:
+            connection.execute("UPDATE queue_jobs SET payload = ?, finished_at = ? WHERE job_id = ?",
+                               (json.dumps(payload), int(time.time()), job_id))
+
+    def purge(self, finished_before):
+        """Delete the shards and results of jobs finished before a timestamp. Returns the number of jobs."""
+        connection = self.get_connection()
+        job_ids = [row['job_id'] for row in connection.execute(
+            "SELECT job_id FROM queue_jobs WHERE finished_at < ?", (finished_before,))]
+        with connection:
+            for job_id in job_ids:
+                connection.execute("DELETE FROM queue_shards WHERE job_id = ?", (job_id,))
+                connection.execute("DELETE FROM queue_jobs WHERE job_id = ?", (job_id,))
+        return len(job_ids)
+
+    def get_stats(self):
+        stats = {status: 0 for status in SHARD_STATUSES}
+        for row in self.get_connection().execute("SELECT status, COUNT(*) AS shards FROM queue_shards GROUP BY status"):
+            stats[row['status']] = row['shards']
+        stats['backend'] = 'sqlite'
+        return stats
+
+class RedisWorkQueue:
+    """The same shard queue on a Redis server, for workers on several hosts.
+
+    Queued shards wait in a list and leased shards in a sorted set scored by
+    lease expiry. LPOP and ZREM each succeed for one caller only, so a
+    shard is leased by one worker at a time. Works with any client that has
+    redis-py's methods and returns strings (decode_responses=True), such
+    as MemoryRedis.
+    """
+    def __init__(self, client, prefix='rank:queue:'):
+        self.redis = client
+        self.prefix = prefix
+
+    def key(self, *parts):
+        return self.prefix + ':'.join(str(part) for part in parts)
+
+    def enqueue_job(self, job_id, payload, shards):
+        self.redis.hset(self.key('job', job_id), mapping={
+            'payload': json.dumps(payload), 'shard_count': len(shards), 'aggregated': 0,
+            'created_at': int(time.time())})
+        for index, shard in enumerate(shards):
+            self.redis.hset(self.key('shard', job_id, index), mapping={
+                'status': SHARD_QUEUED, 'payload': json.dumps(shard), 'size': len(shard),
+                'attempts': 0, 'cost': 0})
+            self.redis.rpush(self.key('queued'), f"{job_id}:{index}")
+
+    def get_job_payload(self, job_id):
+        payload = self.redis.hget(self.key('job', job_id), 'payload')
+        return json.loads(payload) if payload else None
+
+    def take(self):
+        """Pop a queued shard ID, or claim one whose lease expired."""
+        shard_id = self.redis.lpop(self.key('queued'))
+        if shard_id:
+            return shard_id
+        for shard_id in self.redis.zrangebyscore(self.key('leases'), '-inf', time.time(), start=0, num=10):
+            if self.redis.zrem(self.key('leases'), shard_id):
+                return shard_id
+        return None
+
+    def lease(self, worker_id, visibility_timeout):
+        shard_id = self.take()
+        if shard_id is None:
+            return None
+        job_id, index = shard_id.rsplit(':', 1)
+        lease = uuid.uuid4().hex
+        shard_key = self.key('shard', job_id, index)
+        self.redis.hset(shard_key, mapping={'status': SHARD_LEASED, 'lease': lease, 'worker_id': worker_id})
+        attempts = self.redis.hincrby(shard_key, 'attempts', 1)
+        self.redis.zadd(self.key('leases'), {shard_id: time.time() + visibility_timeout})
+        return {'job_id': job_id, 'index': int(index), 'lease': lease, 'attempts': int(attempts),
+                'cost': float(self.redis.hget(shard_key, 'cost') or 0),
+                'items': json.loads(self.redis.hget(shard_key, 'payload'))}
+
+    def owns(self, shard):
+        return self.redis.hget(self.key('shard', shard['job_id'], shard['index']), 'lease') == shard['lease']
+
+    def heartbeat(self, shard, visibility_timeout):
+        if not self.owns(shard):
+            return False
+        self.redis.zadd(self.key('leases'), {f"{shard['job_id']}:{shard['index']}": time.time() + visibility_timeout})
+        return True
+
+    def complete(self, shard, result, cost=0.0):
+        if not self.owns(shard):
+            return False
+        shard_key = self.key('shard', shard['job_id'], shard['index'])
+        self.redis.hset(shard_key, mapping={'status': SHARD_DONE, 'result': json.dumps(result), 'lease': ''})
+        self.redis.hincrbyfloat(shard_key, 'cost', cost)
+        self.redis.zrem(self.key('leases'), f"{shard['job_id']}:{shard['index']}")
+        return True
+
+    def fail(self, shard, error, max_attempts, cost=0.0):
+        if not self.owns(shard):
+            return SHARD_LEASED
+        shard_id = f"{shard['job_id']}:{shard['index']}"
+        shard_key = self.key('shard', shard['job_id'], shard['index'])
+        status = SHARD_FAILED if shard['attempts'] >= max_attempts else SHARD_QUEUED
+        self.redis.hset(shard_key, mapping={'status': status, 'error': error, 'lease': ''})
+        self.redis.hincrbyfloat(shard_key, 'cost', cost)
+        self.redis.zrem(self.key('leases'), shard_id)
+        if status == SHARD_QUEUED:
+            self.redis.rpush(self.key('queued'), shard_id)
+        return status
+
+    def shards(self, job_id):
+        shard_count = self.redis.hget(self.key('job', job_id), 'shard_count')
+        if shard_count is None:
+            return None
+        return [self.redis.hgetall(self.key('shard', job_id, index)) for index in range(int(shard_count))]
+
+    def progress(self, job_id):
+        shards = self.shards(job_id)
+        if shards is None:
+            return None
+        progress = empty_progress(len(shards))
+        for shard in shards:
+            progress[shard['status']] += 1
+            progress['cost'] += float(shard.get('cost') or 0)
+            if shard['status'] in (SHARD_DONE, SHARD_FAILED):
+                progress['keywords_done'] += int(shard['size'])
+            if shard['status'] == SHARD_FAILED:
+                progress['errors'].append(shard.get('error'))
+        return progress
+
+    def results(self, job_id):
+        for shard in self.shards(job_id) or []:
+            if shard['status'] == SHARD_DONE:
+                yield from json.loads(shard['result'])
+
+    def completed_shards(self, job_id):
+        shard_count = self.redis.hget(self.key('job', job_id), 'shard_count')
+        completed = []
+        for index in range(int(shard_count or 0)):
+            status, size = self.redis.hmget(self.key('shard', job_id, index), ['status', 'size'])
+            if status == SHARD_DONE:
+                completed.append((index, int(size)))
+        return completed
+
+    def shard_results(self, job_id, indexes):
+        results = {}
+        for index in sorted(indexes):
+            result = self.redis.hget(self.key('shard', job_id, index), 'result')
+            if result is not None:
+                results[index] = json.loads(result)
+        return results
+
+    def claim_aggregation(self, job_id):
+        progress = self.progress(job_id)
+        if progress is None or progress[SHARD_QUEUED] or progress[SHARD_LEASED]:
+            return False
+        return bool(self.redis.hsetnx(self.key('aggregated'), job_id, 1))
+
+    def finish_job(self, job_id, payload):
+        now = int(time.time())
+        self.redis.hset(self.key('job', job_id), mapping={'payload': json.dumps(payload), 'finished_at': now})
+        self.redis.zadd(self.key('finished'), {job_id: now})
+
+    def purge(self, finished_before):
+        job_ids = self.redis.zrangebyscore(self.key('finished'), '-inf', finished_before)
+        for job_id in job_ids:
+            shard_count = int(self.redis.hget(self.key('job', job_id), 'shard_count') or 0)
+            self.redis.delete(self.key('job', job_id),
+                              *[self.key('shard', job_id, index) for index in range(shard_count)])
+            self.redis.hdel(self.key('aggregated'), job_id)
+            self.redis.zrem(self.key('finished'), job_id)
+        return len(job_ids)
+
+    def get_stats(self):
+        return {
+            SHARD_QUEUED: self.redis.llen(self.key('queued')),
+            SHARD_LEASED: self.redis.zcard(self.key('leases')),
+            'backend': 'redis'
+        }
+
+class MemoryRedis:
+    """In-process stand-in for the Redis commands RedisWorkQueue uses.
+
+    Lets the Redis backend run without a server: in one process with
+    RANK_QUEUE_BACKEND=memory, or when trying the queue locally.
+    """
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.RLock()
+
+    def hset(self, name, key=None, value=None, mapping=None):
+        with self.lock:
+            fields = self.data.setdefault(name, {})
+            items = dict(mapping or {})
+            if key is not None:
+                items[key] = value
+            added = sum(1 for field in items if field not in fields)
+            fields.update({field: str(item) for field, item in items.items()})
+            return added
+
+    def hsetnx(self, name, key, value):
+        with self.lock:
+            fields = self.data.setdefault(name, {})
+            if key in fields:
+                return 0
+            fields[key] = str(value)
+            return 1
+
+    def hget(self, name, key):
+        with self.lock:
+            return self.data.get(name, {}).get(key)
+
+    def hmget(self, name, keys):
+        with self.lock:
+            fields = self.data.get(name, {})
+            return [fields.get(key) for key in keys]
+
+    def hgetall(self, name):
+        with self.lock:
+            return dict(self.data.get(name, {}))
+
+    def hdel(self, name, *keys):
+        with self.lock:
+            fields = self.data.get(name, {})
+            return sum(1 for key in keys if fields.pop(key, None) is not None)
+
+    def hincrby(self, name, key, amount=1):
+        with self.lock:
+            fields = self.data.setdefault(name, {})
+            fields[key] = str(int(fields.get(key, 0)) + amount)
+            return int(fields[key])
+
+    def hincrbyfloat(self, name, key, amount=1.0):
+        with self.lock:
+            fields = self.data.setdefault(name, {})
+            fields[key] = str(float(fields.get(key, 0)) + amount)
+            return float(fields[key])
+
+    def rpush(self, name, *values):
+        with self.lock:
+            items = self.data.setdefault(name, [])
+            items.extend(str(value) for value in values)
+            return len(items)
+
+    def lpop(self, name):
+        with self.lock:
+            items = self.data.get(name)
+            return items.pop(0) if items else None
+
+    def llen(self, name):
+        with self.lock:
+            return len(self.data.get(name, []))
+
+    def zadd(self, name, mapping):
+        with self.lock:
+            scores = self.data.setdefault(name, {})
+            added = sum(1 for member in mapping if member not in scores)
+            scores.update({member: float(score) for member, score in mapping.items()})
+            return added
+
+    def zrem(self, name, *members):
+        with self.lock:
+            scores = self.data.get(name, {})
+            return sum(1 for member in members if scores.pop(member, None) is not None)
+
+    def zrangebyscore(self, name, min, max, start=None, num=None):
+        low = float(min)
+        high = float(max)
+        with self.lock:
+            members = sorted((score, member) for member, score in self.data.get(name, {}).items()
+                             if low <= score <= high)
+        members = [member for score, member in members]
+        if start is not None and num is not None:
+            members = members[start:start + num]
+        return members
+
+    def zcard(self, name):
+        with self.lock:
+            return len(self.data.get(name, {}))
+
+    def delete(self, *names):
+        with self.lock:
+            return sum(1 for name in names if self.data.pop(name, None) is not None)
+
+def create_work_queue(backend=QUEUE_BACKEND):
+    if backend == 'sqlite':
+        return SqliteWorkQueue()
+    if backend == 'memory':
+        return RedisWorkQueue(MemoryRedis())
+    if backend == 'redis':
+        import redis
+        return RedisWorkQueue(redis.Redis.from_url(REDIS_URL, decode_responses=True))
+    raise ValueError(f"Unknown queue backend '{backend}'. Available: sqlite, redis, memory")
+
+# Shared queue, created on first use
+work_queue = None
+work_queue_lock = threading.Lock()
+
+def get_work_queue():
+    """Return the process-wide work queue for the configured backend."""
+    global work_queue
+    with work_queue_lock:
+        if work_queue is None:
+            work_queue = create_work_queue()
+        return work_queue
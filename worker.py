@@ -0,0 +1,281 @@
+import csv
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
+from credentials import make_client
+from jobs import get_job_store, STATUS_QUEUED
+from rank_history import get_rank_history
+from resilience import RetryBudget
+from costs import CostBudget, BUDGET_EXCEEDED
+from fetch_engine import get_fetch_engine, LANE_BULK
+from work_queue import get_work_queue, SHARD_DONE, SHARD_FAILED
+
+# Distributed processing of uploaded CSV files. The web app splits a job
+# into keyword shards on the work queue (RANK_DISTRIBUTED=1), and any number
+# of `python worker.py` processes, on this or other hosts, lease and run them.
+
+# Distinct keywords per shard
+SHARD_SIZE = int(os.environ.get('RANK_SHARD_SIZE', '50'))
+
+# A leased shard goes back to the queue if its worker stops heartbeating for this long
+VISIBILITY_TIMEOUT = int(os.environ.get('RANK_SHARD_VISIBILITY_SECONDS', '300'))
+
+# Leases of a shard before it is marked failed
+MAX_ATTEMPTS = int(os.environ.get('RANK_SHARD_MAX_ATTEMPTS', '3'))
+
+# How long an idle worker waits before asking for work again
+POLL_INTERVAL = float(os.environ.get('RANK_WORKER_POLL_SECONDS', '2'))
+
+def distributed_enabled():
+    return os.environ.get('RANK_DISTRIBUTED', '0') == '1'
+
+def read_keywords(csv_file, limit=None):
+    """Return the keyword column name and the keywords of the first limit rows of a CSV file."""
+    with open(csv_file, 'r') as file:
+        rows = list(csv.DictReader(file))
+    if limit and limit < len(rows):
+        rows = rows[:limit]
+    if not rows:
+        raise ValueError("CSV file is empty.")
+    if 'Keyword' in rows[0]:
+        keyword_column = 'Keyword'
+    elif 'Keywords' in rows[0]:
+        keyword_column = 'Keywords'
+    else:
+        raise ValueError("CSV must contain either a 'Keyword' or 'Keywords' column.")
+    return keyword_column, [row[keyword_column] for row in rows]
+
+def enqueue_csv_job(job_id, csv_file, target_url, api_login, api_password, location_code, limit=None,
+                    location_name='', device='desktop', profile=None, max_cost=None, queue=None):
+    """Split a CSV job into shards of distinct keywords and queue them. Returns the shard count."""
+    queue = queue or get_work_queue()
+    keyword_column, keywords = read_keywords(csv_file, limit)
+    distinct = list(dict.fromkeys(keywords))
+    shards = [distinct[start:start + SHARD_SIZE] for start in range(0, len(distinct), SHARD_SIZE)]
+    payload = {
+        'csv_file': csv_file,
+        'keyword_column': keyword_column,
+        'limit': limit,
+        'target_url': target_url,
+        'location_code': int(location_code),
+        'location_name': location_name or '',
+        'device': device,
+        'profile': profile,
+        'max_cost': max_cost,
+        'distinct_keywords': len(distinct),
+        'api_credentials': {'login': api_login, 'password': api_password}
+    }
+    queue.enqueue_job(job_id, payload, shards)
+    get_job_store().update_job(job_id, total_keywords=len(keywords))
+    print(f"Queued job {job_id}: {len(distinct)} keywords in {len(shards)} shards")
+    return len(shards)
+
+def get_client(payload):
+    credentials = payload.get('api_credentials') or {}
+    api_login = credentials.get('login') or os.environ.get('DATAFORSEO_LOGIN')
+    api_password = credentials.get('password') or os.environ.get('DATAFORSEO_PASSWORD')
+    try:
+        return make_client(api_login, api_password)
+    except ValueError:
+        raise ValueError("No API credentials in the job, DATAFORSEO_LOGIN/DATAFORSEO_PASSWORD or DATAFORSEO_ACCOUNTS")
+
+def get_shard_budget(queue, payload, shard):
+    """A shard's part of the job's max_cost, in proportion to its keywords, less what its earlier attempts spent.
+
+    Shards run in parallel on many workers, so each can only spend its own
+    part; handing every shard what is left of the whole budget would let N
+    running shards spend it N times.
+    """
+    max_cost = payload.get('max_cost')
+    if max_cost is None:
+        return None
+    total = payload.get('distinct_keywords') or queue.progress(shard['job_id'])['shards'] * len(shard['items'])
+    share = max_cost * len(shard['items']) / max(1, total)
+    return max(0.0, share - shard.get('cost', 0.0))
+
+def keep_alive(queue, shard, stop):
+    """Renew a shard's lease until stop is set or the lease is lost."""
+    while not stop.wait(VISIBILITY_TIMEOUT / 3):
+        if not queue.heartbeat(shard, VISIBILITY_TIMEOUT):
+            print(f"Lost lease on shard {shard['index']} of job {shard['job_id']}")
+            return
+
+def process_shard(queue, shard):
+    """Look up every keyword of a leased shard and store the results in the queue."""
+    from rank_checker import get_ranking
+    job_id = shard['job_id']
+    payload = queue.get_job_payload(job_id)
+    job_store = get_job_store()
+    job = job_store.get_job(job_id)
+    if job and job['status'] == STATUS_QUEUED:
+        job_store.start_job(job_id, total_keywords=job['total_keywords'])
+
+    cost_budget = CostBudget(get_shard_budget(queue, payload, shard))
+
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=keep_alive, args=(queue, shard, stop))
+    heartbeat.daemon = True
+    heartbeat.start()
+    try:
+        client = get_client(payload)
+        retry_budget = RetryBudget.for_keywords(len(shard['items']))
+        engine = get_fetch_engine()
+        futures = [
+            engine.submit(get_ranking, client, keyword, payload['target_url'], payload['location_code'],
+                          location_name=payload['location_name'], device=payload['device'],
+                          profile=payload['profile'], retry_budget=retry_budget, cost_budget=cost_budget,
+                          lane=LANE_BULK, job_key=job_id)
+            for keyword in shard['items']
+        ]
+        results = [(keyword, future.result()) for keyword, future in zip(shard['items'], futures)]
+    except Exception as e:
+        stop.set()
+        status = queue.fail(shard, str(e), MAX_ATTEMPTS, cost=cost_budget.get_state()['spent'])
+        print(f"Shard {shard['index']} of job {job_id} failed ({status}): {e}")
+        return False
+    finally:
+        stop.set()
+
+    if not queue.complete(shard, results, cost=cost_budget.get_state()['spent']):
+        # Another worker took the shard over after our lease expired; its result counts
+        print(f"Dropped result of shard {shard['index']} of job {job_id}: lease expired")
+        return False
+    try:
+        get_rank_history().record_results(payload['target_url'], payload['location_code'],
+                                          payload['location_name'], payload['device'], results)
+    except Exception as e:
+        print(f"Error recording rank history: {e}")
+    return True
+
+def update_job_progress(queue, job_id):
+    """Copy shard progress into the job record, and merge the results once every shard is finished."""
+    progress = queue.progress(job_id)
+    if progress is None:
+        return
+    job_store = get_job_store()
+    job = job_store.get_job(job_id)
+    # Shards hold distinct keywords; progress is reported against the CSV's row count
+    finished = (progress[SHARD_DONE] + progress[SHARD_FAILED]) / max(1, progress['shards'])
+    job_store.update_job(job_id, processed_keywords=round((job['total_keywords'] if job else 0) * finished),
+                         cost=round(progress['cost'], 6))
+    if queue.claim_aggregation(job_id):
+        aggregate_job(queue, job_id)
+
+def aggregate_job(queue, job_id):
+    """Write the merged shard results into the job's CSV file and finish the job."""
+    payload = queue.get_job_payload(job_id)
+    progress = queue.progress(job_id)
+    job_store = get_job_store()
+    error = None
+    try:
+        rankings = {keyword: ranking_info for keyword, ranking_info in queue.results(job_id)}
+        write_results_csv(payload['csv_file'], payload['keyword_column'], payload.get('limit'),
+                          payload['device'], rankings)
+        if progress['errors']:
+            error = f"{len(progress['errors'])} of {progress['shards']} shards failed: {progress['errors'][0]}"
+        elif any(value == BUDGET_EXCEEDED for value in rankings.values()):
+            error = f"Cost budget of ${payload['max_cost']} reached; remaining keywords were not checked."
+    except Exception as e:
+        error = f"Error aggregating results: {e}"
+    # Credentials are not needed once the job is finished
+    queue.finish_job(job_id, dict(payload, api_credentials=None))
+    job_store.update_job(job_id, processed_keywords=job_store.get_job(job_id)['total_keywords'])
+    job_store.finish_job(job_id, error=error)
+    try:
+        from uploads import get_upload_store
+        for upload in get_upload_store().list_uploads(job_id=job_id):
+            get_upload_store().refresh_size(upload['id'])
+    except Exception as e:
+        print(f"Error updating upload index: {e}")
+    print(f"Job {job_id} finished{': ' + error if error else ''}")
+
+def write_results_csv(csv_file, keyword_column, limit, device, rankings):
+    """Fill the ranking columns of a CSV file from a keyword -> ranking_info mapping."""
+    with open(csv_file, 'r') as file:
+        reader = csv.DictReader(file)
+        header = reader.fieldnames.copy() if reader.fieldnames else []
+        all_rows = list(reader)
+    for column in ['Ranking', 'Rank Group', 'Rank Absolute', 'Device']:
+        if column not in header:
+            header.append(column)
+    for row in all_rows[:limit] if limit else all_rows:
+        if row[keyword_column] not in rankings:
+            continue
+        ranking_info = rankings[row[keyword_column]]
+        if isinstance(ranking_info, dict):
+            row['Ranking'] = ranking_info.get('position', 'N/A')
+            row['Rank Group'] = ranking_info.get('rank_group', 'N/A')
+            row['Rank Absolute'] = ranking_info.get('rank_absolute', 'N/A')
+        else:
+            row['Ranking'] = ranking_info
+            row['Rank Group'] = 'N/A'
+            row['Rank Absolute'] = 'N/A'
+        row['Device'] = device
+    with open(csv_file, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=header)
+        writer.writeheader()
+        writer.writerows(all_rows)
+
+def run_worker(worker_id=None, concurrency=1, stop=None, queue=None):
+    """Lease and process shards until stop is set. Each of concurrency threads works on one shard at a time."""
+    queue = queue or get_work_queue()
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    stop = stop or threading.Event()
+
+    def work_loop():
+        while not stop.is_set():
+            try:
+                shard = queue.lease(worker_id, VISIBILITY_TIMEOUT)
+                if shard is None:
+                    stop.wait(POLL_INTERVAL)
+                    continue
+                if shard['attempts'] > MAX_ATTEMPTS:
+                    # The workers that leased it before stopped heartbeating, probably mid-crash
+                    queue.fail(shard, f"Lease expired {MAX_ATTEMPTS} times", MAX_ATTEMPTS)
+                else:
+                    print(f"[{worker_id}] Processing shard {shard['index']} of job {shard['job_id']} "
+                          f"({len(shard['items'])} keywords, attempt {shard['attempts']})")
+                    process_shard(queue, shard)
+                update_job_progress(queue, shard['job_id'])
+            except Exception as e:
+                print(f"[{worker_id}] Worker error: {e}")
+                stop.wait(POLL_INTERVAL)
+
+    threads = []
+    for index in range(max(1, concurrency)):
+        thread = threading.Thread(target=work_loop)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    print(f"Worker {worker_id} started with {len(threads)} thread(s)")
+    return threads
+
+def main():
+    args = sys.argv[1:]
+    concurrency = 1
+    if "--concurrency" in args:
+        index = args.index("--concurrency")
+        if index + 1 < len(args):
+            try:
+                concurrency = int(args[index + 1])
+            except ValueError:
+                print("Error: --concurrency must be a number")
+                sys.exit(1)
+    if "--help" in args:
+        print("Usage: python worker.py [--concurrency <threads>]")
+        return
+
+    stop = threading.Event()
+    threads = run_worker(concurrency=concurrency, stop=stop)
+    try:
+        while any(thread.is_alive() for thread in threads):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("Stopping worker; unfinished shards return to the queue when their leases expire")
+        stop.set()
+
+if __name__ == "__main__":
+    main()